@@ -0,0 +1,121 @@
+"""
+Import-time benchmark for the application's startup path.
+
+Runs `import main` in fresh interpreters with `python -X importtime` and
+reports how long it takes, which modules dominate, and whether any heavy
+module (cv2, numpy, pdf2image, pywifi) was imported eagerly.
+
+Usage:
+    python benchmarks/import_time.py [--runs 10] [--output result.json]
+                                     [--baseline previous.json] [--max-regression 0.2]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# Repository root (the directory containing main.py)
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that must stay out of the startup path
+HEAVY_MODULES = ["cv2", "numpy", "pdf2image", "pywifi"]
+
+# Prints which heavy modules ended up in sys.modules after importing main
+PROBE = (
+    "import sys, json, main; "
+    f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+)
+
+
+def run_once() -> Dict[str, Any]:
+    """
+    Imports main in a fresh interpreter and parses the -X importtime report.
+    Returns the wall time, the cumulative import times per module and the
+    heavy modules that were loaded.
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    cumulative: Dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        cumulative[name.strip()] = int(cumulative_us)
+
+    return {
+        "wall_s": wall,
+        "main_import_s": cumulative.get("main", 0) / 1e6,
+        "cumulative_us": cumulative,
+        "heavy_loaded": json.loads(proc.stdout.strip().splitlines()[-1]),
+    }
+
+
+def summarize(runs: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    """Builds the JSON report from several runs."""
+    main_times = [run["main_import_s"] for run in runs]
+    wall_times = [run["wall_s"] for run in runs]
+    last = runs[-1]["cumulative_us"]
+    slowest = sorted(
+        ((name, us) for name, us in last.items() if "." not in name),
+        key=lambda item: item[1], reverse=True
+    )[:top]
+
+    return {
+        "runs": len(runs),
+        "python": sys.version.split()[0],
+        "main_import_s": {
+            "median": statistics.median(main_times),
+            "min": min(main_times),
+            "max": max(main_times),
+        },
+        "process_wall_s": {
+            "median": statistics.median(wall_times),
+            "min": min(wall_times),
+        },
+        "slowest_top_level_imports_ms": {name: us / 1000 for name, us in slowest},
+        "heavy_modules_loaded": sorted({m for run in runs for m in run["heavy_loaded"]}),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the startup import time of main.py")
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh interpreters to run")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to report")
+    parser.add_argument("--output", type=Path, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", type=Path, help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative slowdown of the median against the baseline")
+    args = parser.parse_args()
+
+    report = summarize([run_once() for _ in range(args.runs)], args.top)
+    failed = bool(report["heavy_modules_loaded"])
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        before = baseline["main_import_s"]["median"]
+        after = report["main_import_s"]["median"]
+        report["baseline_median_s"] = before
+        report["regression"] = (after - before) / before if before else 0.0
+        failed = failed or report["regression"] > args.max_regression
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    print(output)
+
+    # A non-zero exit code lets CI or a nightly job flag the regression
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""
+End-to-end load test with concurrent surveyors and viewers.
+
+Starts `main:app` under uvicorn with the fake scan backend
+(HEATMAP_SCAN_BACKEND=fake), seeds a test map with scans, then drives a
+weighted mix of requests from concurrent clients for a fixed duration:
+
+- scan:    POST /scans/{map} at a random position, then wait for the job
+           to finish (the latency includes the time spent in the scan queue)
+- signal:  GET /maps/{map}/signal/{key}
+- channel: GET /maps/{map}/channel/{channel}
+- upload:  POST /plans/ with a new plan (deleted at the end)
+- page:    GET of an HTML page (home, lists, heatmap page)
+
+Reports the p50/p95/p99 latency and throughput of each route as JSON.
+Only the standard library is used on the client side. The test map and
+uploaded plans are removed when the run ends.
+
+Usage:
+    python benchmarks/load_test.py [--concurrency 8] [--duration 30]
+                                   [--mix scan=1,signal=4,channel=2,upload=0.1,page=2]
+                                   [--workers 1] [--output result.json]
+                                   [--baseline previous.json]
+"""
+import argparse
+import gzip
+import http.client
+import json
+import math
+import os
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from urllib.parse import quote
+
+# Repository root (the directory containing main.py)
+ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_MIX = "scan=1,signal=4,channel=2,upload=0.1,page=2"
+
+# One measured request: (route, latency in seconds, HTTP status or 0 on error)
+Sample = Tuple[str, float, int]
+
+
+def make_png(width: int, height: int) -> bytes:
+    """Builds a plain gray PNG plan without any imaging library."""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + b"\xc8" * (width * 3)  # Filter byte + RGB pixels
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(row * height, 6)) + chunk(b"IEND", b""))
+
+
+def multipart(filename: str, content: bytes, content_type: str) -> Tuple[bytes, str]:
+    """Encodes a single file field as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n").encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """A keep-alive HTTP connection to the server under test."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+
+    def request(self, method: str, path: str, body: bytes = None,
+                headers: Dict[str, str] = None) -> Tuple[int, bytes]:
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+            raise
+
+
+def start_server(port: int, workers: int, scan_delay: float) -> subprocess.Popen:
+    """Starts uvicorn with the fake scan backend and waits until it answers."""
+    env = dict(os.environ, HEATMAP_SCAN_BACKEND="fake", HEATMAP_FAKE_SCAN_DELAY=str(scan_delay))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            status, _ = Client(port).request("GET", "/")
+            if status == 200:
+                return server
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The server did not start within 60 seconds")
+
+
+def wait_job(client: Client, map_name: str, job_id: str) -> int:
+    """
+    Polls a scan job until it is finished.
+    Returns 200 if it succeeded, 500 if it failed.
+    """
+    while True:
+        status, content = client.request("GET", f"/scans/{quote(map_name)}/jobs/{job_id}")
+        if status != 200:
+            return status
+        job_status = json.loads(content)["status"]
+        if job_status in ("done", "error"):
+            return 200 if job_status == "done" else 500
+        time.sleep(0.05)
+
+
+def seed_map(client: Client, map_name: str, png: bytes, size: Tuple[int, int],
+             scans: int) -> Tuple[List[str], List[str]]:
+    """
+    Uploads the test map and scans it at random positions.
+    Returns the signal and channel keys available for rendering.
+    """
+    body, content_type = multipart(f"{map_name}.png", png, "image/png")
+    client.request("POST", "/plans/", body, {"Content-Type": content_type})
+
+    job_id = None
+    for index in range(scans):
+        position = json.dumps({"x": random.randrange(size[0]), "y": random.randrange(size[1])})
+        path = f"/scans/{quote(map_name)}" + ("?new_session=true" if index == 0 else "")
+        status, content = client.request("POST", path, position.encode(), {"Content-Type": "application/json"})
+        if status == 202:
+            job_id = json.loads(content)["job"]["id"]
+    # Jobs run in order: the scans are all saved once the last one is done
+    if job_id:
+        wait_job(client, map_name, job_id)
+
+    # The export bundle lists both kinds of layers in one request
+    status, content = client.request("GET", f"/save/{quote(map_name)}?format=bundle")
+    if status != 200:
+        raise RuntimeError(f"Seeding the test map failed (HTTP {status})")
+    signal_keys, channel_keys = set(), set()
+    for line in gzip.decompress(content).splitlines():
+        record = json.loads(line)
+        if record.get("type") == "signal":
+            signal_keys.add(record["key"])
+        elif record.get("type") == "channel":
+            channel_keys.add(record["key"])
+    return sorted(signal_keys), sorted(channel_keys)
+
+
+def run_client(port: int, map_name: str, size: Tuple[int, int], png: bytes, keys: Dict[str, List[str]],
+               mix: Dict[str, float], deadline: float, samples: List[Sample], uploads: List[str]) -> None:
+    """Sends requests picked from the mix until the deadline."""
+    client = Client(port)
+    routes, weights = list(mix), list(mix.values())
+    pages = ["/", "/plans/", "/scans/", "/maps/", f"/maps/{quote(map_name)}"]
+
+    while time.monotonic() < deadline:
+        route = random.choices(routes, weights)[0]
+        body, headers = None, {}
+        if route == "scan":
+            method, path = "POST", f"/scans/{quote(map_name)}"
+            body = json.dumps({"x": random.randrange(size[0]), "y": random.randrange(size[1])}).encode()
+            headers = {"Content-Type": "application/json"}
+        elif route == "signal":
+            method, path = "GET", f"/maps/{quote(map_name)}/signal/{quote(random.choice(keys['signal']))}"
+        elif route == "channel":
+            method, path = "GET", f"/maps/{quote(map_name)}/channel/{quote(random.choice(keys['channel']))}"
+        elif route == "upload":
+            name = f"{map_name}-upload-{uuid.uuid4().hex[:8]}"
+            uploads.append(name)
+            body, content_type = multipart(f"{name}.png", png, "image/png")
+            method, path, headers = "POST", "/plans/", {"Content-Type": content_type}
+        else:
+            method, path = "GET", random.choice(pages)
+
+        start = time.perf_counter()
+        try:
+            status, content = client.request(method, path, body, headers)
+            if route == "scan" and status == 202:
+                status = wait_job(client, map_name, json.loads(content)["job"]["id"])
+        except (OSError, http.client.HTTPException):
+            status = 0
+        samples.append((route, time.perf_counter() - start, status))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(samples: List[Sample], duration: float) -> Dict[str, Any]:
+    """Builds the per-route and overall statistics of a run."""
+    by_route: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_route.setdefault(sample[0], []).append(sample)
+    by_route["total"] = samples
+
+    report = {}
+    for route, route_samples in sorted(by_route.items()):
+        latencies = sorted(latency * 1000 for _, latency, _ in route_samples)
+        report[route] = {
+            "requests": len(route_samples),
+            # Redirects are the normal answer of uploads
+            "errors": sum(1 for _, _, status in route_samples if not 200 <= status < 400),
+            "throughput_rps": len(route_samples) / duration,
+            "latency_ms": {
+                "p50": percentile(latencies, 0.50),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "mean": statistics.fmean(latencies),
+                "max": latencies[-1],
+            },
+        }
+    return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Relative change of p95 latency and throughput against a previous report."""
+    changes = {}
+    for route, stats in report["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        changes[route] = {
+            "p95_change": stats["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1,
+            "throughput_change": stats["throughput_rps"] / before["throughput_rps"] - 1,
+        }
+    return changes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the heatmap server with a fake scan backend")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Measured duration, in seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of the routes")
+    parser.add_argument("--workers", type=int, default=1, help="Number of uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the server under test")
+    parser.add_argument("--plan-size", default="1600x1000", help="Size of the test plan (WxH)")
+    parser.add_argument("--seed-scans", type=int, default=40, help="Scans made before the measure")
+    parser.add_argument("--scan-delay", type=float, default=0.5, help="Duration of a fake scan, in seconds")
+    parser.add_argument("--output", type=Path, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", type=Path, help="Previous JSON report to compare against")
+    args = parser.parse_args()
+
+    mix = {route: float(weight) for route, weight in (item.split("=") for item in args.mix.split(","))}
+    unknown = set(mix) - {"scan", "signal", "channel", "upload", "page"}
+    if unknown:
+        parser.error(f"Unknown routes in --mix: {', '.join(sorted(unknown))}")
+    size = tuple(int(v) for v in args.plan_size.lower().split("x"))
+    png = make_png(*size)
+    map_name = f"loadtest-{os.getpid()}"
+
+    server = start_server(args.port, args.workers, args.scan_delay)
+    setup = Client(args.port)
+    samples: List[Sample] = []
+    uploads: List[str] = []
+    try:
+        signal_keys, channel_keys = seed_map(setup, map_name, png, size, args.seed_scans)
+        keys = {"signal": signal_keys, "channel": channel_keys}
+
+        deadline = time.monotonic() + args.duration
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=run_client,
+                             args=(args.port, map_name, size, png, keys, mix, deadline, samples, uploads))
+            for _ in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        # Remove everything the run created, then stop the server
+        # (on a new connection: the setup one may have timed out while idle)
+        cleanup = Client(args.port)
+        for name in [map_name] + uploads:
+            try:
+                cleanup.request("DELETE", f"/plans/{quote(name)}")
+            except (OSError, http.client.HTTPException):
+                pass
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "concurrency": args.concurrency,
+        "duration_s": elapsed,
+        "workers": args.workers,
+        "mix": mix,
+        "plan_size": list(size),
+        "python": sys.version.split()[0],
+        "routes": summarize(samples, elapsed),
+    }
+    if args.baseline:
+        report["baseline"] = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")))
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
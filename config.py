@@ -1,13 +1,16 @@
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import os
 import sys
-import pywifi
 import subprocess
-from typing import Optional
+from functools import lru_cache
+from typing import Any, Literal, Optional
 
 # Initialize Jinja2 for HTML templates
 template = Jinja2Templates(directory="templates")
+# Translations are read-only mappings (see html_handler): let |tojson serialize them
+template.env.policies["json.dumps_kwargs"] = {"sort_keys": True, "default": dict}
 
 # --- Path Configuration ---
 # Determine the base directory of the application
@@ -25,6 +28,43 @@ MAPS_ALLOWED_EXTENSIONS = [".png", ".jpg", ".jpeg", ".pdf"]
 # Define extensions that are checked for existing maps
 MAPS_POSSIBLE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
 
+# --- Upload Limits ---
+# Maximum accepted size for uploaded map files (images and PDFs), in bytes
+MAPS_MAX_UPLOAD_SIZE = int(os.environ.get("HEATMAP_MAPS_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+# Maximum accepted size for uploaded scan data files, in bytes
+DATA_MAX_UPLOAD_SIZE = int(os.environ.get("HEATMAP_DATA_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+# Maximum decompressed size of an imported survey bundle, in bytes
+DATA_MAX_DECOMPRESSED_SIZE = 10 * DATA_MAX_UPLOAD_SIZE
+# Maximum accepted size for uploaded archives of every map (see /archive), in bytes
+ARCHIVE_MAX_UPLOAD_SIZE = int(os.environ.get("HEATMAP_ARCHIVE_MAX_UPLOAD_MB", "2048")) * 1024 * 1024
+# Uploads are streamed to disk in chunks of this size (bytes)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Largest working copy of a plan, in pixels: bigger uploads are downscaled
+# (the original is kept in ORIGINALS_DIR)
+MAPS_MAX_PIXELS = int(float(os.environ.get("HEATMAP_MAPS_MAX_MEGAPIXELS", "12")) * 1_000_000)
+
+# --- Scan Data ---
+# Name of the measured value in the points of each kind of layer
+VALUE_FIELDS = {"signal": "signal", "channel": "count", "ap": "signal"}
+# Default color range of each kind of layer: dBm for signal, AP count for channel
+VALUE_RANGES = {"signal": (-90, -30), "channel": (0, 20), "congestion": (0, 50), "ap": (-90, -30)}
+# Default radius (px) of the disk drawn around each scan point
+RADIUS = 30
+# Default standard deviation (px) of the Gaussian blur smoothing the disks
+SIGMA = 30
+# Memory budget of the cache of computed heatmap fields, in bytes
+FIELD_CACHE_BYTES = int(os.environ.get("HEATMAP_FIELD_CACHE_MB", "512")) * 1024 * 1024
+# Memory kept for reuse by the render pipeline's scratch buffers, in bytes
+BUFFER_POOL_BYTES = int(os.environ.get("HEATMAP_BUFFER_POOL_MB", "256")) * 1024 * 1024
+# Scan backend: "system" (pywifi/netsh or iw) or "fake" (generated results, for load tests)
+SCAN_BACKEND = os.environ.get("HEATMAP_SCAN_BACKEND", "system")
+# Simulated duration of a fake scan, in seconds
+FAKE_SCAN_DELAY = float(os.environ.get("HEATMAP_FAKE_SCAN_DELAY", "0.5"))
+# Maximum number of scan jobs waiting for the Wi-Fi interface (further clicks are refused)
+SCAN_QUEUE_MAX = int(os.environ.get("HEATMAP_SCAN_QUEUE_MAX", "50"))
+# Generated heatmap images older than this (seconds) are deleted by later renders
+GENERATED_MAX_AGE = int(os.environ.get("HEATMAP_GENERATED_MAX_AGE", "600"))
+
 # Define all primary directories
 MAPS_DIR = BASE_DIR / "static/maps"
 SIGNAL_DIR = BASE_DIR / "static/data/signal"
@@ -32,11 +72,37 @@ DATA_DIR = BASE_DIR / "static/data"
 CHANNEL_DIR = BASE_DIR / "static/data/channel"
 LANG_DIR = BASE_DIR / "languages"
 GENERATED_DIR = BASE_DIR / "static/generated"
+# Lock files used to serialize writes to a map's data across processes
+LOCK_DIR = BASE_DIR / "static/data/locks"
+# Archived survey sessions, one sub-directory per map
+SESSIONS_DIR = BASE_DIR / "static/data/sessions"
+# Uploaded plans as received, with their normalization metadata
+ORIGINALS_DIR = BASE_DIR / "static/data/originals"
+# Every BSSID seen by the scans of each map (compact store, see ap_handler)
+AP_DIR = BASE_DIR / "static/data/aps"
+# State of the scan jobs, shared by the worker processes (see job_handler)
+JOBS_DIR = BASE_DIR / "static/data/jobs"
+
+# Storage of the current surveys: "json" (one signal and one channel file per map)
+# or "sqlite" (indexed table in DB_PATH, WAL mode). JSON stays the import/export format.
+STORAGE_BACKEND = os.environ.get("HEATMAP_STORAGE", "json")
+DB_PATH = BASE_DIR / "static/data/scans.db"
+
+# Number of uvicorn worker processes started by "python main.py"
+WORKERS = int(os.environ.get("HEATMAP_WORKERS", "1"))
+# Number of render processes per server worker (0 renders in the request's thread)
+RENDER_PROCESSES = int(os.environ.get("HEATMAP_RENDER_PROCESSES", "0"))
+
+# --- Page Rendering ---
+# Reload translation files when they change on disk (development only)
+DEV_RELOAD = os.environ.get("HEATMAP_DEV_RELOAD", "0") == "1"
+# Maximum number of rendered HTML pages kept in memory
+PAGE_CACHE_SIZE = 64
 
 # Ensure all data directories exist on startup
 GENERATED_DIR.mkdir(parents=True, exist_ok=True)
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-for path in [MAPS_DIR, SIGNAL_DIR, CHANNEL_DIR]:
+for path in [MAPS_DIR, SIGNAL_DIR, CHANNEL_DIR, LOCK_DIR, SESSIONS_DIR, ORIGINALS_DIR, AP_DIR, JOBS_DIR]:
     path.mkdir(parents=True, exist_ok=True)
 
 # --- Pydantic Model ---
@@ -49,6 +115,26 @@ class ClickPosition(BaseModel):
     x: int
     y: int
 
+
+# OpenCV color maps offered by the heatmap endpoints and page
+COLORMAPS = ("turbo", "jet", "viridis", "inferno", "plasma", "hot")
+
+
+class HeatmapParams(BaseModel):
+    """
+    Pydantic model of the optional rendering parameters of the heatmap endpoints.
+
+    `radius` and `sigma` shape the field and are part of its cache key.
+    The others only change the color and blend stage, so changing them
+    never recomputes a field.
+    """
+    radius: int = Field(RADIUS, ge=1, le=300)  # Disk radius around each scan (px)
+    sigma: float = Field(SIGMA, gt=0, le=300)  # Gaussian blur standard deviation (px)
+    min_value: Optional[float] = None  # Value mapped to the bottom of the color map
+    max_value: Optional[float] = None  # Value mapped to the top of the color map
+    colormap: Literal[COLORMAPS] = "turbo"
+    alpha: float = Field(0.6, ge=0, le=1)  # Weight of the heatmap in the blend
+
 # --- OS-Specific Wi-Fi Interface Configuration ---
 
 def get_wifi_interface_linux() -> Optional[str]:
@@ -67,18 +153,30 @@ def get_wifi_interface_linux() -> Optional[str]:
     return None
 
 
-# Determine the operating system and find the Wi-Fi interface
+# Determine the operating system (cheap, done at import time)
 if sys.platform.startswith("win"):
     SYS = "Windows"
-    try:
-        # On Windows, use pywifi to get the interface
-        WIFI_INTERFACE = pywifi.PyWiFi().interfaces()[0]
-    except Exception:
-        WIFI_INTERFACE = None
 elif sys.platform.startswith("linux"):
     SYS = "Linux"
-    # On Linux, use our helper function
-    WIFI_INTERFACE = get_wifi_interface_linux()
 else:
     SYS = "Unknown"
-    WIFI_INTERFACE = None
\ No newline at end of file
+
+
+@lru_cache(maxsize=None)
+def get_wifi_interface() -> Optional[Any]:
+    """
+    Finds the Wi-Fi interface to scan with.
+    Probing the hardware is slow, so it is deferred to the first scan
+    instead of running at startup. The result is cached afterwards.
+    """
+    if SYS == "Windows":
+        try:
+            # On Windows, use pywifi to get the interface
+            import pywifi
+            return pywifi.PyWiFi().interfaces()[0]
+        except Exception:
+            return None
+    if SYS == "Linux":
+        # On Linux, use our helper function
+        return get_wifi_interface_linux()
+    return None
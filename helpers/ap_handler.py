@@ -0,0 +1,229 @@
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import AP_DIR
+from helpers.import_handler import lazy_module
+from helpers.lock_handler import map_file_lock, read_json_checked, write_bytes_atomic
+
+# NumPy is imported on first use, not at startup
+np = lazy_module("numpy")
+
+# Compact store of every BSSID seen by every scan of a map:
+# - "keys":   table of "SSID [Band]" strings
+# - "bssids": table of BSSID strings
+# - "scan_x", "scan_y": position of each scan
+# - "scan", "key", "bssid", "signal": one entry per sample (AP seen by a scan),
+#   referencing the scan and the two string tables by index
+APStore = Dict[str, List[Any]]
+
+COLUMNS = ("keys", "bssids", "scan_x", "scan_y", "scan", "key", "bssid", "signal")
+
+
+def _store_path(map_name: str) -> Path:
+    return AP_DIR / f"{map_name}.jsonl"
+
+
+def _encode(store: APStore) -> bytes:
+    """One line of the store file: compact JSON of some columns, newline terminated."""
+    return json.dumps(store, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def load_store(file_path: Path) -> APStore:
+    """
+    Reads a store file: each line holds the columns added by one write
+    (string table entries included), so the store is their concatenation.
+    A last line without its newline is an append interrupted by a crash: it is ignored.
+    """
+    store: APStore = {column: [] for column in COLUMNS}
+    with open(file_path, "rb") as f:
+        lines = f.read().split(b"\n")
+    for line in lines[:-1]:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("AP store lines must be JSON objects")
+        for column in COLUMNS:
+            store[column].extend(record.get(column, []))
+    return store
+
+
+def read_store(map_name: str) -> APStore:
+    """
+    Returns a map's AP store (empty columns if it has none).
+    Must be called while holding the map's file lock.
+    """
+    store = read_json_checked(_store_path(map_name), loader=load_store)
+    return {column: store.get(column, []) for column in COLUMNS}
+
+
+def write_store(map_name: str, store: APStore) -> None:
+    """
+    Replaces a map's AP store (a single line of compact JSON).
+    Must be called while holding the map's file lock.
+    """
+    write_bytes_atomic(_store_path(map_name), _encode(store))
+
+
+def delete_store(map_name: str) -> None:
+    """Deletes a map's AP store."""
+    with map_file_lock(map_name):
+        _store_path(map_name).unlink(missing_ok=True)
+
+
+def append_scan(map_name: str, x: int, y: int, networks: List[Dict[str, Any]]) -> None:
+    """
+    Adds every network seen by one scan to the map's AP store.
+    SSIDs and BSSIDs are interned, so each sample costs four small numbers.
+    The scan is appended as one line: the file is never rewritten.
+    """
+    with map_file_lock(map_name):
+        store = read_store(map_name)
+        keys = {key: i for i, key in enumerate(store["keys"])}
+        bssids = {bssid: i for i, bssid in enumerate(store["bssids"])}
+
+        scan = len(store["scan_x"])
+        record: APStore = {column: [] for column in COLUMNS}
+        record["scan_x"].append(x)
+        record["scan_y"].append(y)
+        for network in networks:
+            key = f"{network['ssid']} [{network['band']}]"
+            bssid = str(network["bssid"])
+            if key not in keys:
+                keys[key] = len(keys)
+                record["keys"].append(key)
+            if bssid not in bssids:
+                bssids[bssid] = len(bssids)
+                record["bssids"].append(bssid)
+            record["scan"].append(scan)
+            record["key"].append(keys[key])
+            record["bssid"].append(bssids[bssid])
+            record["signal"].append(float(network["signal"]))
+
+        with open(_store_path(map_name), "a+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # Drop the partial line of an append interrupted by a crash
+                    f.seek(0)
+                    f.truncate(f.read().rfind(b"\n") + 1)
+            f.write(_encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _arrays(store: APStore) -> Tuple[np.ndarray, ...]:
+    return (np.asarray(store["scan"], dtype=np.int64), np.asarray(store["key"], dtype=np.int64),
+            np.asarray(store["bssid"], dtype=np.int64), np.asarray(store["signal"], dtype=np.float64))
+
+
+def best_samples(scan: np.ndarray, key: np.ndarray, signal: np.ndarray) -> np.ndarray:
+    """
+    Vectorized group-by max: returns the indices of the strongest sample of
+    each (scan, SSID key) group, i.e. the "best BSSID per SSID" view.
+    """
+    if len(scan) == 0:
+        return np.zeros(0, dtype=np.int64)
+    group = scan * (int(key.max()) + 1) + key
+    # Sort by group, then by signal: the last sample of each group is its maximum
+    order = np.lexsort((signal, group))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = group[order][1:] != group[order][:-1]
+    return order[last]
+
+
+def best_points(map_name: str, key: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Returns the scans of a map as signal layers: the strongest BSSID of each
+    SSID key per scan, computed from the AP store (see best_layers).
+    With `key`, only that layer is computed.
+    """
+    with map_file_lock(map_name):
+        store = read_store(map_name)
+    return best_layers(store, key)
+
+
+def best_layers(store: APStore, key: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Turns an AP store into signal layers with best_samples: one point per
+    scan and SSID key, for its strongest BSSID. With `key`, only that layer.
+    """
+    scan, key_index, bssid, signal = _arrays(store)
+    if key is not None:
+        if key not in store["keys"]:
+            return {}
+        selected = np.flatnonzero(key_index == store["keys"].index(key))
+        scan, key_index, bssid, signal = scan[selected], key_index[selected], bssid[selected], signal[selected]
+
+    layers: Dict[str, List[Dict[str, Any]]] = {}
+    scan_x, scan_y = store["scan_x"], store["scan_y"]
+    # In scan order, like the points of a signal file
+    for i in np.sort(best_samples(scan, key_index, signal)):
+        layers.setdefault(store["keys"][key_index[i]], []).append(
+            {"bssid": store["bssids"][bssid[i]], "signal": float(signal[i]),
+             "x": scan_x[scan[i]], "y": scan_y[scan[i]]})
+    return layers
+
+
+def list_keys(map_name: str) -> List[str]:
+    """Returns the "SSID [Band]" keys seen by the scans of a map."""
+    with map_file_lock(map_name):
+        return read_store(map_name)["keys"]
+
+
+def ap_points(map_name: str, bssid: str) -> List[Dict[str, Any]]:
+    """
+    Returns the samples of one BSSID as signal points (a per-AP layer).
+    """
+    with map_file_lock(map_name):
+        store = read_store(map_name)
+    if bssid not in store["bssids"]:
+        return []
+
+    scan, _, bssid_index, signal = _arrays(store)
+    selected = np.flatnonzero(bssid_index == store["bssids"].index(bssid))
+    scan_x, scan_y = store["scan_x"], store["scan_y"]
+    return [{"bssid": bssid, "signal": float(signal[i]), "x": scan_x[scan[i]], "y": scan_y[scan[i]]}
+            for i in selected]
+
+
+def ap_summary(map_name: str) -> List[Dict[str, Any]]:
+    """
+    Lists every BSSID of a map with its SSID key, its number of samples, its
+    mean signal, and how many scans saw it as the best AP of its SSID
+    (useful to see where clients would roam from one AP to another).
+    """
+    with map_file_lock(map_name):
+        store = read_store(map_name)
+    scan, key, bssid, signal = _arrays(store)
+    if len(scan) == 0:
+        return []
+
+    count = np.bincount(bssid, minlength=len(store["bssids"]))
+    total = np.bincount(bssid, weights=signal, minlength=len(store["bssids"]))
+    best = np.bincount(bssid[best_samples(scan, key, signal)], minlength=len(store["bssids"]))
+    # Key of each BSSID: the one of its first sample
+    first = np.zeros(len(store["bssids"]), dtype=np.int64)
+    seen, first_sample = np.unique(bssid, return_index=True)
+    first[seen] = key[first_sample]
+
+    return sorted((
+        {
+            "bssid": name,
+            "key": store["keys"][first[i]],
+            "samples": int(count[i]),
+            "mean_signal": round(float(total[i] / count[i]), 1),
+            "best": int(best[i]),
+        }
+        for i, name in enumerate(store["bssids"]) if count[i]
+    ), key=lambda ap: (ap["key"], -ap["best"]))
+
+
+def data_version(map_name: str) -> Tuple[int, int]:
+    """Cheap version stamp (mtime, size) of a map's AP store."""
+    try:
+        stat = _store_path(map_name).stat()
+    except OSError:
+        return 0, 0
+    return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,386 @@
+import hashlib
+import json
+import re
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from fastapi.responses import StreamingResponse
+from config import MAPS_DIR, SIGNAL_DIR, ORIGINALS_DIR, MAPS_ALLOWED_EXTENSIONS, MAPS_POSSIBLE_EXTENSIONS, \
+    MAPS_MAX_UPLOAD_SIZE, DATA_MAX_UPLOAD_SIZE, MAPS_MAX_PIXELS, UPLOAD_CHUNK_SIZE
+from helpers.catalog_handler import map_catalog
+from helpers.data_handler import read_survey, write_survey, delete_signal, delete_channel
+from helpers.export_handler import BundleError, iter_bundle, read_bundle
+from helpers.file_handler import plan_metadata_path
+from helpers.heatmap_handler import write_plan_sidecar
+from helpers.lock_handler import map_file_lock, write_json_atomic
+from helpers import ap_handler
+from helpers.upload_handler import copy_to_temp, commit_upload, UploadTooLargeError
+from helpers.import_handler import lazy_module
+
+# Pillow checks the imported plans
+PIL_Image = lazy_module("PIL.Image")
+
+# Identification of the archive format
+ARCHIVE_FORMAT = "heatmap-archive"
+ARCHIVE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Largest manifest and plan metadata files accepted on import (bytes)
+MAX_MANIFEST_SIZE = 4 * 1024 * 1024
+MAX_METADATA_SIZE = 64 * 1024
+# Maps imported at the same time
+IMPORT_WORKERS = 4
+
+# Members of each map in the archive, under "{map_name}/"
+# (the plan and the original keep their extension)
+PLAN_MEMBER = "plan"
+METADATA_MEMBER = "plan.json"
+SURVEY_MEMBER = "survey.heatmap.gz"
+
+# Same rule as the plan uploads: a plain file name, no hidden files
+_NAME_PATTERN = re.compile(r"^[^/\\:\x00]{1,200}$")
+
+
+class ArchiveError(ValueError):
+    """
+    Raised when an imported archive is malformed or fails verification.
+    """
+
+
+# --- Export ---
+
+class _ChunkSink:
+    """
+    Write-only, unseekable file that keeps what is written until it is taken.
+    zipfile then writes data descriptors after each member instead of seeking
+    back, so the archive can be streamed as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _file_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _map_members(name: str) -> Iterator[Tuple[str, str, Any]]:
+    """
+    Yields the (kind, member name, source) of each file of a map: the plan and
+    its original upload and metadata as paths, the survey as a bundle iterator.
+    """
+    entry = map_catalog.get(name)
+    if entry is None:
+        # Deleted since the export started: left out like a map that fails to read
+        raise FileNotFoundError(f"Map {name} no longer exists")
+    yield "plan", f"{name}/{PLAN_MEMBER}{entry.path.suffix.lower()}", entry.path
+
+    metadata_path = plan_metadata_path(name)
+    if metadata_path.exists():
+        metadata = json.loads(metadata_path.read_text(encoding="utf-8"))
+        # Only the map's own original upload, "{name}{ext}" in ORIGINALS_DIR
+        original = (ORIGINALS_DIR / str(metadata.get("original", ""))).resolve()
+        if original.parent == ORIGINALS_DIR.resolve() and original.stem == name \
+                and original.suffix.lower() in MAPS_ALLOWED_EXTENSIONS and original.is_file():
+            yield "original", f"{name}/original{original.suffix.lower()}", original
+        yield "metadata", f"{name}/{METADATA_MEMBER}", metadata_path
+
+    if entry.has_signal or entry.has_channel:
+        # Read both kinds under the lock so they come from the same scan
+        with map_file_lock(name):
+            signal = read_survey(name, "signal")
+            channel = read_survey(name, "channel")
+        yield "survey", f"{name}/{SURVEY_MEMBER}", iter_bundle(name, signal, channel, entry.scale)
+
+
+def iter_archive() -> Iterator[bytes]:
+    """
+    Yields a zip archive of every plan and its scan data, chunk by chunk.
+
+    Nothing is built in memory: each file is copied into the archive in
+    chunks of UPLOAD_CHUNK_SIZE and the bytes are yielded as they are
+    produced. Plans and bundles are already compressed, so members are
+    stored as is. The manifest comes last, with the size and SHA-256 of
+    every member, computed while streaming them.
+    """
+    sink = _ChunkSink()
+    manifest: Dict[str, Any] = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION,
+                                "created": int(time.time()), "maps": {}}
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for entry in map_catalog.all():
+            files: Dict[str, Dict[str, Any]] = {}
+            try:
+                for kind, member, source in _map_members(entry.name):
+                    if isinstance(source, Path):
+                        info = zipfile.ZipInfo.from_file(source, member)  # Sets the size for ZIP64
+                        chunks = _file_chunks(source)
+                    else:
+                        info = zipfile.ZipInfo(member, time.localtime()[:6])
+                        chunks = source
+
+                    checksum = hashlib.sha256()
+                    size = 0
+                    with archive.open(info, "w") as out:
+                        for chunk in chunks:
+                            checksum.update(chunk)
+                            size += len(chunk)
+                            out.write(chunk)
+                            yield sink.take()
+                    files[kind] = {"path": member, "size": size, "sha256": checksum.hexdigest()}
+            except OSError as e:
+                # The map changed while it was exported: leave it out of the manifest
+                print(f"Error exporting map {entry.name}: {e}")
+                continue
+            manifest["maps"][entry.name] = {"files": files}
+
+        archive.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.take()
+
+
+def export_archive() -> StreamingResponse:
+    """
+    Streams every map and its scan data as a zip download.
+    """
+    filename = f"heatmap-archive-{time.strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        iter_archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+# --- Import ---
+
+def _check_file(name: str, kind: str, info: Any) -> Dict[str, Any]:
+    if not isinstance(info, dict) or not isinstance(info.get("path"), str) \
+            or not isinstance(info.get("size"), int) or not isinstance(info.get("sha256"), str):
+        raise ArchiveError(f"Invalid {kind} entry for map {name!r}")
+
+    expected = {
+        "plan": [f"{name}/{PLAN_MEMBER}{ext}" for ext in MAPS_POSSIBLE_EXTENSIONS],
+        "metadata": [f"{name}/{METADATA_MEMBER}"],
+        "survey": [f"{name}/{SURVEY_MEMBER}"],
+        "original": [f"{name}/original{ext}" for ext in MAPS_ALLOWED_EXTENSIONS],
+    }.get(kind)
+    if expected is None:
+        raise ArchiveError(f"Unknown file kind {kind!r} for map {name!r}")
+    if info["path"] not in expected:
+        raise ArchiveError(f"Unexpected member {info['path']!r} for map {name!r}")
+    return info
+
+
+def read_manifest(archive_path: Path) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Reads and validates the manifest of an uploaded archive.
+    Returns {map_name: {kind: {"path", "size", "sha256"}}}; every listed
+    member must exist in the archive with the listed size.
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            try:
+                info = archive.getinfo(MANIFEST_NAME)
+            except KeyError:
+                raise ArchiveError("Not a heatmap archive: the manifest is missing")
+            if info.file_size > MAX_MANIFEST_SIZE:
+                raise ArchiveError("Manifest is too large")
+            manifest = json.loads(archive.read(info))
+            sizes = {member.filename: member.file_size for member in archive.infolist()}
+    except (zipfile.BadZipFile, OSError, EOFError) as e:
+        raise ArchiveError(f"Corrupted archive: {e}")
+    except json.JSONDecodeError as e:
+        raise ArchiveError(f"Invalid manifest: {e}")
+
+    if not isinstance(manifest, dict) or manifest.get("format") != ARCHIVE_FORMAT:
+        raise ArchiveError("Not a heatmap archive")
+    if manifest.get("version") != ARCHIVE_VERSION:
+        raise ArchiveError(f"Unsupported archive version {manifest.get('version')!r}")
+    maps = manifest.get("maps")
+    if not isinstance(maps, dict):
+        raise ArchiveError("The manifest does not list any map")
+
+    plans: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for name, content in maps.items():
+        if not _NAME_PATTERN.match(name) or name.startswith(".") or name != name.strip():
+            raise ArchiveError(f"Invalid map name {name!r}")
+        files = content.get("files") if isinstance(content, dict) else None
+        if not isinstance(files, dict) or "plan" not in files:
+            raise ArchiveError(f"Map {name!r} has no plan")
+        plans[name] = {kind: _check_file(name, kind, info) for kind, info in files.items()}
+        for info in plans[name].values():
+            if sizes.get(info["path"]) != info["size"]:
+                raise ArchiveError(f"Member {info['path']!r} is missing or has the wrong size")
+    return plans
+
+
+def _check_metadata(name: str, metadata: Any) -> Dict[str, Any]:
+    """
+    Keeps the known keys of an imported plan's metadata, with checked types.
+    "original" is dropped: it is set again when the original is imported.
+    """
+    if not isinstance(metadata, dict):
+        raise ArchiveError(f"Invalid metadata for map {name!r}")
+    clean: Dict[str, Any] = {}
+    if "sha256" in metadata:
+        if not isinstance(metadata["sha256"], str) or not re.fullmatch(r"[0-9a-f]{64}", metadata["sha256"]):
+            raise ArchiveError(f"Invalid checksum in the metadata of map {name!r}")
+        clean["sha256"] = metadata["sha256"]
+    for key in ("original_size", "size"):
+        if key in metadata:
+            size = metadata[key]
+            if not isinstance(size, list) or len(size) != 2 \
+                    or not all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in size):
+                raise ArchiveError(f"Invalid {key} in the metadata of map {name!r}")
+            clean[key] = size
+    if "scale" in metadata:
+        scale = metadata["scale"]
+        if isinstance(scale, bool) or not isinstance(scale, (int, float)) or not 0 < scale < float("inf"):
+            raise ArchiveError(f"Invalid scale in the metadata of map {name!r}")
+        clean["scale"] = float(scale)
+    return clean
+
+
+def _extract(archive: zipfile.ZipFile, info: Dict[str, Any], directory: Path, max_size: int) -> Path:
+    """
+    Streams one member into a temporary file in `directory` (the directory
+    of its destination, so it can be renamed into place) and checks its
+    SHA-256 against the manifest. zipfile checks the CRC as it reads.
+    """
+    with archive.open(info["path"]) as member:
+        tmp_path, checksum = copy_to_temp(member, info["path"], directory, max_size)
+    if checksum != info["sha256"]:
+        tmp_path.unlink(missing_ok=True)
+        raise ArchiveError(f"Checksum mismatch for {info['path']!r}")
+    return tmp_path
+
+
+def _import_map(archive_path: Path, name: str, files: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Imports one map of an archive: every file is extracted and verified
+    before anything is moved into place, then the plan, its original and
+    metadata, and the survey are committed. The map's previous scan data
+    is replaced, even by an archive without a survey.
+    """
+    staged: List[Path] = []
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            # 1. Extract and verify the plan, and check that it is a usable image
+            plan_tmp = _extract(archive, files["plan"], MAPS_DIR, MAPS_MAX_UPLOAD_SIZE)
+            staged.append(plan_tmp)
+            plan_ext = Path(files["plan"]["path"]).suffix
+            with PIL_Image.open(plan_tmp) as image:
+                if image.format not in ("PNG", "JPEG") or image.width * image.height > MAPS_MAX_PIXELS:
+                    raise ArchiveError(f"Plan of map {name!r} is not a valid working copy")
+
+            # 2. The original upload and its metadata
+            original_tmp = metadata = None
+            if "metadata" in files:
+                metadata_tmp = _extract(archive, files["metadata"], ORIGINALS_DIR, MAX_METADATA_SIZE)
+                staged.append(metadata_tmp)
+                metadata = _check_metadata(name, json.loads(metadata_tmp.read_text(encoding="utf-8")))
+            if "original" in files:
+                original_tmp = _extract(archive, files["original"], ORIGINALS_DIR, MAPS_MAX_UPLOAD_SIZE)
+                staged.append(original_tmp)
+
+            # 3. The survey, validated record by record
+            signal = channel = None
+            if "survey" in files:
+                survey_tmp = _extract(archive, files["survey"], SIGNAL_DIR, DATA_MAX_UPLOAD_SIZE)
+                staged.append(survey_tmp)
+                with open(survey_tmp, "rb") as f:
+                    signal, channel = read_bundle(f)
+    except (zipfile.BadZipFile, OSError, EOFError, UploadTooLargeError, json.JSONDecodeError,
+            PIL_Image.UnidentifiedImageError, PIL_Image.DecompressionBombError) as e:
+        for path in staged:
+            path.unlink(missing_ok=True)
+        raise ArchiveError(f"Invalid files for map {name!r}: {e}")
+    except BaseException:
+        for path in staged:
+            path.unlink(missing_ok=True)
+        raise
+
+    # 4. Everything is valid: move the files into place
+    try:
+        if original_tmp is not None:
+            original_name = f"{name}{Path(files['original']['path']).suffix}"
+            commit_upload(original_tmp, ORIGINALS_DIR / original_name)
+            if metadata is not None:
+                metadata["original"] = original_name
+        if metadata is not None:
+            write_json_atomic(plan_metadata_path(name), metadata)
+        commit_upload(plan_tmp, MAPS_DIR / f"{name}{plan_ext}")
+        # A replaced plan may have had another extension
+        for ext in MAPS_POSSIBLE_EXTENSIONS:
+            if ext != plan_ext:
+                (MAPS_DIR / f"{name}{ext}").unlink(missing_ok=True)
+        # The survey replaces the map's whole scan data, APs included
+        with map_file_lock(name):
+            for kind, data, delete in (("signal", signal, delete_signal), ("channel", channel, delete_channel)):
+                if data:
+                    write_survey(name, kind, data)
+                else:
+                    delete(name)
+            ap_handler.delete_store(name)
+    finally:
+        for path in staged:
+            path.unlink(missing_ok=True)
+
+    # Decode the plan once now, like a regular upload
+    try:
+        write_plan_sidecar(MAPS_DIR / f"{name}{plan_ext}")
+    except Exception as e:
+        print(f"Error writing plan sidecar for {name}: {e}")
+    map_catalog.refresh(name)
+
+
+def import_archive(archive_path: Path, plans: Dict[str, Dict[str, Dict[str, Any]]],
+                   replace: bool = False) -> Dict[str, Any]:
+    """
+    Imports the maps of a verified manifest, IMPORT_WORKERS at a time.
+    Existing maps are skipped unless `replace` is set. A map that fails
+    verification is reported and leaves nothing behind; the others are
+    still imported. The caller holds the maps' locks.
+    """
+    result: Dict[str, Any] = {"imported": [], "skipped": [], "failed": {}}
+    todo = []
+    for name in plans:
+        if not replace and map_catalog.get(name):
+            result["skipped"].append(name)
+        else:
+            todo.append(name)
+
+    def run(name: str) -> Tuple[str, Optional[str]]:
+        try:
+            _import_map(archive_path, name, plans[name])
+            return name, None
+        except (ArchiveError, BundleError) as e:
+            return name, str(e)
+        except Exception as e:
+            print(f"Error importing map {name}: {e}")
+            return name, f"Error importing map: {e}"
+
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="archive-import") as executor:
+        for name, error in executor.map(run, todo):
+            if error is None:
+                result["imported"].append(name)
+            else:
+                result["failed"][name] = error
+    return result
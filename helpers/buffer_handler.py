@@ -0,0 +1,97 @@
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+from config import BUFFER_POOL_BYTES
+from helpers.import_handler import lazy_module
+
+# OpenCV and NumPy are imported on the first render, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+BufferKey = Tuple[Tuple[int, ...], str]
+
+
+class BufferPool:
+    """
+    Reusable scratch arrays for the render pipeline, keyed by shape and dtype.
+
+    A render borrows the full-size buffers it needs and gives them back when
+    it is done, so steady-state renders of the same plan reuse the same
+    memory instead of allocating (and page-faulting) new arrays each time.
+    Concurrent renders borrow distinct buffers. Buffers kept while idle are
+    bounded by `max_bytes`; the least recently used shapes go first.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._free: "OrderedDict[BufferKey, List[np.ndarray]]" = OrderedDict()
+        self._bytes = 0
+        # Counters, to check that renders reuse their buffers
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def borrow(self, shape: Tuple[int, ...], dtype) -> Iterator[np.ndarray]:
+        """
+        Lends an uninitialized array of the given shape and dtype for the
+        duration of the block. Its content is garbage: write before reading.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        buffer = None
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buffer = free.pop()
+                self._bytes -= buffer.nbytes
+                self.hits += 1
+            else:
+                self.misses += 1
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+
+        try:
+            yield buffer
+        finally:
+            self._give_back(key, buffer)
+
+    def _give_back(self, key: BufferKey, buffer: np.ndarray) -> None:
+        if buffer.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self._bytes += buffer.nbytes
+            # Drop the buffers of the least recently used shapes first
+            while self._bytes > self.max_bytes:
+                oldest_key, oldest = next(iter(self._free.items()))
+                self._bytes -= oldest.pop(0).nbytes
+                if not oldest:
+                    del self._free[oldest_key]
+
+    def clear(self) -> None:
+        """Releases every idle buffer."""
+        with self._lock:
+            self._free.clear()
+            self._bytes = 0
+
+
+# Shared by every render of this process
+buffer_pool = BufferPool(BUFFER_POOL_BYTES)
+
+# BGR color of each of the 256 intensity levels, per color map
+_colormap_luts: Dict[str, np.ndarray] = {}
+
+
+def colormap_lut(colormap: str) -> np.ndarray:
+    """
+    Returns the 256-entry lookup table of an OpenCV color map, computed once.
+    Passed to cv2.applyColorMap as a user color map.
+    """
+    lut = _colormap_luts.get(colormap)
+    if lut is None:
+        levels = np.arange(256, dtype=np.uint8).reshape(256, 1)
+        lut = _colormap_luts[colormap] = cv2.applyColorMap(levels, getattr(cv2, f"COLORMAP_{colormap.upper()}"))
+    return lut
@@ -0,0 +1,167 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from config import MAPS_DIR, MAPS_POSSIBLE_EXTENSIONS, SIGNAL_DIR, CHANNEL_DIR, AP_DIR, STORAGE_BACKEND, ORIGINALS_DIR
+from helpers import db_handler
+from helpers.import_handler import lazy_module
+
+# Pillow (installed with pdf2image) reads image sizes from the file header only
+PIL_Image = lazy_module("PIL.Image")
+
+
+@dataclass(frozen=True)
+class MapEntry:
+    """
+    Everything the pages and endpoints need to know about one map.
+    """
+    name: str  # Map name (file name without extension)
+    path: Path  # Plan image on disk
+    url: str  # Web URL of the plan image
+    width: int
+    height: int
+    sha256: str  # Checksum of the plan image
+    scale: float  # Working copy size / original upload size (1.0 if not downscaled)
+    has_signal: bool  # Whether signal scan data exists
+    has_channel: bool  # Whether channel scan data exists
+
+
+class MapCatalog:
+    """
+    In-memory index of every map in MAPS_DIR and of the scan data they have.
+
+    Pages and endpoints look maps up here instead of listing directories and
+    probing extensions on each request. The catalog is kept up to date by the
+    upload, delete and scan paths, and is re-synced with the disk whenever the
+    mtime of MAPS_DIR, SIGNAL_DIR, CHANNEL_DIR or AP_DIR changes (e.g. when another
+    worker process added a map).
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries: Dict[str, MapEntry] = {}
+        # (name, mtime, size) -> (width, height, sha256, scale), so unchanged plans are never re-read
+        self._image_info: Dict[Tuple[str, int, int], Tuple[int, int, str, float]] = {}
+        self._dir_state: Optional[Tuple[int, ...]] = None
+        self._version = 0
+
+    @staticmethod
+    def _read_dir_state() -> Tuple[int, ...]:
+        """One stat call per directory; any added, removed or replaced file changes it."""
+        if STORAGE_BACKEND == "sqlite":
+            # Scan data lives in the database: use its write counters instead
+            return (MAPS_DIR.stat().st_mtime_ns, AP_DIR.stat().st_mtime_ns, *db_handler.data_state())
+        return tuple(d.stat().st_mtime_ns for d in (MAPS_DIR, SIGNAL_DIR, CHANNEL_DIR, AP_DIR))
+
+    def _image_details(self, path: Path) -> Tuple[int, int, str, float]:
+        """Returns (width, height, sha256, scale) of a plan image, cached by mtime and size."""
+        stat = path.stat()
+        key = (path.name, stat.st_mtime_ns, stat.st_size)
+        info = self._image_info.get(key)
+        if info is None:
+            checksum = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    checksum.update(chunk)
+            try:
+                with PIL_Image.open(path) as image:
+                    width, height = image.size
+                    # OpenCV applies the EXIF orientation when decoding: 90° rotations swap the axes
+                    if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                        width, height = height, width
+            except Exception as e:
+                print(f"Error reading size of map {path.name}: {e}")
+                width = height = 0
+            # The scale factor was stored when the upload was normalized
+            try:
+                with open(ORIGINALS_DIR / f"{path.stem}.json", "r", encoding="utf-8") as f:
+                    scale = float(json.load(f).get("scale", 1.0))
+            except (OSError, ValueError, AttributeError):
+                scale = 1.0
+            info = self._image_info[key] = (width, height, checksum.hexdigest(), scale)
+        return info
+
+    def _rescan(self) -> None:
+        """Rebuilds every entry from a single listing of each directory."""
+        dir_state = self._read_dir_state()
+        if STORAGE_BACKEND == "sqlite":
+            signal_names = db_handler.survey_names("signal")
+            channel_names = db_handler.survey_names("channel")
+        else:
+            signal_names = {f.stem for f in SIGNAL_DIR.iterdir() if f.suffix.lower() == ".json"}
+            channel_names = {f.stem for f in CHANNEL_DIR.iterdir() if f.suffix.lower() == ".json"}
+        # Scans are saved to the AP store, from which the signal layers are computed
+        signal_names |= {f.stem for f in AP_DIR.iterdir() if f.suffix.lower() == ".jsonl"}
+
+        # Keep the first extension in MAPS_POSSIBLE_EXTENSIONS order when a name has several
+        files = list(MAPS_DIR.iterdir())
+        plans: Dict[str, Path] = {}
+        for ext in MAPS_POSSIBLE_EXTENSIONS:
+            for file in files:
+                if file.suffix.lower() == ext and file.stem not in plans:
+                    plans[file.stem] = file
+
+        entries: Dict[str, MapEntry] = {}
+        for name, path in plans.items():
+            try:
+                width, height, checksum, scale = self._image_details(path)
+            except OSError:
+                continue  # Deleted while listing
+            entries[name] = MapEntry(
+                name=name,
+                path=path,
+                url=f"/static/maps/{path.name}",
+                width=width,
+                height=height,
+                sha256=checksum,
+                scale=scale,
+                has_signal=name in signal_names,
+                has_channel=name in channel_names,
+            )
+
+        # Forget image details of plans that are gone
+        live = {p.name for p in plans.values()}
+        self._image_info = {k: v for k, v in self._image_info.items() if k[0] in live}
+
+        self._entries = entries
+        self._dir_state = dir_state
+        self._version += 1
+
+    def _ensure_fresh(self) -> None:
+        """Re-syncs with the disk if one of the directories changed since the last scan."""
+        if self._dir_state != self._read_dir_state():
+            self._rescan()
+
+    def get(self, name: str) -> Optional[MapEntry]:
+        """Returns the entry of a map, or None if no plan image exists for it."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._entries.get(name)
+
+    def all(self) -> List[MapEntry]:
+        """Returns every map, sorted by name."""
+        with self._lock:
+            self._ensure_fresh()
+            return sorted(self._entries.values(), key=lambda entry: entry.name.lower())
+
+    def version(self) -> int:
+        """Counter that changes whenever a map or its scan data is added, replaced or removed."""
+        with self._lock:
+            self._ensure_fresh()
+            return self._version
+
+    def refresh(self, name: str) -> None:
+        """
+        Re-syncs the catalog after a map was uploaded, deleted or scanned.
+        The change is visible immediately, even on filesystems with coarse
+        directory mtimes. Only the plan of `name` is re-read.
+        """
+        with self._lock:
+            self._image_info = {k: v for k, v in self._image_info.items() if Path(k[0]).stem != name}
+            self._rescan()
+
+
+# Shared catalog instance used by the helpers and routers
+map_catalog = MapCatalog()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import quoteattr
+from helpers.field_handler import MIN_COVERAGE, RADIUS, SIGMA, get_field
+from helpers.buffer_handler import buffer_pool, colormap_lut
+from helpers.stats_handler import DEFAULT_THRESHOLDS
+from helpers.import_handler import lazy_module
+
+# OpenCV and NumPy are imported on the first computation, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+# Maximum distance (px) between a contour and its simplified polygon
+DEFAULT_EPSILON = 1.5
+# Areas smaller than this (px²) are dropped as noise
+MIN_AREA = 16
+
+# A polygon is its outer ring followed by its holes, each a list of (x, y)
+Polygon = List[List[Tuple[int, int]]]
+
+
+def _level_polygons(mean: np.ndarray, coverage: np.ndarray, threshold: float,
+                    epsilon: float) -> List[Polygon]:
+    """
+    Extracts the areas of a field at or above a threshold as polygons.
+
+    1. Thresholds the surveyed part of the field into a binary mask.
+    2. Traces its outer boundaries and holes with cv2.findContours (RETR_CCOMP
+       gives a two-level hierarchy: outer rings, then the holes inside them).
+    3. Simplifies each ring with cv2.approxPolyDP.
+    """
+    with buffer_pool.borrow(mean.shape, np.uint8) as mask, buffer_pool.borrow(mean.shape, np.bool_) as inside, \
+            buffer_pool.borrow(mean.shape, np.bool_) as surveyed:
+        np.greater_equal(mean, threshold, out=inside)
+        np.greater_equal(coverage, MIN_COVERAGE, out=surveyed)
+        np.logical_and(inside, surveyed, out=inside)
+        np.copyto(mask, inside, casting="unsafe")
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+
+    polygons: Dict[int, Polygon] = {}
+    if hierarchy is None:
+        return []
+    for index, contour in enumerate(contours):
+        if cv2.contourArea(contour) < MIN_AREA:
+            continue
+        ring = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+        if len(ring) < 3:
+            continue
+        points = [(int(x), int(y)) for x, y in ring]
+        parent = int(hierarchy[0][index][3])
+        if parent < 0:
+            polygons.setdefault(index, [None])[0] = points
+        else:
+            polygons.setdefault(parent, [None]).append(points)
+
+    # Drop the holes whose outer ring was too small to be kept
+    return [rings for rings in polygons.values() if rings[0] is not None]
+
+
+def layer_contours(map_name: str, data_type: str, key: str, shape: Tuple[int, int],
+                   thresholds: Optional[Sequence[float]] = None, epsilon: float = DEFAULT_EPSILON,
+                   radius: int = RADIUS, sigma: float = SIGMA) -> List[Dict[str, Any]]:
+    """
+    Returns the iso-bands of a layer: for each threshold (lowest first), the
+    polygons where the field is at or above it, in plan pixel coordinates.
+    The field comes from the field cache, like the renders.
+    """
+    if thresholds is None:
+        thresholds = DEFAULT_THRESHOLDS.get(data_type, ())
+    field = get_field(map_name, data_type, key, shape, radius, sigma)
+    return [
+        {"threshold": threshold, "polygons": _level_polygons(field.mean, field.coverage, threshold, epsilon)}
+        for threshold in sorted(thresholds)
+    ]
+
+
+def _level_color(threshold: float, value_range: Tuple[float, float], colormap: str) -> str:
+    """Color of a threshold in the heatmap's color map, as #rrggbb."""
+    min_val, max_val = value_range
+    level = int(np.clip((threshold - min_val) / (max_val - min_val), 0, 1) * 255)
+    b, g, r = (int(c) for c in colormap_lut(colormap)[level, 0])
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+def to_geojson(levels: List[Dict[str, Any]], layer: str, shape: Tuple[int, int]) -> Dict[str, Any]:
+    """
+    Encodes iso-bands as a GeoJSON FeatureCollection: one MultiPolygon per
+    threshold, in plan pixel coordinates (x right, y down).
+    """
+    h, w = shape
+    features = []
+    for level in levels:
+        # GeoJSON rings are closed: the first point is repeated at the end
+        coordinates = [[[list(p) for p in ring + ring[:1]] for ring in polygon] for polygon in level["polygons"]]
+        features.append({
+            "type": "Feature",
+            "properties": {"layer": layer, "threshold": level["threshold"]},
+            "geometry": {"type": "MultiPolygon", "coordinates": coordinates},
+        })
+    return {"type": "FeatureCollection", "width": w, "height": h, "features": features}
+
+
+def to_svg(levels: List[Dict[str, Any]], layer: str, shape: Tuple[int, int],
+           value_range: Tuple[float, float], colormap: str = "turbo") -> str:
+    """
+    Encodes iso-bands as an SVG overlay of the plan's size: one path per
+    threshold (lowest first, so higher levels are drawn on top), colored
+    like the heatmap and filled with the even-odd rule so holes stay open.
+    """
+    h, w = shape
+    paths = []
+    for level in levels:
+        d = " ".join(
+            "M" + " L".join(f"{x},{y}" for x, y in ring) + " Z"
+            for polygon in level["polygons"] for ring in polygon
+        )
+        if not d:
+            continue
+        color = _level_color(level["threshold"], value_range, colormap)
+        paths.append(
+            f'<path data-threshold="{level["threshold"]:g}" d="{d}" fill="{color}" fill-opacity="0.25" '
+            f'stroke="{color}" stroke-width="2" fill-rule="evenodd" vector-effect="non-scaling-stroke"/>'
+        )
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {w} {h}" width="{w}" height="{h}" '
+            f'data-layer={quoteattr(layer)}>' + "".join(paths) + "</svg>")
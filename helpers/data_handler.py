@@ -1,187 +1,241 @@
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Tuple, Union
 from fastapi import File, UploadFile, status, HTTPException
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import RedirectResponse, Response
 from pathlib import Path
-from config import SIGNAL_DIR, CHANNEL_DIR
+from config import SIGNAL_DIR, CHANNEL_DIR, DATA_MAX_UPLOAD_SIZE, STORAGE_BACKEND
 import json
-from helpers.scan_handler import extract_scan
+from helpers.upload_handler import stream_to_temp, UploadTooLargeError
+from helpers.export_handler import SurveyData, export_bundle, read_bundle, validate_survey, merge_survey
+from helpers.lock_handler import map_file_lock, read_json_checked, write_json_atomic
+from helpers.catalog_handler import map_catalog
+from helpers import db_handler, ap_handler
 
 
-def load_data(map_name: str, file: UploadFile = File(...)) -> RedirectResponse:
+def _survey_path(map_name: str, kind: str) -> Path:
+    """Path of a map's JSON file of one kind ("signal" or "channel")."""
+    return (CHANNEL_DIR if kind == "channel" else SIGNAL_DIR) / f"{map_name}.json"
+
+
+def read_survey(map_name: str, kind: str, scans: bool = True) -> SurveyData:
+    """
+    Returns a map's whole survey of one kind, from the configured storage.
+    The signal survey also holds the map's scans: the strongest BSSID per
+    SSID/Band of each scan, computed from the AP store. Without `scans`, only
+    the stored points (imported surveys) are returned, as write_survey writes them.
+    Must be called while holding the map's file lock.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        data = db_handler.read_survey(map_name, kind)
+    else:
+        data = read_json_checked(_survey_path(map_name, kind))
+    if kind == "signal" and scans:
+        for key, points in ap_handler.best_points(map_name).items():
+            data[key] = data.get(key, []) + points
+    return data
+
+
+def write_survey(map_name: str, kind: str, data: SurveyData) -> None:
+    """
+    Replaces a map's whole survey of one kind in the configured storage.
+    The scans of the AP store are not touched (see ap_handler.delete_store).
+    Must be called while holding the map's file lock.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        db_handler.replace_survey(map_name, kind, data)
+    else:
+        write_json_atomic(_survey_path(map_name, kind), data)
+
+
+def load_data(map_name: str, file: UploadFile = File(...), merge: bool = False) -> RedirectResponse:
     """
-    Handles uploading a .json scan file for a specific map.
+    Handles uploading scan data for a specific map.
     This is used for the "Load" functionality on the scans page.
+
+    Accepts either a legacy .json signal file or a compressed export bundle
+    (signal + channel data). The content is validated before anything is
+    written. With `merge`, the points are added to the existing survey
+    instead of replacing it.
     """
-    ext = Path(file.filename).suffix.lower()
+    filename = Path(file.filename).name.lower()
+    is_bundle = filename.endswith(".gz")
 
-    if ext != ".json":
-        # If the file is not a JSON, redirect with an error
+    if not is_bundle and Path(filename).suffix != ".json":
+        # If the file is neither a JSON nor a bundle, redirect with an error
         return RedirectResponse(url="/scans", status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
-    # Define the target file path in the signal directory
-    file_path = SIGNAL_DIR / f"{map_name}.json"
+    # 1. Stream the upload to a temp file, bounded by DATA_MAX_UPLOAD_SIZE
+    try:
+        tmp_path, _ = stream_to_temp(file, SIGNAL_DIR, DATA_MAX_UPLOAD_SIZE)
+    except UploadTooLargeError as e:
+        print(f"Rejected upload: {e}")
+        return RedirectResponse(url="/scans", status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
-    # Write the uploaded file's content to the target file
+    # 2. Parse and validate the content (bundles are read record by record)
+    channel = None  # Legacy .json files only hold signal data
+    try:
+        with open(tmp_path, "rb") as f:
+            if is_bundle:
+                signal, channel = read_bundle(f)
+            else:
+                signal = validate_survey("signal", json.load(f))
+    except ValueError as e:
+        print(f"Rejected scan data for {map_name}: {e}")
+        return RedirectResponse(url="/scans", status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    # 3. Write (or merge) the validated data under the map's lock
     try:
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
+        with map_file_lock(map_name):
+            for kind, incoming in (("signal", signal), ("channel", channel)):
+                if incoming is None:
+                    continue
+                if merge:
+                    incoming = merge_survey(kind, read_survey(map_name, kind, scans=False), incoming)
+                write_survey(map_name, kind, incoming)
+            if not merge:
+                # The APs of the replaced survey are not in the new one
+                ap_handler.delete_store(map_name)
     except Exception as e:
-        print(f"Error writing file {file_path}: {e}")
+        print(f"Error writing scan data for {map_name}: {e}")
         # Redirect on failure
         return RedirectResponse(url="/scans", status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    map_catalog.refresh(map_name)
+
     # Redirect back to the scans page on success
     return RedirectResponse(url="/scans", status_code=status.HTTP_303_SEE_OTHER)
 
 
-def send_data(map_name: str) -> FileResponse:
+def send_data(map_name: str, export_format: str = "json") -> Response:
     """
-    Handles downloading a .json scan file for a specific map.
+    Handles downloading the scan data of a specific map.
     This is used for the "Save" functionality on the scans page.
-    """
-    file_path = SIGNAL_DIR / f"{map_name}.json"
 
-    if not file_path.exists():
-        # If the file doesn't exist, raise a 404 error
+    - "json": the signal data, in the legacy .json file format.
+    - "bundle": a compressed bundle with signal and channel data, streamed.
+    """
+    if not find_ssid_list(map_name):
+        # If there is no signal data, raise a 404 error
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
 
-    # Return the file as a downloadable attachment
-    return FileResponse(
-        path=file_path,
-        filename=f"{map_name}.json",
+    if export_format == "bundle":
+        # Read both kinds under the lock so they come from the same scan
+        with map_file_lock(map_name):
+            signal = read_survey(map_name, "signal")
+            channel = read_survey(map_name, "channel")
+        entry = map_catalog.get(map_name)
+        return export_bundle(map_name, signal, channel, entry.scale if entry else 1.0)
+
+    # Export the stored points and the scans in the same JSON form as the files
+    with map_file_lock(map_name):
+        content = json.dumps(read_survey(map_name, "signal"), indent=4)
+    return Response(
+        content=content,
         media_type='application/json',
         headers={"Content-Disposition": f"attachment; filename={map_name}.json"}
     )
 
 
-def extract_signal(results: List[Dict[str, Union[str, float]]], x: int, y: int, map_name: str) -> str:
-    """
-    Takes a list of network scan results and appends them to this map's signal JSON file.
-    Organizes data by SSID and Band.
-    """
-    file_path = SIGNAL_DIR / f"{map_name}.json"
-
-    # Load existing data from the file, or start with an empty dict
-    if file_path.exists():
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data: Dict[str, List] = json.load(f)
-        except json.JSONDecodeError:
-            data = {}  # Overwrite corrupted file
-    else:
-        data = {}
-
-    # Process each network found in the scan result
-    for network in results:
-        ssid = str(network["ssid"])
-        band = str(network["band"])
-        bssid = str(network["bssid"])
-        signal = float(network["signal"])
-
-        # Create a unique key for the SSID + Band combination
-        key = f"{ssid} [{band}]"
-
-        if key not in data:
-            data[key] = []
-
-        # Append the new scan point data
-        data[key].append({
-            "bssid": bssid,
-            "signal": signal,
-            "x": x,
-            "y": y
-        })
-
-    # Write the updated data back to the JSON file
-    try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-        return f"Scan data saved to {file_path.name}"
-    except Exception as e:
-        return f"Error saving signal data: {e}"
-
-
 def extract_channel(channels: Dict[int, int], x: int, y: int, map_name: str) -> str:
     """
     Takes a dictionary of channel counts and appends them to this map's channel JSON file.
     Organizes data by channel number.
+    With the SQLite backend, the points are inserted instead of rewriting the file.
     """
     file_path = CHANNEL_DIR / f"{map_name}.json"
 
-    # Load existing data from the file, or start with an empty dict
-    if file_path.exists():
+    if STORAGE_BACKEND == "sqlite":
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data: Dict[str, List] = json.load(f)
-        except json.JSONDecodeError:
-            data = {}  # Overwrite corrupted file
-    else:
-        data = {}
+            db_handler.insert_points(map_name, "channel", [
+                (f"Channel_{channel}", {"x": x, "y": y, "count": count})
+                for channel, count in channels.items()
+            ])
+            return "Channel data saved to the database"
+        except Exception as e:
+            return f"Error saving channel data: {e}"
 
-    # Process each channel count
-    for channel, count in channels.items():
-        key = f"Channel_{channel}"  # e.g., "Channel_6"
+    # Hold the map's lock for the whole read-modify-write
+    with map_file_lock(map_name):
+        # Load existing data (after a crash-recovery check), or start with an empty dict
+        data: Dict[str, List] = read_json_checked(file_path)
 
-        if key not in data:
-            data[key] = []
+        # Process each channel count
+        for channel, count in channels.items():
+            key = f"Channel_{channel}"  # e.g., "Channel_6"
 
-        # Append the new scan point data
-        data[key].append({
-            "x": x,
-            "y": y,
-            "count": count
-        })
+            if key not in data:
+                data[key] = []
 
-    # Write the updated data back to the JSON file
-    try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-        return f"Channel data saved to {file_path.name}"
-    except Exception as e:
-        return f"Error saving channel data: {e}"
+            # Append the new scan point data
+            data[key].append({
+                "x": x,
+                "y": y,
+                "count": count
+            })
+
+        # Write the updated data back to the JSON file
+        try:
+            write_json_atomic(file_path, data)
+            return f"Channel data saved to {file_path.name}"
+        except Exception as e:
+            return f"Error saving channel data: {e}"
 
 
-def update_json_with_scan(map_name: str, x: int, y: int) -> Dict[str, str]:
-    """
-    Main function called by the API when a user clicks on the scan map.
-    It performs a scan and updates both signal and channel JSON files.
+def save_scan(map_name: str, x: int, y: int, results: List[Dict[str, Union[str, float]]],
+              channels: Dict[int, int]) -> Dict[str, str]:
     """
-    # 1. Perform the OS-specific scan
-    results, channels = extract_scan()
+    Saves the results of one scan to the AP store and the channel data.
+    The map's lock is held across both writes so they land together.
 
-    # 2. Save the signal (SSID) results
-    signal_mess = extract_signal(results, x, y, map_name)
+    `results` holds every BSSID seen: all of them go to the AP store, from
+    which the signal layers (strongest BSSID per SSID/Band) are computed.
+    """
+    with map_file_lock(map_name):
+        try:
+            ap_handler.append_scan(map_name, x, y, results)
+            signal_mess = f"{len(results)} networks saved to the AP store"
+        except Exception as e:
+            signal_mess = f"Error saving signal data: {e}"
+        channel_mess = extract_channel(channels, x, y, map_name)
 
-    # 3. Save the channel count results
-    channel_mess = extract_channel(channels, x, y, map_name)
+    map_catalog.refresh(map_name)
 
     return {"status": "success", "message": signal_mess + "\n" + channel_mess}
 
 
 def delete_signal(map_name: str) -> str:
-    """Utility function to delete the signal JSON file for a map."""
+    """Utility function to delete the signal JSON file (or stored points) for a map."""
     file_path = SIGNAL_DIR / f"{map_name}.json"
-    if file_path.exists():
-        try:
-            file_path.unlink()
-            return f"{file_path.name} has been deleted"
-        except Exception as e:
-            return f"Error deleting {file_path.name}: {e}"
-    else:
-        return f"{file_path.name} does not exist"
+    with map_file_lock(map_name):
+        if STORAGE_BACKEND == "sqlite":
+            deleted = db_handler.delete_survey(map_name, "signal")
+            return f"{deleted} signal points have been deleted"
+        if file_path.exists():
+            try:
+                file_path.unlink()
+                return f"{file_path.name} has been deleted"
+            except Exception as e:
+                return f"Error deleting {file_path.name}: {e}"
+        else:
+            return f"{file_path.name} does not exist"
 
 
 def delete_channel(map_name: str) -> str:
-    """Utility function to delete the channel JSON file for a map."""
+    """Utility function to delete the channel JSON file (or stored points) for a map."""
     file_path = CHANNEL_DIR / f"{map_name}.json"
-    if file_path.exists():
-        try:
-            file_path.unlink()
-            return f"{file_path.name} has been deleted"
-        except Exception as e:
-            return f"Error deleting {file_path.name}: {e}"
-    else:
-        return f"{file_path.name} does not exist"
+    with map_file_lock(map_name):
+        if STORAGE_BACKEND == "sqlite":
+            deleted = db_handler.delete_survey(map_name, "channel")
+            return f"{deleted} channel points have been deleted"
+        if file_path.exists():
+            try:
+                file_path.unlink()
+                return f"{file_path.name} has been deleted"
+            except Exception as e:
+                return f"Error deleting {file_path.name}: {e}"
+        else:
+            return f"{file_path.name} does not exist"
 
 
 def delete_json(map_name: str) -> Dict[str, str]:
@@ -191,6 +245,8 @@ def delete_json(map_name: str) -> Dict[str, str]:
     """
     signal_mess = delete_signal(map_name)
     channel_mess = delete_channel(map_name)
+    ap_handler.delete_store(map_name)
+    map_catalog.refresh(map_name)
     return {"status": "deleted", "message": signal_mess + "\n" + channel_mess}
 
 
@@ -199,7 +255,16 @@ def find_ssid_list(map_name: str) -> List[str]:
     Finds the list of all "SSID [Band]" keys from a map's signal JSON file.
     Used to populate the checklist on the heatmap visualization page.
     """
-    json_path = SIGNAL_DIR / f"{map_name}.json"
+    if STORAGE_BACKEND == "sqlite":
+        keys = db_handler.list_keys(map_name, "signal")
+    else:
+        keys = _stored_keys(SIGNAL_DIR / f"{map_name}.json")
+    # Then the keys only seen by scans
+    return keys + [key for key in ap_handler.list_keys(map_name) if key not in keys]
+
+
+def _stored_keys(json_path: Path) -> List[str]:
+    """Returns the keys of a map's JSON file (empty on a missing or unreadable file)."""
     if not json_path.exists():
         return []
     try:
@@ -215,27 +280,35 @@ def find_channel_list(map_name: str) -> List[str]:
     Finds the list of all "Channel_X" keys from a map's channel JSON file.
     Used to populate the checklist on the heatmap visualization page.
     """
-    json_path = CHANNEL_DIR / f"{map_name}.json"
-    if not json_path.exists():
-        return []
-    try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data: Dict[str, Any] = json.load(f)
-        return list(data.keys())
-    except Exception:
-        return []  # Return empty list on file error
+    if STORAGE_BACKEND == "sqlite":
+        return db_handler.list_keys(map_name, "channel")
+    return _stored_keys(CHANNEL_DIR / f"{map_name}.json")
 
 
 def find_data_list(map_name: str, key: str, data_type: str) -> List[Dict[str, Any]]:
     """
     Retrieves the raw list of data points (x, y, signal/count) for a
     specific key (e.g., "MySSID [5GHz]" or "Channel_6") from the correct JSON file.
+    With the SQLite backend, only that layer's rows are read, through the index.
+    Signal layers end with the scans of that key, computed from the AP store.
+    For "ap" layers, the key is a BSSID, read from the AP store.
     """
-    if data_type == "channel":
-        json_path = CHANNEL_DIR / f"{map_name}.json"
-    else:  # Default to signal
-        json_path = SIGNAL_DIR / f"{map_name}.json"
+    if data_type == "ap":
+        return ap_handler.ap_points(map_name, key)
+
+    kind = "channel" if data_type == "channel" else "signal"
+    if STORAGE_BACKEND == "sqlite":
+        points = db_handler.find_points(map_name, kind, key)
+    else:
+        points = _stored_points(_survey_path(map_name, kind), key)
+
+    if kind == "signal":
+        points = points + ap_handler.best_points(map_name, key).get(key, [])
+    return points
+
 
+def _stored_points(json_path: Path, key: str) -> List[Dict[str, Any]]:
+    """Returns the points of one key of a map's JSON file (empty on a missing or unreadable file)."""
     if not json_path.exists():
         return []
 
@@ -245,4 +318,29 @@ def find_data_list(map_name: str, key: str, data_type: str) -> List[Dict[str, An
         # Return the list of data points for the requested key, or empty list
         return data.get(key, [])
     except Exception:
-        return []
\ No newline at end of file
+        return []
+
+
+def data_version(map_name: str, data_type: str) -> Tuple[int, ...]:
+    """
+    Returns a cheap version stamp (mtime, size) of a map's signal or channel data.
+    Every write replaces the file, so the stamp changes with each scan or import.
+    With the SQLite backend, it is the map's write counter in the database.
+    The stamp of signal data includes the one of the AP store, which holds the scans.
+    """
+    if data_type == "ap":
+        return ap_handler.data_version(map_name)
+
+    kind = "channel" if data_type == "channel" else "signal"
+    if STORAGE_BACKEND == "sqlite":
+        stamp = (db_handler.version(map_name, kind), 0)
+    else:
+        try:
+            stat = _survey_path(map_name, kind).stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = (0, 0)
+
+    if kind == "signal":
+        return stamp + ap_handler.data_version(map_name)
+    return stamp
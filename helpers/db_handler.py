@@ -0,0 +1,172 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Set, Tuple
+from config import DB_PATH, SIGNAL_DIR, CHANNEL_DIR, VALUE_FIELDS
+
+SurveyData = Dict[str, List[Dict[str, Any]]]
+
+# One connection per thread: sqlite3 connections must not be shared between threads
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    id      INTEGER PRIMARY KEY,
+    map     TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    bssid   TEXT NOT NULL DEFAULT '',
+    x       INTEGER NOT NULL,
+    y       INTEGER NOT NULL,
+    value   REAL NOT NULL,
+    ts      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS points_map_key ON points (map, kind, key);
+CREATE TABLE IF NOT EXISTS versions (
+    map     TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (map, kind)
+);
+"""
+
+
+def _initialize(conn: sqlite3.Connection) -> None:
+    """
+    Creates the schema once per process.
+    A new database imports the JSON files written by the JSON backend,
+    so switching HEATMAP_STORAGE to "sqlite" keeps the existing surveys.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        is_new = conn.execute("SELECT name FROM sqlite_master WHERE name = 'points'").fetchone() is None
+        conn.executescript(SCHEMA)
+        if is_new:
+            for kind, directory in (("signal", SIGNAL_DIR), ("channel", CHANNEL_DIR)):
+                for file_path in directory.glob("*.json"):
+                    try:
+                        with open(file_path, "r", encoding="utf-8") as f:
+                            replace_survey(file_path.stem, kind, json.load(f), conn)
+                    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                        print(f"Skipping {file_path.name} during the SQLite import: {e}")
+        _initialized = True
+
+
+def connect() -> sqlite3.Connection:
+    """Returns this thread's connection to the scan database (WAL mode)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        # WAL lets readers run while a scan is being written, across processes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        _initialize(conn)
+    return conn
+
+
+def _bump_version(conn: sqlite3.Connection, map_name: str, kind: str) -> None:
+    conn.execute(
+        "INSERT INTO versions (map, kind, version) VALUES (?, ?, 1) "
+        "ON CONFLICT (map, kind) DO UPDATE SET version = version + 1",
+        (map_name, kind)
+    )
+
+
+def _to_row(map_name: str, kind: str, key: str, point: Dict[str, Any], ts: float) -> Tuple[Any, ...]:
+    return (map_name, kind, key, str(point.get("bssid", "")), point["x"], point["y"],
+            point[VALUE_FIELDS[kind]], ts)
+
+
+def _to_point(kind: str, bssid: str, x: int, y: int, value: float) -> Dict[str, Any]:
+    """Rebuilds a point in the same form as the JSON files."""
+    if kind == "signal":
+        return {"bssid": bssid, "signal": value, "x": x, "y": y}
+    return {"x": x, "y": y, "count": int(value)}
+
+
+def insert_points(map_name: str, kind: str, points: List[Tuple[str, Dict[str, Any]]]) -> None:
+    """Appends (key, point) pairs to a map's current survey."""
+    conn = connect()
+    ts = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT INTO points (map, kind, key, bssid, x, y, value, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [_to_row(map_name, kind, key, point, ts) for key, point in points]
+        )
+        _bump_version(conn, map_name, kind)
+
+
+def replace_survey(map_name: str, kind: str, data: SurveyData, conn: sqlite3.Connection = None) -> None:
+    """Replaces a map's whole survey of one kind (import, session switch)."""
+    conn = conn or connect()
+    ts = time.time()
+    with conn:
+        conn.execute("DELETE FROM points WHERE map = ? AND kind = ?", (map_name, kind))
+        conn.executemany(
+            "INSERT INTO points (map, kind, key, bssid, x, y, value, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [_to_row(map_name, kind, key, point, ts) for key, points in data.items() for point in points]
+        )
+        _bump_version(conn, map_name, kind)
+
+
+def delete_survey(map_name: str, kind: str) -> int:
+    """Deletes a map's survey of one kind and returns the number of points removed."""
+    conn = connect()
+    with conn:
+        deleted = conn.execute("DELETE FROM points WHERE map = ? AND kind = ?", (map_name, kind)).rowcount
+        _bump_version(conn, map_name, kind)
+    return deleted
+
+
+def read_survey(map_name: str, kind: str) -> SurveyData:
+    """Returns a map's survey of one kind as {key: [points]}, in insertion order."""
+    data: SurveyData = {}
+    rows = connect().execute(
+        "SELECT key, bssid, x, y, value FROM points WHERE map = ? AND kind = ? ORDER BY id",
+        (map_name, kind)
+    )
+    for key, bssid, x, y, value in rows:
+        data.setdefault(key, []).append(_to_point(kind, bssid, x, y, value))
+    return data
+
+
+def list_keys(map_name: str, kind: str) -> List[str]:
+    """Returns the layer keys of a map, in the order they were first scanned."""
+    rows = connect().execute(
+        "SELECT key FROM points WHERE map = ? AND kind = ? GROUP BY key ORDER BY MIN(id)",
+        (map_name, kind)
+    )
+    return [key for (key,) in rows]
+
+
+def find_points(map_name: str, kind: str, key: str) -> List[Dict[str, Any]]:
+    """Returns the points of one layer, through the (map, kind, key) index."""
+    rows = connect().execute(
+        "SELECT bssid, x, y, value FROM points WHERE map = ? AND kind = ? AND key = ? ORDER BY id",
+        (map_name, kind, key)
+    )
+    return [_to_point(kind, *row) for row in rows]
+
+
+def version(map_name: str, kind: str) -> int:
+    """Counter incremented by every write to a map's survey of one kind."""
+    row = connect().execute(
+        "SELECT version FROM versions WHERE map = ? AND kind = ?", (map_name, kind)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def survey_names(kind: str) -> Set[str]:
+    """Returns the maps that have points of one kind."""
+    return {name for (name,) in connect().execute("SELECT DISTINCT map FROM points WHERE kind = ?", (kind,))}
+
+
+def data_state() -> Tuple[int, int]:
+    """Changes whenever any survey is written, like a directory mtime for the JSON backend."""
+    return connect().execute("SELECT COALESCE(SUM(version), 0), COUNT(*) FROM versions").fetchone()
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import base64
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+from helpers.data_handler import read_survey, data_version
+from helpers.grid_handler import grid_shape
+from helpers.lock_handler import map_file_lock
+from helpers.import_handler import lazy_module
+
+# OpenCV and NumPy are imported on the first computation, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+# Longest side of the grid the distances are computed on, in cells
+DENSITY_GRID_SIZE = 512
+# Areas farther than this from every scan (px of the plan) are gaps
+DEFAULT_GAP_DISTANCE = 150
+# Number of suggested next positions
+DEFAULT_SUGGESTIONS = 5
+# Maximum number of maps whose scan positions are kept in memory
+POSITIONS_CACHE_SIZE = 32
+
+# Overlay colors (RGBA): gaps fade in from half the gap distance
+GAP_COLOR = (220, 40, 40)
+GAP_MAX_ALPHA = 150
+
+# map -> (data versions, scan positions)
+_positions: "OrderedDict[str, Tuple[Any, np.ndarray]]" = OrderedDict()
+_positions_lock = Lock()
+
+
+def scan_positions(map_name: str) -> np.ndarray:
+    """
+    Returns the distinct (x, y) positions of a map's scans as an (n, 2) array,
+    from every signal and channel layer. Re-read only when the data changed.
+    """
+    version = (data_version(map_name, "signal"), data_version(map_name, "channel"))
+    with _positions_lock:
+        cached = _positions.get(map_name)
+        if cached is not None and cached[0] == version:
+            _positions.move_to_end(map_name)
+            return cached[1]
+
+    with map_file_lock(map_name):
+        surveys = [read_survey(map_name, kind) for kind in ("signal", "channel")]
+    xy = [(p["x"], p["y"]) for survey in surveys for points in survey.values() for p in points]
+    positions = np.unique(np.array(xy, dtype=np.int64).reshape(-1, 2), axis=0)
+
+    with _positions_lock:
+        _positions[map_name] = (version, positions)
+        _positions.move_to_end(map_name)
+        while len(_positions) > POSITIONS_CACHE_SIZE:
+            _positions.popitem(last=False)
+    return positions
+
+
+def _suggest(distance: np.ndarray, free: np.ndarray, cell: float, gap_distance: float,
+             count: int) -> List[Dict[str, Any]]:
+    """
+    Picks the next scan positions, while gaps remain: the center of the
+    largest empty area (the cell farthest from every scan and from the edges
+    of the plan), then the same again counting the earlier suggestions as
+    scans. Corners and edges are only picked when a gap is left nowhere else.
+    Each pick costs one O(cells) pass. `distance` is updated in place.
+    """
+    gh, gw = distance.shape
+    # Distance to the nearest scan or edge: a zero border around the grid
+    bordered = cv2.copyMakeBorder(free, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    interior = cv2.distanceTransform(bordered, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)[1:-1, 1:-1]
+
+    rows = np.arange(gh, dtype=np.float32)[:, None]
+    cols = np.arange(gw, dtype=np.float32)[None, :]
+    suggestions = []
+    for _ in range(count):
+        row, col = divmod(int(np.argmax(interior)), gw)
+        if distance[row, col] * cell < gap_distance:
+            # Only thin gaps along the edges are left: take the farthest cell
+            row, col = divmod(int(np.argmax(distance)), gw)
+        farthest = float(distance[row, col]) * cell
+        if farthest < gap_distance:
+            break
+        suggestions.append({"x": int((col + 0.5) * cell), "y": int((row + 0.5) * cell),
+                            "distance": round(farthest, 1)})
+        # Distance to the new suggestion, folded into the running minimums
+        to_suggestion = np.sqrt((rows - row) ** 2 + (cols - col) ** 2)
+        np.minimum(distance, to_suggestion, out=distance)
+        np.minimum(interior, to_suggestion, out=interior)
+    return suggestions
+
+
+def _overlay(distance: np.ndarray, cell: float, gap_distance: float) -> str:
+    """
+    Encodes the gaps as a transparent PNG at the grid's resolution (stretched
+    over the plan by the page): clear near scans, increasingly red beyond
+    half the gap distance. Returned as a data URL.
+    """
+    alpha = (distance * cell - gap_distance / 2) * (2 * GAP_MAX_ALPHA / gap_distance)
+    np.clip(alpha, 0, GAP_MAX_ALPHA, out=alpha)
+    overlay = np.empty(distance.shape + (4,), dtype=np.uint8)
+    overlay[..., :3] = GAP_COLOR[::-1]  # OpenCV writes BGRA
+    overlay[..., 3] = alpha
+    _, png = cv2.imencode(".png", overlay)
+    return "data:image/png;base64," + base64.b64encode(png.tobytes()).decode()
+
+
+def sampling_density(map_name: str, shape: Tuple[int, int], gap_distance: float = DEFAULT_GAP_DISTANCE,
+                     suggestions: int = DEFAULT_SUGGESTIONS) -> Dict[str, Any]:
+    """
+    Finds the parts of a plan of the given (height, width) that are far from
+    every scan, where the heatmap only extrapolates.
+
+    1. Marks the grid cells holding a scan on a downsampled grid.
+    2. cv2.distanceTransform gives every cell its distance to the nearest
+       scan in a single O(cells) pass.
+    3. Summarizes the gaps (cells beyond `gap_distance`), draws them as an
+       overlay and suggests where to scan next.
+
+    Distances are in plan pixels, precise to about one grid cell.
+    """
+    h, w = shape
+    gh, gw = grid_shape(shape, DENSITY_GRID_SIZE)
+    cell = w / gw  # Plan pixels per grid cell (same on both axes, up to rounding)
+
+    # 1. Zero at the scans, non-zero elsewhere
+    positions = scan_positions(map_name)
+    if not len(positions):
+        # No scan yet: everything is a gap, start from the middle of the plan
+        return {
+            "width": w, "height": h, "scans": 0, "gap_distance": gap_distance,
+            "max_distance": None, "gap_pct": 100.0,
+            "overlay": _overlay(np.full((gh, gw), np.float32(gap_distance / cell)), cell, gap_distance),
+            "suggestions": [{"x": w // 2, "y": h // 2, "distance": None}][:suggestions],
+        }
+    free = np.ones((gh, gw), dtype=np.uint8)
+    cols = np.clip((positions[:, 0] / cell).astype(np.intp), 0, gw - 1)
+    rows = np.clip((positions[:, 1] / cell).astype(np.intp), 0, gh - 1)
+    free[rows, cols] = 0
+
+    # 2. Distance (in cells) of each cell to the nearest scan
+    distance = cv2.distanceTransform(free, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+
+    # 3. Gaps, overlay and suggestions
+    gaps = distance >= gap_distance / cell
+    return {
+        "width": w, "height": h,
+        "scans": int(len(positions)),
+        "gap_distance": gap_distance,
+        "max_distance": round(float(distance.max()) * cell, 1),
+        "gap_pct": round(100.0 * float(np.count_nonzero(gaps)) / gaps.size, 2),
+        "overlay": _overlay(distance, cell, gap_distance),
+        "suggestions": _suggest(distance, free, cell, gap_distance, suggestions),
+    }
@@ -0,0 +1,258 @@
+import gzip
+import io
+import json
+import math
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Tuple
+from fastapi.responses import StreamingResponse
+from config import DATA_MAX_DECOMPRESSED_SIZE, VALUE_FIELDS
+
+# Identification of the export bundle format
+BUNDLE_FORMAT = "heatmap-survey"
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = ".heatmap.gz"
+
+# Number of points written per record, which bounds the length of each line
+POINTS_PER_RECORD = 1000
+# Longest line accepted when reading a bundle (bytes, decompressed)
+MAX_RECORD_SIZE = 1024 * 1024
+
+SurveyData = Dict[str, List[Dict[str, Any]]]
+
+
+class BundleError(ValueError):
+    """
+    Raised when imported scan data is malformed or fails validation.
+    """
+
+
+# --- Export ---
+
+def _encode_record(kind: str, key: str, points: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Encodes points of one layer as a compact columnar record.
+    BSSIDs are interned in a per-record table and referenced by index.
+    """
+    value_field = VALUE_FIELDS[kind]
+    record: Dict[str, Any] = {
+        "type": kind,
+        "key": key,
+        "x": [p["x"] for p in points],
+        "y": [p["y"] for p in points],
+        value_field: [p[value_field] for p in points],
+    }
+    if kind == "signal":
+        bssids: Dict[str, int] = {}
+        record["bssid"] = [bssids.setdefault(str(p.get("bssid", "")), len(bssids)) for p in points]
+        record["bssids"] = list(bssids)
+    return record
+
+
+def iter_bundle(map_name: str, signal: SurveyData, channel: SurveyData, scale: float = 1.0) -> Iterator[bytes]:
+    """
+    Yields the gzip-compressed bundle of a survey, chunk by chunk.
+
+    The bundle is JSON Lines: a header, one record per (layer, slice of up to
+    POINTS_PER_RECORD points), and an "end" record used to detect truncation.
+    The header's "scale" maps the point coordinates (on the working copy of
+    the plan) back to the original upload: original = working / scale.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+
+    def lines() -> Iterator[Dict[str, Any]]:
+        yield {"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION, "map": map_name, "created": int(time.time()),
+               "scale": scale}
+        records = 0
+        for kind, data in (("signal", signal), ("channel", channel)):
+            for key, points in data.items():
+                for start in range(0, len(points), POINTS_PER_RECORD):
+                    records += 1
+                    yield _encode_record(kind, key, points[start:start + POINTS_PER_RECORD])
+        yield {"type": "end", "records": records}
+
+    for line in lines():
+        chunk = compressor.compress(json.dumps(line, separators=(",", ":")).encode("utf-8") + b"\n")
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def export_bundle(map_name: str, signal: SurveyData, channel: SurveyData, scale: float = 1.0) -> StreamingResponse:
+    """
+    Streams the signal and channel data of a map as a compressed bundle download.
+    """
+    filename = f"{map_name}{BUNDLE_EXTENSION}"
+    return StreamingResponse(
+        iter_bundle(map_name, signal, channel, scale),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+# --- Validation ---
+
+def _check_int(value: Any, name: str) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value != int(value):
+        raise BundleError(f"{name} must be an integer, got {value!r}")
+    return int(value)
+
+
+def _check_float(value: Any, name: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise BundleError(f"{name} must be a number, got {value!r}")
+    return float(value)
+
+
+def _check_key(kind: str, key: Any) -> str:
+    if not isinstance(key, str) or not key or len(key) > 256:
+        raise BundleError(f"Invalid {kind} key {key!r}")
+    if kind == "channel" and not re.fullmatch(r"Channel_\d+", key):
+        raise BundleError(f"Invalid channel key {key!r}")
+    return key
+
+
+def validate_point(kind: str, point: Any) -> Dict[str, Any]:
+    """
+    Validates one scan point and returns it in its canonical form.
+    """
+    if not isinstance(point, dict):
+        raise BundleError(f"A {kind} point must be an object")
+    clean = {"x": _check_int(point.get("x"), "x"), "y": _check_int(point.get("y"), "y")}
+    if kind == "signal":
+        bssid = point.get("bssid", "")
+        if not isinstance(bssid, str):
+            raise BundleError(f"bssid must be a string, got {bssid!r}")
+        return {"bssid": bssid, "signal": _check_float(point.get("signal"), "signal"), **clean}
+    count = _check_int(point.get("count"), "count")
+    if count < 0:
+        raise BundleError(f"count must be positive, got {count}")
+    return {**clean, "count": count}
+
+
+def validate_survey(kind: str, data: Any) -> SurveyData:
+    """
+    Validates a legacy JSON file ({key: [points]}) of signal or channel data.
+    """
+    if not isinstance(data, dict):
+        raise BundleError(f"{kind} data must be an object of layers")
+    clean: SurveyData = {}
+    for key, points in data.items():
+        if not isinstance(points, list):
+            raise BundleError(f"Layer {key!r} must be a list of points")
+        clean[_check_key(kind, key)] = [validate_point(kind, p) for p in points]
+    return clean
+
+
+def _decode_record(record: Dict[str, Any]) -> Tuple[str, str, List[Dict[str, Any]]]:
+    """
+    Validates one columnar record and expands it back to a list of points.
+    """
+    kind = record.get("type")
+    if kind not in ("signal", "channel"):
+        raise BundleError(f"Unknown record type {kind!r}")
+    key = _check_key(kind, record.get("key"))
+    value_field = VALUE_FIELDS[kind]
+
+    columns = [record.get("x"), record.get("y"), record.get(value_field)]
+    if kind == "signal":
+        columns.append(record.get("bssid"))
+        table = record.get("bssids")
+        if not isinstance(table, list) or not all(isinstance(b, str) for b in table):
+            raise BundleError(f"Invalid BSSID table in layer {key!r}")
+    if not all(isinstance(column, list) for column in columns) or len({len(c) for c in columns}) != 1:
+        raise BundleError(f"Columns of layer {key!r} have different lengths")
+
+    points = []
+    for row in zip(*columns):
+        point = {"x": row[0], "y": row[1], value_field: row[2]}
+        if kind == "signal":
+            index = _check_int(row[3], "bssid")
+            if not 0 <= index < len(table):
+                raise BundleError(f"BSSID index {index} out of range in layer {key!r}")
+            point["bssid"] = table[index]
+        points.append(validate_point(kind, point))
+    return kind, key, points
+
+
+def read_bundle(stream: io.BufferedIOBase) -> Tuple[SurveyData, SurveyData]:
+    """
+    Decompresses and validates a bundle record by record.
+
+    Only one line is held in memory at a time besides the decoded survey, and
+    the decompressed size is capped to protect against gzip bombs.
+    Returns the (signal, channel) data.
+    """
+    data: Dict[str, SurveyData] = {"signal": {}, "channel": {}}
+    total = 0
+    records = 0
+    header_seen = end_seen = False
+
+    try:
+        with gzip.GzipFile(fileobj=stream, mode="rb") as gz:
+            reader = io.BufferedReader(gz)
+            while True:
+                line = reader.readline(MAX_RECORD_SIZE + 1)
+                if not line:
+                    break
+                total += len(line)
+                if len(line) > MAX_RECORD_SIZE or total > DATA_MAX_DECOMPRESSED_SIZE:
+                    raise BundleError("Bundle is too large")
+                if not line.strip():
+                    continue
+                if end_seen:
+                    raise BundleError("Data found after the end of the bundle")
+
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise BundleError("Each bundle line must be an object")
+
+                # 1. The header identifies the format and version
+                if not header_seen:
+                    if record.get("format") != BUNDLE_FORMAT:
+                        raise BundleError("Not a heatmap survey bundle")
+                    if record.get("version") != BUNDLE_VERSION:
+                        raise BundleError(f"Unsupported bundle version {record.get('version')!r}")
+                    header_seen = True
+                    continue
+
+                # 2. The end record closes the bundle and counts its records
+                if record.get("type") == "end":
+                    if record.get("records") != records:
+                        raise BundleError("Bundle is incomplete")
+                    end_seen = True
+                    continue
+
+                # 3. Layer records are validated as they arrive
+                kind, key, points = _decode_record(record)
+                data[kind].setdefault(key, []).extend(points)
+                records += 1
+    except (OSError, EOFError, zlib.error) as e:
+        raise BundleError(f"Corrupted bundle: {e}")
+    except json.JSONDecodeError as e:
+        raise BundleError(f"Invalid record: {e}")
+
+    if not end_seen:
+        raise BundleError("Bundle is truncated")
+    return data["signal"], data["channel"]
+
+
+# --- Merge ---
+
+def merge_survey(kind: str, existing: SurveyData, incoming: SurveyData) -> SurveyData:
+    """
+    Merges incoming layers into an existing survey.
+    Points already present (same position, value and BSSID) are not duplicated.
+    """
+    merged = {key: list(points) for key, points in existing.items()}
+    fields = ("x", "y", VALUE_FIELDS[kind], "bssid")
+    for key, points in incoming.items():
+        target = merged.setdefault(key, [])
+        seen = {tuple(p.get(f) for f in fields) for p in target}
+        for point in points:
+            identity = tuple(point.get(f) for f in fields)
+            if identity not in seen:
+                seen.add(identity)
+                target.append(point)
+    return merged
@@ -0,0 +1,203 @@
+from __future__ import annotations
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from config import VALUE_FIELDS, FIELD_CACHE_BYTES, RADIUS, SIGMA
+from helpers.data_handler import find_data_list, data_version
+from helpers.import_handler import lazy_module
+from helpers.buffer_handler import buffer_pool
+
+# OpenCV and NumPy are imported on the first computation, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+# Below this coverage a pixel is considered too far from any scan to have a value
+MIN_COVERAGE = 0.01
+
+DataPoint = Dict[str, Any]
+
+
+class Field:
+    """
+    Continuous version of a layer's scan points over the whole plan.
+
+    - `coverage`: blurred sum of the disks drawn around each point. It is ~1
+      next to a scan and fades to 0 away from all scans.
+    - `mean`: Gaussian-weighted mean of the measured values around each pixel
+      (dBm for signal, AP count for channel), i.e. the interpolated value.
+
+    The rendered intensity for a value range [min, max] is
+    coverage * (mean - min) / (max - min), which is the blur of the normalized
+    disks the heatmap used to be drawn from.
+    """
+    __slots__ = ("mean", "coverage")
+
+    def __init__(self, mean: np.ndarray, coverage: np.ndarray):
+        self.mean = mean
+        self.coverage = coverage
+
+    @property
+    def nbytes(self) -> int:
+        return self.mean.nbytes + self.coverage.nbytes
+
+    def value_at(self, x: int, y: int) -> Optional[float]:
+        """Interpolated value at a pixel, or None if it is too far from any scan."""
+        h, w = self.mean.shape
+        if not (0 <= x < w and 0 <= y < h) or self.coverage[y, x] < MIN_COVERAGE:
+            return None
+        return float(self.mean[y, x])
+
+
+def _disk(radius: int) -> np.ndarray:
+    """Float32 stamp of a filled disk, as drawn by cv2.circle."""
+    stamp = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.float32)
+    cv2.circle(stamp, (radius, radius), radius, 1.0, -1)
+    return stamp
+
+
+def compute_field(data: List[DataPoint], value_field: str, shape: Tuple[int, int],
+                  radius: int = RADIUS, sigma: float = SIGMA) -> Field:
+    """
+    Builds the field of a layer for a plan of the given (height, width).
+
+    1. Adds a disk of weight 1 (and of weight `value`) around each point.
+       Only the disk's bounding box is touched, no full-size temporaries.
+    2. Blurs both accumulators to get smooth coverage and weighted sums.
+    3. Divides them to get the weighted mean value around each pixel.
+
+    The two accumulators become the (cached) field; the per-point product
+    and the division mask use scratch buffers, not new arrays.
+    """
+    h, w = shape
+    weighted = np.zeros((h, w), dtype=np.float32)
+    coverage = np.zeros((h, w), dtype=np.float32)
+    stamp = _disk(radius)
+    scaled = np.empty_like(stamp)
+
+    for point in data:
+        x, y = int(point["x"]), int(point["y"])
+        value = float(point[value_field])
+
+        # Clip the disk's bounding box to the image
+        x0, x1 = max(x - radius, 0), min(x + radius + 1, w)
+        y0, y1 = max(y - radius, 0), min(y + radius + 1, h)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        sy, sx = slice(y0 - (y - radius), y1 - (y - radius)), slice(x0 - (x - radius), x1 - (x - radius))
+
+        coverage[y0:y1, x0:x1] += stamp[sy, sx]
+        weighted[y0:y1, x0:x1] += np.multiply(stamp[sy, sx], value, out=scaled[sy, sx])
+
+    cv2.GaussianBlur(coverage, (0, 0), sigmaX=sigma, sigmaY=sigma, dst=coverage)
+    cv2.GaussianBlur(weighted, (0, 0), sigmaX=sigma, sigmaY=sigma, dst=weighted)
+
+    # weighted / coverage where there is coverage, 0 elsewhere
+    with buffer_pool.borrow((h, w), np.bool_) as covered:
+        np.greater(coverage, 1e-6, out=covered)
+        mean = np.divide(weighted, coverage, out=weighted, where=covered)
+        np.logical_not(covered, out=covered)
+        np.copyto(mean, 0.0, where=covered)
+    return Field(mean, coverage)
+
+
+class FieldCache:
+    """
+    LRU cache of computed fields, bounded by their total size in bytes.
+    Keys include the data version, so a new scan never serves a stale field.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._fields: "OrderedDict[Tuple[Any, ...], Field]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[Field]:
+        with self._lock:
+            field = self._fields.get(key)
+            if field is not None:
+                self._fields.move_to_end(key)
+            return field
+
+    def put(self, key: Tuple[Any, ...], field: Field) -> None:
+        with self._lock:
+            if key in self._fields:
+                self._bytes -= self._fields.pop(key).nbytes
+            self._fields[key] = field
+            self._bytes += field.nbytes
+            # Evict the least recently used fields, but always keep the newest one
+            while self._bytes > self.max_bytes and len(self._fields) > 1:
+                _, evicted = self._fields.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def discard_map(self, map_name: str) -> None:
+        """Drops every field of a map (e.g. when it is deleted)."""
+        with self._lock:
+            for key in [k for k in self._fields if k[0] == map_name]:
+                self._bytes -= self._fields.pop(key).nbytes
+
+
+# Shared field cache used by the renderer and the query endpoints
+field_cache = FieldCache(FIELD_CACHE_BYTES)
+
+
+def get_field(map_name: str, data_type: str, key: str, shape: Tuple[int, int],
+              radius: int = RADIUS, sigma: float = SIGMA) -> Field:
+    """
+    Returns the field of a layer ("signal" or "channel" data), from the cache
+    if it was already computed for the same data version, radius and sigma.
+    """
+    cache_key = (map_name, data_type, key, tuple(shape), radius, sigma, data_version(map_name, data_type))
+    field = field_cache.get(cache_key)
+    if field is None:
+        data = find_data_list(map_name, key, data_type)
+        field = compute_field(data, VALUE_FIELDS[data_type], shape, radius, sigma)
+        field_cache.put(cache_key, field)
+    return field
+
+
+def best_field(fields: List[Field], out: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Field:
+    """
+    Combines several fields into the best value at each pixel (e.g. the strongest
+    signal across a set of SSIDs), with a running np.maximum reduction.
+    Pixels too far from any scan of a layer do not take part for that layer.
+    The result is written into the (mean, coverage) arrays of `out` when given.
+    """
+    shape = fields[0].mean.shape
+    mean, coverage = out if out is not None else (np.empty(shape, np.float32), np.empty(shape, np.float32))
+    mean.fill(-np.inf)
+    coverage.fill(0)
+    with buffer_pool.borrow(shape, np.float32) as candidate, buffer_pool.borrow(shape, np.bool_) as far:
+        for field in fields:
+            np.less(field.coverage, MIN_COVERAGE, out=far)
+            np.copyto(candidate, field.mean)
+            np.copyto(candidate, -np.inf, where=far)
+            np.maximum(mean, candidate, out=mean)
+            np.maximum(coverage, field.coverage, out=coverage)
+        np.isneginf(mean, out=far)
+        np.copyto(mean, 0.0, where=far)
+    return Field(mean, coverage)
+
+
+def sum_field(fields: List[Field], out: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Field:
+    """
+    Combines several fields into their sum at each pixel (e.g. the total
+    congestion across channels). The result is scaled so that its rendered
+    intensity is the normalized sum of the layers' weighted values.
+    The result is written into the (mean, coverage) arrays of `out` when given.
+    """
+    shape = fields[0].mean.shape
+    total, coverage = out if out is not None else (np.empty(shape, np.float32), np.empty(shape, np.float32))
+    total.fill(0)
+    coverage.fill(0)
+    with buffer_pool.borrow(shape, np.float32) as weighted, buffer_pool.borrow(shape, np.bool_) as covered:
+        for field in fields:
+            np.multiply(field.mean, field.coverage, out=weighted)
+            total += weighted
+            np.maximum(coverage, field.coverage, out=coverage)
+        # Store the sum as a mean over the combined coverage (coverage * mean == total)
+        np.greater(coverage, 1e-6, out=covered)
+        mean = np.divide(total, coverage, out=total, where=covered)
+        np.logical_not(covered, out=covered)
+        np.copyto(mean, 0.0, where=covered)
+    return Field(mean, coverage)
@@ -1,10 +1,68 @@
 from fastapi import File, UploadFile, status
 from fastapi.responses import RedirectResponse, JSONResponse
-from config import MAPS_DIR, MAPS_ALLOWED_EXTENSIONS
+from config import MAPS_DIR, MAPS_ALLOWED_EXTENSIONS, MAPS_POSSIBLE_EXTENSIONS, MAPS_MAX_UPLOAD_SIZE, \
+    MAPS_MAX_PIXELS, ORIGINALS_DIR
 from pathlib import Path
-from pdf2image import convert_from_bytes
 from helpers.data_handler import delete_json
-from typing import Optional, Union
+from helpers.catalog_handler import map_catalog
+from helpers.shm_handler import plan_store
+from helpers.session_handler import delete_sessions
+from helpers.heatmap_handler import plan_sidecar, write_plan_sidecar
+from helpers.upload_handler import stream_to_temp, commit_upload, UploadTooLargeError
+from helpers.lock_handler import write_json_atomic
+from helpers.import_handler import lazy_module
+import glob
+import math
+import os
+import tempfile
+from typing import Optional, Tuple, Union
+
+# pdf2image is only needed when a PDF is uploaded, Pillow when a plan is uploaded
+pdf2image = lazy_module("pdf2image")
+PIL_Image = lazy_module("PIL.Image")
+PIL_ImageOps = lazy_module("PIL.ImageOps")
+
+
+def plan_metadata_path(map_name: str) -> Path:
+    """Path of the normalization metadata of a plan (original file, checksum, scale)."""
+    return ORIGINALS_DIR / f"{map_name}.json"
+
+
+def normalize_plan(image: "PIL_Image.Image") -> Tuple["PIL_Image.Image", Tuple[int, int], float]:
+    """
+    Turns an uploaded plan into its canonical working copy.
+
+    1. Applies the EXIF orientation, since the metadata is dropped afterwards.
+    2. Flattens transparency on white and converts to RGB.
+    3. Downscales it to at most MAPS_MAX_PIXELS pixels.
+
+    Returns the working image, the (oriented) original size and the scale
+    factor from original to working coordinates.
+    """
+    width, height = image.size
+    scale = min(1.0, math.sqrt(MAPS_MAX_PIXELS / (width * height)))
+    if scale < 1.0:
+        # JPEG can decode directly at a reduced size, which is much faster
+        image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+
+    drafted = image.size
+    image = PIL_ImageOps.exif_transpose(image)
+    if image.size != drafted:
+        width, height = height, width  # Rotated by 90°
+
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = PIL_Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if image.size != target:
+        image = image.resize(target, PIL_Image.LANCZOS)
+    image.load()
+    return image, (width, height), target[0] / width
 
 
 def load_file(page_path: str, file: UploadFile = File(...)) -> RedirectResponse:
@@ -12,6 +70,15 @@ def load_file(page_path: str, file: UploadFile = File(...)) -> RedirectResponse:
     Handles uploading a new map file (Image or PDF).
     It validates the file type, checks for conflicts, converts PDFs to PNGs,
     and saves the final image to the MAPS_DIR.
+
+    The upload is streamed to a temporary file (bounded by MAPS_MAX_UPLOAD_SIZE)
+    and only renamed into MAPS_DIR once it is complete, so a failed or
+    oversized upload never leaves a truncated plan behind.
+
+    Every plan is normalized (see normalize_plan) to a metadata-free PNG
+    working copy of bounded size. The original file is kept in ORIGINALS_DIR,
+    next to a JSON file with its checksum, sizes and the scale factor that
+    maps working coordinates (clicks, scan points) to the original.
     """
     # Get the file extension (e.g., ".pdf", ".png")
     ext = Path(file.filename).suffix.lower()
@@ -20,40 +87,79 @@ def load_file(page_path: str, file: UploadFile = File(...)) -> RedirectResponse:
     if ext not in MAPS_ALLOWED_EXTENSIONS:
         return RedirectResponse(url=page_path, status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
-    file_path = MAPS_DIR / file.filename
+    # Only keep the base name so the upload cannot escape MAPS_DIR
+    # Working copies are always stored as PNG
+    map_name = Path(Path(file.filename).name).stem
+    file_path = MAPS_DIR / f"{map_name}.png"
 
-    # Check if a file with the same name already exists
-    if file_path.exists():
+    # Check if a map with the same name already exists, whatever its extension
+    if any((MAPS_DIR / f"{map_name}{e}").exists() for e in MAPS_POSSIBLE_EXTENSIONS):
         return RedirectResponse(url=page_path, status_code=status.HTTP_409_CONFLICT)
 
-    # Special handling for PDF files
-    if ext == ".pdf":
-        name = Path(file.filename).stem
-        # Define the output path as .png
-        file_path = MAPS_DIR / f"{name}.png"
+    try:
+        # Stream the upload to a temp file in MAPS_DIR, computing its checksum
+        tmp_path, checksum = stream_to_temp(file, MAPS_DIR, MAPS_MAX_UPLOAD_SIZE)
+    except UploadTooLargeError as e:
+        print(f"Rejected upload: {e}")
+        return RedirectResponse(url=page_path, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
-        if file_path.exists():
-            return RedirectResponse(url=page_path, status_code=status.HTTP_409_CONFLICT)
+    png_path = None
+    try:
+        # Special handling for PDF files
+        if ext == ".pdf":
+            # Convert the first page of the streamed PDF to an image
+            images = pdf2image.convert_from_path(str(tmp_path), first_page=1, last_page=1)
 
-        # Read PDF bytes and convert the first page to an image
-        pdf_bytes = file.file.read()
-        images = convert_from_bytes(pdf_bytes, first_page=1, last_page=1)
+            if not images:
+                tmp_path.unlink(missing_ok=True)
+                return RedirectResponse(url=page_path, status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 
-        if images:
             image = images[0]
             # Auto-rotate the image if it's in portrait mode (taller than wide)
             if image.height > image.width:
                 image = image.rotate(90, expand=True)
+            image, original_size, scale = normalize_plan(image)
+        else:
+            # Close the upload before it is moved to ORIGINALS_DIR
+            with PIL_Image.open(tmp_path) as source:
+                image, original_size, scale = normalize_plan(source)
+
+        # Save the working PNG next to its destination (without metadata)
+        fd, png_name = tempfile.mkstemp(dir=MAPS_DIR, prefix=".upload-", suffix=".part")
+        os.close(fd)
+        png_path = Path(png_name)
+        image.save(str(png_path), "PNG")
+
+        # Keep the original, then atomically move the working copy into MAPS_DIR
+        commit_upload(tmp_path, ORIGINALS_DIR / f"{map_name}{ext}")
+        write_json_atomic(plan_metadata_path(map_name), {
+            "original": f"{map_name}{ext}",
+            "sha256": checksum,
+            "original_size": list(original_size),
+            "size": list(image.size),
+            "scale": scale,
+        })
+        commit_upload(png_path, file_path)
+    except (PIL_Image.UnidentifiedImageError, PIL_Image.DecompressionBombError) as e:
+        tmp_path.unlink(missing_ok=True)
+        print(f"Rejected map {file.filename}: {e}")
+        return RedirectResponse(url=page_path, status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        if png_path:
+            png_path.unlink(missing_ok=True)
+        print(f"Error storing map {file_path.name}: {e}")
+        return RedirectResponse(url=page_path, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            MAPS_DIR.mkdir(parents=True, exist_ok=True)
-            # Save the converted image as PNG
-            image.save(str(file_path), "PNG")
-    else:
-        # Standard image file (PNG, JPG, JPEG)
-        MAPS_DIR.mkdir(parents=True, exist_ok=True)
-        # Write the file bytes directly to the maps directory
-        with open(file_path, "wb") as f:
-            f.write(file.file.read())
+    print(f"Stored map {file_path.name} (original sha256 {checksum}, scale {scale:.3f})")
+
+    # Decode the plan once now: renders then memory-map the raw pixels
+    try:
+        write_plan_sidecar(file_path)
+    except Exception as e:
+        print(f"Error writing plan sidecar for {file_path.name}: {e}")
+
+    map_catalog.refresh(file_path.stem)
 
     # Redirect the user back to the page they uploaded from
     return RedirectResponse(url=page_path, status_code=status.HTTP_303_SEE_OTHER)
@@ -64,13 +170,24 @@ def delete_file(map_name: str) -> JSONResponse:
     Deletes a map image file and its associated JSON scan data.
     """
     # Iterate through possible image extensions to find the file
-    for ext in [".png", ".jpg", ".jpeg"]:
+    for ext in MAPS_POSSIBLE_EXTENSIONS:
         map_file = MAPS_DIR / f"{map_name}{ext}"
         if map_file.exists():
             map_file.unlink()  # Delete the image file
+        plan_sidecar(map_file).unlink(missing_ok=True)  # And its decoded pixels
+
+    # Delete the original upload and its metadata
+    for original in ORIGINALS_DIR.glob(f"{glob.escape(map_name)}.*"):
+        if original.stem == map_name:
+            original.unlink(missing_ok=True)
+
+    # Free the plan's shared memory once the renders using it are done
+    plan_store.discard(map_name)
 
     # Call the function from data_handler to delete associated scan data
+    # (this also drops the map from the catalog)
     delete_json(map_name)
+    delete_sessions(map_name)
 
     return JSONResponse(content={"status": "deleted"}, status_code=status.HTTP_200_OK)
 
@@ -80,12 +197,8 @@ def find_map_url(map_name: str) -> Optional[str]:
     Finds the full, web-accessible URL for a given map name (without extension).
     Returns the URL (e.g., "/static/maps/my_map.png") or None if not found.
     """
-    for ext in [".png", ".jpg", ".jpeg"]:
-        map_file = MAPS_DIR / f"{map_name}{ext}"
-        if map_file.exists():
-            # Return the static URL
-            return f"/static/maps/{map_name}{ext}"
-    return None
+    entry = map_catalog.get(map_name)
+    return entry.url if entry else None
 
 
 def find_map(map_name: str) -> Optional[Path]:
@@ -93,10 +206,5 @@ def find_map(map_name: str) -> Optional[Path]:
     Finds the full file system Path object for a given map name.
     Returns the Path object or None if not found.
     """
-    for ext in [".png", ".jpg", ".jpeg"]:
-        filename = f"{map_name}{ext}"
-        map_file = MAPS_DIR / filename
-        if map_file.exists():
-            # Return the Pathlib Path object
-            return map_file
-    return None
\ No newline at end of file
+    entry = map_catalog.get(map_name)
+    return entry.path if entry else None
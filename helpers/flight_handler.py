@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# Number of clients whose latest render is remembered
+MAX_CLIENTS = 1024
+
+
+class RenderCancelled(Exception):
+    """Raised when every request waiting for a render was superseded."""
+
+
+class RenderTicket:
+    """
+    Identifies one render request of a client (e.g. one heatmap page).
+    A newer request of the same client supersedes it.
+    """
+    __slots__ = ("_tickets", "client", "generation")
+
+    def __init__(self, tickets: "RenderTickets", client: Optional[str], generation: int):
+        self._tickets = tickets
+        self.client = client
+        self.generation = generation
+
+    @property
+    def superseded(self) -> bool:
+        # Requests without a client id are never superseded
+        return self.client is not None and self._tickets.latest(self.client) != self.generation
+
+
+class RenderTickets:
+    """
+    Remembers the latest render request of each client, so older ones can
+    stop before their expensive stages.
+    """
+
+    def __init__(self, max_clients: int = MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._latest: "OrderedDict[str, int]" = OrderedDict()
+
+    def claim(self, client: Optional[str]) -> RenderTicket:
+        """Returns the ticket of a new request, superseding the client's previous ones."""
+        if not client:
+            return RenderTicket(self, None, 0)
+        with self._lock:
+            generation = self._latest.pop(client, 0) + 1
+            self._latest[client] = generation
+            while len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+        return RenderTicket(self, client, generation)
+
+    def latest(self, client: str) -> int:
+        with self._lock:
+            return self._latest.get(client, 0)
+
+
+class Flight:
+    """One computation in progress and the tickets of the requests waiting for it."""
+    __slots__ = ("future", "tickets")
+
+    def __init__(self, ticket: RenderTicket):
+        self.future: Future = Future()
+        self.tickets: List[RenderTicket] = [ticket]
+
+    def cancelled(self) -> bool:
+        """True when nobody wants the result anymore."""
+        return all(ticket.superseded for ticket in self.tickets)
+
+    def check(self) -> None:
+        """Cancellation point: raises RenderCancelled if the render is no longer wanted."""
+        if self.cancelled():
+            raise RenderCancelled("Superseded by a newer render request")
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations (same key): the first
+    request runs it, the others wait for its result instead of repeating it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+
+    def run(self, key: Hashable, ticket: RenderTicket, fn: Callable[[Flight], Any]) -> Any:
+        """
+        Returns fn(flight) for the key, computed once for all concurrent callers.
+        `fn` receives the flight and should call `flight.check()` before each
+        expensive stage: it raises RenderCancelled when every waiting request
+        was superseded.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight(ticket)
+                else:
+                    flight.tickets.append(ticket)
+
+            if not leader:
+                try:
+                    return flight.future.result()
+                except RenderCancelled:
+                    # Cancelled just before this request joined: run it again
+                    if ticket.superseded:
+                        raise
+                    continue
+
+            try:
+                result = fn(flight)
+            except BaseException as e:
+                flight.future.set_exception(e)
+                raise
+            else:
+                flight.future.set_result(result)
+                return result
+            finally:
+                with self._lock:
+                    del self._flights[key]
+
+
+# Shared by every render of this process
+render_tickets = RenderTickets()
+render_flights = SingleFlight()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+from config import COLORMAPS
+from helpers.data_handler import data_version
+from helpers.field_handler import MIN_COVERAGE, RADIUS, SIGMA, get_field
+from helpers.flight_handler import Flight, RenderTicket, render_flights, render_tickets
+from helpers.buffer_handler import buffer_pool, colormap_lut
+from helpers.import_handler import lazy_module
+
+# OpenCV and NumPy are imported on the first computation, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+# Longest side of the grid sent to the browser, in cells
+DEFAULT_GRID_SIZE = 256
+MAX_GRID_SIZE = 1024
+
+
+def grid_shape(shape: Tuple[int, int], size: int) -> Tuple[int, int]:
+    """(height, width) of a grid whose longest side is `size`, with the plan's aspect ratio."""
+    h, w = shape
+    scale = min(1.0, size / max(h, w))
+    return max(1, round(h * scale)), max(1, round(w * scale))
+
+
+def layer_grid(map_name: str, data_type: str, key: str, shape: Tuple[int, int],
+               value_range: Tuple[float, float], size: int = DEFAULT_GRID_SIZE,
+               radius: int = RADIUS, sigma: float = SIGMA, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
+    """
+    Returns a layer's quantized grid (see _layer_grid). Like the image
+    renders, identical requests in flight are computed once, and a grid
+    whose requests were all superseded by newer ones of their client stops
+    at its next stage and raises RenderCancelled.
+    """
+    flight_key = ("grid", map_name, data_type, key, shape, value_range, size, radius, sigma,
+                  data_version(map_name, data_type))
+    return render_flights.run(
+        flight_key, ticket or render_tickets.claim(None),
+        lambda flight: _layer_grid(flight, map_name, data_type, key, shape, value_range, size, radius, sigma)
+    )
+
+
+def _layer_grid(flight: Flight, map_name: str, data_type: str, key: str, shape: Tuple[int, int],
+                value_range: Tuple[float, float], size: int, radius: int, sigma: float) -> Dict[str, Any]:
+    """
+    Quantizes a layer's field into a small grid for client-side rendering.
+
+    1. Normalizes the (cached) field's mean to 0 - 1 over the value range,
+       and computes the intensity blend_heatmap colors:
+       min(normalized mean * coverage, 1), with the coverage unclipped
+       (it reaches well above 1 where scans are dense).
+    2. Downsamples the value, the intensity and the coverage to the grid with
+       cv2.resize (INTER_AREA averages the pixels of each cell).
+    3. Stores them as uint8 planes, row-major.
+
+    The browser colors a cell with the color map entry of its intensity byte,
+    and a cell is surveyed (for the threshold view) when its coverage byte
+    reaches `surveyed`. Changing the color map, opacity or threshold needs no
+    new request; a value byte v stands for min + v / 255 * (max - min).
+    """
+    min_val, max_val = value_range
+    flight.check()
+    field = get_field(map_name, data_type, key, shape, radius, sigma)
+    flight.check()
+    gh, gw = grid_shape(shape, size)
+
+    planes = np.empty((3, gh, gw), dtype=np.uint8)
+    with buffer_pool.borrow(shape, np.float32) as norm, buffer_pool.borrow(shape, np.float32) as intensity, \
+            buffer_pool.borrow((gh, gw), np.float32) as cell:
+        # 1. clip((mean - min) / (max - min)) and min(norm * coverage, 1), in place
+        np.subtract(field.mean, min_val, out=norm)
+        np.multiply(norm, 1.0 / (max_val - min_val), out=norm)
+        np.clip(norm, 0, 1, out=norm)
+        np.multiply(norm, field.coverage, out=intensity)
+        np.minimum(intensity, 1, out=intensity)
+
+        # 2-3. Each plane: average per cell, then scale to 0 - 255
+        for plane, source in zip(planes, (norm, intensity, field.coverage)):
+            cv2.resize(source, (gw, gh), dst=cell, interpolation=cv2.INTER_AREA)
+            np.multiply(cell, 255, out=cell)
+            np.clip(cell, 0, 255, out=cell)
+            np.rint(cell, out=cell)
+            np.copyto(plane, cell, casting="unsafe")
+
+    return {
+        "width": gw, "height": gh,
+        "min": min_val, "max": max_val,
+        "surveyed": int(np.ceil(MIN_COVERAGE * 255)),
+        "value": planes[0].tobytes(),
+        "intensity": planes[1].tobytes(),
+        "coverage": planes[2].tobytes(),
+    }
+
+
+def colormap_tables() -> Dict[str, str]:
+    """
+    The 256 RGB colors of every offered color map, as hex strings
+    ("rrggbb" per level), for the heatmap page's client-side rendering.
+    """
+    return {name: colormap_lut(name)[:, 0, ::-1].tobytes().hex() for name in COLORMAPS}
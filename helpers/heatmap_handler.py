@@ -1,61 +1,249 @@
-import cv2
-import numpy as np
+from __future__ import annotations
+import os
+import time
 import uuid
 import shutil
 import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any
-from config import GENERATED_DIR
+from typing import List, Dict, Any, Optional, Tuple
+from config import GENERATED_DIR, GENERATED_MAX_AGE, VALUE_RANGES, RENDER_PROCESSES, HeatmapParams
+from helpers.data_handler import data_version
+from helpers.flight_handler import Flight, RenderCancelled, RenderTicket, render_flights, render_tickets
+from helpers.import_handler import lazy_module
+from helpers.field_handler import Field, MIN_COVERAGE, get_field, best_field, sum_field
+from helpers.shm_handler import PlanHandle, plan_store, attach_plan
+from helpers.buffer_handler import buffer_pool, colormap_lut
+
+# OpenCV and NumPy are imported on the first render, not at startup
+cv2 = lazy_module("cv2")
+np = lazy_module("numpy")
+
+# Render process pool (see render_layer), started on first use
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Last cleanup of the generated images (see delete_heatmap)
+_last_cleanup = 0.0
+# Minimum delay between two cleanups, in seconds
+CLEANUP_INTERVAL = 60
+
+
+def draw_heatmap(map_name: str, key: str, map_path: Path,
+                 params: Optional[HeatmapParams] = None, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
+    """
+    Generates a signal strength heatmap image.
 
-# Define a type alias for the data points for clarity
-DataPoint = Dict[str, Any]
+    This function takes the signal field of an "SSID [Band]" key (dBm),
+    creates a heatmap overlay, and blends it with the base map image.
+    """
+    # Signal (dBm) typically ranges from -90 (worst) to -30 (best)
+    return render_layer(map_name, "signal", key, map_path, params or HeatmapParams(), ticket)
 
 
-def draw_heatmap(data: List[DataPoint], map_path: Path) -> Dict[str, Any]:
+def channel_heatmap(map_name: str, channel: str, map_path: Path,
+                    params: Optional[HeatmapParams] = None, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
     """
-    Generates a signal strength heatmap image.
+    Generates a channel congestion heatmap image.
 
-    This function takes signal data points (dBm), creates a heatmap overlay,
-    and blends it with the base map image.
+    This function takes the channel count field of a "Channel_X" key,
+    creates a heatmap overlay, and blends it with the base map image.
     """
-    delete_heatmap()  # Clear any previously generated images
-    img = create_img(map_path)  # Load the base map image
+    # We'll map count values from 0 (min) to 20 (max congestion)
+    return render_layer(map_name, "channel", channel, map_path, params or HeatmapParams(), ticket)
 
-    # Generate the heatmap overlay using signal strength values
-    # Signal (dBm) typically ranges from -90 (worst) to -30 (best)
-    overlay = generate_heatmap("signal", -90, -30, data, img)
 
-    # Create a unique filename for the generated image
-    output_filename = f"{uuid.uuid4()}.jpg"
-    output_path = GENERATED_DIR / output_filename
+def ap_heatmap(map_name: str, bssid: str, map_path: Path,
+               params: Optional[HeatmapParams] = None, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
+    """
+    Generates the signal heatmap of a single access point (BSSID).
 
-    # Save the final blended image to the 'generated' directory
+    Its samples come from the AP store, so it includes the scans where the
+    AP was not the strongest one of its SSID.
+    """
+    return render_layer(map_name, "ap", bssid, map_path, params or HeatmapParams(), ticket)
+
+
+def _params_key(params: HeatmapParams) -> Tuple[Any, ...]:
+    """The rendering parameters as a hashable key (identical renders share it)."""
+    return params.radius, params.sigma, params.min_value, params.max_value, params.colormap, params.alpha
+
+
+def render_layer(map_name: str, data_type: str, key: str, map_path: Path,
+                 params: HeatmapParams, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
+    """
+    Renders one layer ("signal", "channel" or "ap" data) over its map.
+
+    Identical renders in flight (same layer, data version and parameters)
+    are computed once and share the resulting image. When every request
+    waiting for a render has been superseded by a newer one of its client
+    (see flight_handler), the render stops at its next stage and raises
+    RenderCancelled.
+    """
+    flight_key = ("layer", map_name, data_type, key, str(map_path), _params_key(params),
+                  data_version(map_name, data_type))
+    return render_flights.run(
+        flight_key, ticket or render_tickets.claim(None),
+        lambda flight: _render_layer(flight, map_name, data_type, key, map_path, params)
+    )
+
+
+def _render_layer(flight: Flight, map_name: str, data_type: str, key: str, map_path: Path,
+                  params: HeatmapParams) -> Dict[str, Any]:
+    """
+    Runs one render for render_layer.
+
+    With HEATMAP_RENDER_PROCESSES set, the render runs in the process pool:
+    the decoded plan is published once in shared memory (see shm_handler)
+    and the worker only receives its handle. Otherwise, it runs here.
+    """
+    delete_heatmap()  # Clear the images of earlier renders
+
+    if RENDER_PROCESSES <= 0:
+        flight.check()
+        img = create_img(map_path)  # Load the base map image
+        field = get_field(map_name, data_type, key, img.shape[:2], params.radius, params.sigma)
+        flight.check()
+        with buffer_pool.borrow(img.shape, np.uint8) as overlay:
+            blend_heatmap(field, *value_range(data_type, params), img, params.colormap, params.alpha, out=overlay)
+            flight.check()
+            return save_heatmap(overlay)
+
+    flight.check()
+    output_filename = f"{uuid.uuid4()}.jpg"
+    plan = plan_store.acquire(map_name, map_path, create_img)
     try:
-        cv2.imwrite(str(output_path), overlay)
+        future = _render_pool().submit(_render_job, plan, map_name, data_type, key, params,
+                                       str(GENERATED_DIR / output_filename))
+        while True:
+            try:
+                future.result(timeout=0.05)
+                break
+            except FutureTimeoutError:
+                # A job still waiting for a render process can be dropped
+                if flight.cancelled() and future.cancel():
+                    raise RenderCancelled("Superseded by a newer render request")
+    except RenderCancelled:
+        raise
+    except BrokenProcessPool as e:
+        print(f"Error rendering heatmap in the process pool: {e}")
+        _reset_render_pool()  # Start a new pool on the next render
+        return {"error": "Failed to save heatmap image"}
     except Exception as e:
-        print(f"Error writing heatmap image: {e}")
+        print(f"Error rendering heatmap in the process pool: {e}")
         return {"error": "Failed to save heatmap image"}
+    finally:
+        plan_store.release(plan)
+
+    return {"url": f"/static/generated/{output_filename}"}
+
+
+def _render_pool() -> ProcessPoolExecutor:
+    """Returns the render process pool, started on the first pooled render."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # "spawn" everywhere: forking a server process with running threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
 
-    # Return the URL to the new image and the original data points
-    # (data points are used by frontend JS for hover-tooltips)
-    return {"url": f"/static/generated/{output_filename}",
-            "points": data}
+def _reset_render_pool() -> None:
+    """Drops a pool whose worker died, so the next render starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
 
 
-def channel_heatmap(data: List[DataPoint], map_path: Path) -> Dict[str, Any]:
+def _render_job(plan: PlanHandle, map_name: str, data_type: str, key: str,
+                params: HeatmapParams, output_path: str) -> None:
     """
-    Generates a channel congestion heatmap image.
+    Runs in a render process: blends a layer over a plan attached from
+    shared memory (no copy of the image) and writes the result.
+    Each process keeps its own field cache, read from the data files.
+    """
+    img = attach_plan(plan)
+    field = get_field(map_name, data_type, key, img.shape[:2], params.radius, params.sigma)
+    with buffer_pool.borrow(img.shape, np.uint8) as overlay:
+        blend_heatmap(field, *value_range(data_type, params), img, params.colormap, params.alpha, out=overlay)
+        if not cv2.imwrite(output_path, overlay):
+            raise IOError(f"cv2.imwrite failed to write {output_path}")
 
-    This function takes channel count data, creates a heatmap overlay,
-    and blends it with the base map image.
+
+def aggregate_heatmap(map_name: str, mode: str, keys: List[str], map_path: Path, threshold: float = -67,
+                      params: Optional[HeatmapParams] = None, ticket: Optional[RenderTicket] = None) -> Dict[str, Any]:
     """
-    delete_heatmap()  # Clear any previously generated images
+    Generates an aggregate heatmap image over several layers.
+
+    - "best": strongest signal across the given "SSID [Band]" keys.
+    - "threshold": where the best signal across the keys reaches `threshold` dBm
+      (green) or not (red).
+    - "congestion": total AP count across the given "Channel_X" keys.
+
+    The per-key fields come from the field cache, so only the reduction
+    and the final blend are computed for each request. Identical requests
+    in flight are coalesced like in render_layer.
+    """
+    params = params or HeatmapParams()
+    data_type = "channel" if mode == "congestion" else "signal"
+    flight_key = ("aggregate", map_name, mode, tuple(keys), str(map_path), threshold, _params_key(params),
+                  data_version(map_name, data_type))
+    return render_flights.run(
+        flight_key, ticket or render_tickets.claim(None),
+        lambda flight: _aggregate_heatmap(flight, map_name, mode, keys, map_path, threshold, params)
+    )
+
+
+def _aggregate_heatmap(flight: Flight, map_name: str, mode: str, keys: List[str], map_path: Path,
+                       threshold: float, params: HeatmapParams) -> Dict[str, Any]:
+    """Runs one aggregate render for aggregate_heatmap."""
+    delete_heatmap()  # Clear the images of earlier renders
+    flight.check()
     img = create_img(map_path)  # Load the base map image
+    shape = img.shape[:2]
+
+    with buffer_pool.borrow(shape, np.float32) as mean, buffer_pool.borrow(shape, np.float32) as coverage, \
+            buffer_pool.borrow(img.shape, np.uint8) as overlay:
+        if mode == "congestion":
+            field = sum_field([get_field(map_name, "channel", key, shape, params.radius, params.sigma)
+                               for key in keys], out=(mean, coverage))
+            # Total counts over several channels: use a wider range than one channel
+            blend_heatmap(field, *value_range("congestion", params), img, params.colormap, params.alpha, out=overlay)
+        else:
+            field = best_field([get_field(map_name, "signal", key, shape, params.radius, params.sigma)
+                                for key in keys], out=(mean, coverage))
+            if mode == "threshold":
+                blend_threshold(field, threshold, img, params.alpha, out=overlay)
+            else:
+                blend_heatmap(field, *value_range("signal", params), img, params.colormap, params.alpha, out=overlay)
+
+        flight.check()
+        return save_heatmap(overlay)
+
+
+def value_range(kind: str, params: HeatmapParams) -> Tuple[float, float]:
+    """
+    Returns the (min, max) values mapped to the color map for a kind of layer,
+    using the request's overrides when given.
+    """
+    default_min, default_max = VALUE_RANGES[kind]
+    min_val = default_min if params.min_value is None else params.min_value
+    max_val = default_max if params.max_value is None else params.max_value
+    # Keep a valid range if only one bound was overridden past the other
+    return min_val, max(max_val, min_val + 1e-6)
 
-    # Generate the heatmap overlay using channel counts
-    # We'll map count values from 0 (min) to 20 (max congestion)
-    overlay = generate_heatmap("count", 0, 20, data, img)
 
+def save_heatmap(overlay: np.ndarray) -> Dict[str, Any]:
+    """
+    Saves a blended heatmap to the 'generated' directory and returns its URL.
+    Hover tooltips query /maps/{map_name}/query, so the raw points are not sent.
+    """
     # Create a unique filename for the generated image
     output_filename = f"{uuid.uuid4()}.jpg"
     output_path = GENERATED_DIR / output_filename
@@ -67,26 +255,85 @@ def channel_heatmap(data: List[DataPoint], map_path: Path) -> Dict[str, Any]:
         print(f"Error writing heatmap image: {e}")
         return {"error": "Failed to save heatmap image"}
 
-    # Return the URL and data points, same as draw_heatmap
-    return {"url": f"/static/generated/{output_filename}",
-            "points": data}
+    # Return the URL to the new image
+    return {"url": f"/static/generated/{output_filename}"}
 
 
-def delete_heatmap():
+def delete_heatmap(max_age: float = GENERATED_MAX_AGE) -> None:
     """
-    Clears all files from the 'generated' directory.
-    This prevents old heatmap images from accumulating.
+    Deletes the images of the 'generated' directory older than `max_age`
+    seconds, so they do not accumulate. Recent images are kept: they may be
+    the result another request (or another client) is about to load.
+    Runs at most once every CLEANUP_INTERVAL seconds.
     """
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < CLEANUP_INTERVAL:
+        return
+    _last_cleanup = now
+
     for file in GENERATED_DIR.iterdir():
         try:
-            file.unlink()
+            if now - file.stat().st_mtime > max_age:
+                file.unlink()
+        except FileNotFoundError:
+            pass  # Deleted by another worker meanwhile
         except Exception as e:
             print(f"Error deleting old heatmap file {file}: {e}")
 
 
+def plan_sidecar(map_path: Path) -> Path:
+    """Path of the raw .npy copy of a plan's decoded pixels (hidden, next to the plan)."""
+    return map_path.with_name(f".{map_path.name}.npy")
+
+
+def write_plan_sidecar(map_path: Path, img: Optional[np.ndarray] = None) -> None:
+    """
+    Saves a plan's decoded pixels as its .npy sidecar, through a temp file
+    and os.replace so other processes never map a partial file.
+    """
+    if img is None:
+        img = decode_img(map_path)
+    sidecar = plan_sidecar(map_path)
+    fd, tmp_name = tempfile.mkstemp(dir=sidecar.parent, prefix=f"{sidecar.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(img))
+        os.replace(tmp_name, sidecar)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
 def create_img(map_path: Path) -> np.ndarray:
     """
-    Loads an image from the specified path using OpenCV.
+    Loads a plan image as a BGR array.
+
+    The decoded pixels are kept in a raw .npy sidecar next to the plan and
+    memory-mapped (read-only) on later loads: every worker and render process
+    shares the same page-cache-backed pixels instead of decoding the plan.
+    The sidecar is rebuilt when the plan file is newer than it.
+    """
+    sidecar = plan_sidecar(map_path)
+    try:
+        if sidecar.stat().st_mtime_ns >= map_path.stat().st_mtime_ns:
+            return np.load(sidecar, mmap_mode="r")
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Error loading plan sidecar {sidecar.name}, rebuilding it: {e}")
+
+    img = decode_img(map_path)
+    try:
+        write_plan_sidecar(map_path, img)
+    except OSError as e:
+        print(f"Error writing plan sidecar {sidecar.name}: {e}")
+    return img
+
+
+def decode_img(map_path: Path) -> np.ndarray:
+    """
+    Decodes an image from the specified path using OpenCV.
 
     Includes a workaround by copying to a temp file, which can help
     resolve issues with file paths containing special characters.
@@ -112,53 +359,64 @@ def create_img(map_path: Path) -> np.ndarray:
     return img
 
 
-def generate_heatmap(key: str, min_val: int, max_val: int, data: List[DataPoint], img: np.ndarray) -> np.ndarray:
+def blend_heatmap(field: Field, min_val: float, max_val: float, img: np.ndarray,
+                  colormap: str = "turbo", alpha: float = 0.6, out: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Core heatmap generation logic using OpenCV.
-
-    1. Creates a "mask" (a blank canvas) the size of the image.
-    2. Draws circles on the mask for each data point, where the
-       circle's intensity is based on the normalized data value.
-    3. Blurs the mask to create a smooth gradient.
-    4. Applies a color map (e.g., COLORMAP_TURBO) to the blurred mask.
-    5. Blends the color heatmap with the original map image.
-    """
-    h, w = img.shape[:2]
-
-    # 1. Create a floating-point mask for accumulating intensities
-    mask = np.zeros((h, w), dtype=np.float32)
-
-    # 2. Draw circles for each data point
-    for point in data:
-        x, y = int(point["x"]), int(point["y"])
-        value = float(point[key])
-
-        # Normalize the value to a 0.0 - 1.0 range
-        norm_value = np.clip((value - min_val) / (max_val - min_val), 0, 1)
+    Turns a field into a colored heatmap blended with the map image.
+    This is the cheap stage: changing the range, color map or alpha only
+    re-runs it, never the field computation.
 
-        # Convert normalized value to 0-255 intensity
-        intensity = int(norm_value * 255)
+    1. Normalizes the field to a 0 - 255 intensity for the value range.
+    2. Applies a color map (e.g., COLORMAP_TURBO) to the intensity, through
+       its precomputed 256-entry lookup table.
+    3. Blends the color heatmap with the original map image.
 
-        # Create a temporary mask for this single point
-        circle_mask = np.zeros_like(mask)
-        # Draw a filled circle with the calculated intensity
-        cv2.circle(circle_mask, (x, y), 30, intensity, -1)
-
-        # Add this circle to the main mask
-        mask = cv2.add(mask, circle_mask)
-
-    # Clip mask values to 0-255 and convert to 8-bit unsigned integer
-    mask = np.clip(mask, 0, 255).astype(np.uint8)
-
-    # 3. Blur the mask to create the smooth heatmap gradient
-    # A large sigma value (e.g., 30) creates a wide, smooth blur
-    blur = cv2.GaussianBlur(mask, (0, 0), sigmaX=30, sigmaY=30)
-
-    # 4. Apply a color map to the blurred mask
-    heatmap_color = cv2.applyColorMap(blur, cv2.COLORMAP_TURBO)
-
-    # 5. Blend the heatmap with the original image
-    alpha = 0.6  # 60% heatmap, 40% original image
-    overlay = cv2.addWeighted(heatmap_color, alpha, img, 1 - alpha, 0)
-
-    return overlay
\ No newline at end of file
+    Every step writes into pooled buffers (see buffer_handler), and the result
+    into `out` when given, so repeated renders allocate almost nothing.
+    """
+    shape = field.mean.shape
+    with buffer_pool.borrow(shape, np.float32) as norm, buffer_pool.borrow(shape, np.uint8) as mask, \
+            buffer_pool.borrow(img.shape, np.uint8) as heatmap_color:
+        # 1. 255 * coverage * clip((mean - min) / (max - min)), in place, then to an 8-bit mask
+        np.subtract(field.mean, min_val, out=norm)
+        np.multiply(norm, 255.0 / (max_val - min_val), out=norm)
+        np.clip(norm, 0, 255, out=norm)
+        np.multiply(norm, field.coverage, out=norm)
+        np.minimum(norm, 255, out=norm)
+        np.copyto(mask, norm, casting="unsafe")
+
+        # 2. Apply the color map's lookup table to the mask
+        cv2.applyColorMap(mask, colormap_lut(colormap), dst=heatmap_color)
+
+        # 3. Blend the heatmap with the original image
+        # (default alpha 0.6: 60% heatmap, 40% original image)
+        if out is None:
+            out = np.empty_like(img)
+        cv2.addWeighted(heatmap_color, alpha, img, 1 - alpha, 0, dst=out)
+
+    return out
+
+
+def blend_threshold(field: Field, threshold: float, img: np.ndarray, alpha: float = 0.6,
+                    out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Colors the surveyed area green where the field reaches `threshold`
+    and red where it does not, then blends it with the map image.
+    """
+    shape = field.mean.shape
+    with buffer_pool.borrow(shape, np.bool_) as surveyed, buffer_pool.borrow(shape, np.bool_) as passing, \
+            buffer_pool.borrow(img.shape, np.uint8) as heatmap_color:
+        np.greater_equal(field.coverage, MIN_COVERAGE, out=surveyed)
+        np.greater_equal(field.mean, threshold, out=passing)
+        np.logical_and(passing, surveyed, out=passing)
+
+        # BGR colors for each class of pixel
+        np.copyto(heatmap_color, img)
+        np.copyto(heatmap_color, np.array((0, 0, 220), dtype=np.uint8), where=surveyed[..., None])  # Red: below
+        np.copyto(heatmap_color, np.array((0, 200, 0), dtype=np.uint8), where=passing[..., None])  # Green: at or above
+
+        if out is None:
+            out = np.empty_like(img)
+        cv2.addWeighted(heatmap_color, alpha, img, 1 - alpha, 0, dst=out)
+
+    return out
@@ -1,14 +1,90 @@
-from typing import Dict, List, Tuple, Any
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+from typing import Callable, Dict, Hashable, List, Mapping, Optional, Tuple, Any
 from fastapi import Request
-from config import MAPS_DIR, MAPS_POSSIBLE_EXTENSIONS, SIGNAL_DIR, LANG_DIR
+from fastapi.responses import HTMLResponse
+from config import LANG_DIR, DEV_RELOAD, PAGE_CACHE_SIZE, template
+from helpers.catalog_handler import map_catalog
 import json
 
+# In-memory translation catalog: (lang, page) -> (file mtime, frozen translations)
+_catalog: Dict[Tuple[str, str], Tuple[int, Mapping[str, Any]]] = {}
+_catalog_lock = Lock()
+# Bumped whenever the catalog changes, so cached pages using old texts are ignored
+_catalog_generation = 0
 
-def find_language(html_page_name: str, request: Request) -> Tuple[str, Dict[str, Any]]:
+# Rendered HTML pages: (page, lang, data version, catalog generation) -> HTML
+_page_cache: "OrderedDict[Tuple[Any, ...], str]" = OrderedDict()
+_page_cache_lock = Lock()
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turns dicts into read-only mappings and lists into tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _load_translation_file(language_path: Path) -> Mapping[str, Any]:
+    """Loads and freezes one translation file, returning an empty mapping on error."""
+    try:
+        with open(language_path, "r", encoding="utf-8") as f:
+            return _freeze(json.load(f))
+    except Exception as e:
+        print(f"Error loading translation file {language_path}: {e}")
+        return MappingProxyType({})
+
+
+def load_translations() -> None:
+    """
+    Loads every "languages/{lang}/{page}.json" file into the in-memory catalog.
+    Called once at startup; pages then read their translations from memory.
+    """
+    global _catalog_generation
+    with _catalog_lock:
+        _catalog.clear()
+        for language_path in LANG_DIR.glob("*/*.json"):
+            key = (language_path.parent.name, language_path.stem)
+            _catalog[key] = (language_path.stat().st_mtime_ns, _load_translation_file(language_path))
+        _catalog_generation += 1
+
+
+def get_translations(language: str, html_page_name: str) -> Optional[Mapping[str, Any]]:
+    """
+    Returns the translations of a page from the catalog, or None if the file does not exist.
+    With DEV_RELOAD enabled, an entry is reloaded when its file's mtime changes.
+    """
+    global _catalog_generation
+    if not _catalog:
+        load_translations()
+
+    key = (language, html_page_name)
+    entry = _catalog.get(key)
+
+    if DEV_RELOAD:
+        language_path = LANG_DIR / language / f"{html_page_name}.json"
+        mtime = language_path.stat().st_mtime_ns if language_path.exists() else None
+        if mtime != (entry[0] if entry else None):
+            with _catalog_lock:
+                if mtime is None:
+                    _catalog.pop(key, None)
+                    entry = None
+                else:
+                    entry = _catalog[key] = (mtime, _load_translation_file(language_path))
+                _catalog_generation += 1
+
+    return entry[1] if entry else None
+
+
+def find_language(html_page_name: str, request: Request) -> Tuple[str, Mapping[str, Any]]:
     """
-    Determines the correct language and loads the corresponding translation JSON.
+    Determines the correct language and returns the corresponding translations.
     - Reads language from the 'lang' cookie (defaults to 'en').
-    - Loads the JSON file (e.g., "languages/fr/home.json").
+    - Looks the page up in the in-memory catalog (e.g., "fr"/"home").
     - Falls back to English if a translation file is missing.
     """
     # 1. Get language from cookie, default to 'en'
@@ -16,59 +92,86 @@ def find_language(html_page_name: str, request: Request) -> Tuple[str, Dict[str,
     if language not in ["en", "fr"]:
         language = "en"
 
-    # 2. Construct the path to the translation file
-    language_path = LANG_DIR / language / f"{html_page_name}.json"
+    # 2. Look up the translations of this page
+    translation = get_translations(language, html_page_name)
 
     # 3. Fallback to English if the specific language file doesn't exist
-    if not language_path.exists():
+    if translation is None:
         language = "en"  # Explicitly set lang back to 'en' for context
-        language_path = LANG_DIR / "en" / f"{html_page_name}.json"
+        translation = get_translations("en", html_page_name)
 
-    # 4. Load the JSON content
-    try:
-        with open(language_path, "r", encoding="utf-8") as f:
-            translation = json.load(f)
-    except Exception as e:
-        print(f"Error loading translation file {language_path}: {e}")
-        translation = {}
+    if translation is None:
+        print(f"Missing translation file for page {html_page_name}")
+        translation = MappingProxyType({})
 
     return language, translation
 
 
-def generate_preview() -> List[Dict[str, str]]:
+def render_page(html_page_name: str, request: Request, version: Hashable = None,
+                context: Optional[Callable[[], Dict[str, Any]]] = None) -> HTMLResponse:
+    """
+    Renders "templates/{html_page_name}.html" and caches the resulting HTML.
+
+    The cache is keyed by (page, language, data version), so a page is only
+    re-rendered when the data it shows changes. `context` builds the extra
+    template variables and is only called on a cache miss.
+    """
+    lang, translations = find_language(html_page_name, request)
+    key = (html_page_name, lang, version, _catalog_generation)
+
+    with _page_cache_lock:
+        html = _page_cache.get(key)
+        if html is not None:
+            _page_cache.move_to_end(key)
+
+    if html is None:
+        page_context = {
+            "request": request,
+            "translations": translations,
+            "current_lang": lang
+        }
+        if context:
+            page_context.update(context())
+        html = template.get_template(f"{html_page_name}.html").render(page_context)
+
+        with _page_cache_lock:
+            _page_cache[key] = html
+            # Evict the least recently used pages
+            while len(_page_cache) > PAGE_CACHE_SIZE:
+                _page_cache.popitem(last=False)
+
+    return HTMLResponse(content=html)
+
+
+def maps_version() -> int:
+    """
+    Version of the map catalog, used as the cache key of pages listing maps.
+    It changes whenever a map or its scan data is added, replaced or removed.
+    """
+    return map_catalog.version()
+
+
+def generate_preview() -> List[Dict[str, Any]]:
     """
-    Scans the /static/maps directory and builds a list of all available maps.
+    Builds the list of all available maps from the map catalog.
     Used to display maps on the 'plans' and 'scans' pages.
     """
-    maps = []
-    for file in MAPS_DIR.iterdir():
-        # Check if the file has one of the allowed image extensions
-        if file.suffix.lower() in MAPS_POSSIBLE_EXTENSIONS:
-            maps.append({
-                "name": file.stem,  # File name without extension (e.g., "my_plan")
-                "preview_url": f"/static/maps/{file.name}"
-            })
-    return maps
+    return [
+        {
+            "name": entry.name,  # File name without extension (e.g., "my_plan")
+            "preview_url": entry.url,
+            "has_data": entry.has_signal  # Whether the map can be visualised
+        }
+        for entry in map_catalog.all()
+    ]
 
 
 def list_map() -> List[Dict[str, str]]:
     """
-    Scans the /static/data/signal directory to find which maps have scan data.
+    Lists the maps that have scan data, from the map catalog.
     Used to display maps on the 'maps' (visualization) page.
 
     This ensures that the visualization page only lists maps that actually
     have scan data to be viewed.
     """
-    data = []
-    # 1. Iterate over all JSON files in the signal data directory
-    for file in SIGNAL_DIR.iterdir():
-        if file.suffix.lower() == ".json":
-            # 2. For each scan file, check if a corresponding map image still exists
-            for ext in MAPS_POSSIBLE_EXTENSIONS:
-                corresponding_map = MAPS_DIR / (file.stem + ext)
-                if corresponding_map.exists():
-                    # 3. If both scan data and map image exist, add it to the list
-                    data.append({"name": file.stem})
-                    # Found a match, no need to check other extensions for this file
-                    break
-    return data
\ No newline at end of file
+    return [{"name": entry.name} for entry in map_catalog.all() if entry.has_signal]
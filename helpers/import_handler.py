@@ -0,0 +1,42 @@
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a heavy module (cv2, numpy, pdf2image...) that is only
+    imported the first time one of its attributes is used.
+
+    This keeps them out of the application's startup path: pages that never
+    render a heatmap or convert a PDF never pay for the import.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_module: Optional[ModuleType] = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        """Imports the real module once, even if several threads ask at the same time."""
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    def __getattr__(self, attr: str):
+        # Only called for attributes not found on the proxy itself
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_module(name: str) -> LazyModule:
+    """
+    Returns a lazy accessor for the given module name.
+    Usage: `cv2 = lazy_module("cv2")` instead of `import cv2`.
+    """
+    return LazyModule(name)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+import math
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from config import VALUE_FIELDS
+from helpers.data_handler import find_data_list, data_version
+from helpers.field_handler import RADIUS, SIGMA, get_field
+from helpers.import_handler import lazy_module
+
+# NumPy is imported on the first query, not at startup
+np = lazy_module("numpy")
+
+# Side (px) of the grid cells points are bucketed into
+CELL_SIZE = 64
+# Maximum number of (map, layer) indexes kept in memory
+INDEX_CACHE_SIZE = 128
+
+DataPoint = Dict[str, Any]
+
+
+class PointIndex:
+    """
+    Uniform-grid spatial index over the scan points of one layer.
+
+    Points are bucketed into CELL_SIZE x CELL_SIZE cells. A nearest-point
+    query only looks at the rings of cells around the pixel until no closer
+    point can exist, instead of scanning every point.
+    """
+
+    def __init__(self, data: List[DataPoint], value_field: str):
+        self.points = data
+        self.value_field = value_field
+        self.xy = np.array([(p["x"], p["y"]) for p in data], dtype=np.float64).reshape(-1, 2)
+
+        # cell (cx, cy) -> indices of the points inside it
+        self.cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(data):
+            cell_ids = np.floor_divide(self.xy, CELL_SIZE).astype(np.int64)
+            order = np.lexsort((cell_ids[:, 1], cell_ids[:, 0]))
+            sorted_ids = cell_ids[order]
+            # Split the sorted indices where the cell changes
+            breaks = np.flatnonzero(np.any(np.diff(sorted_ids, axis=0) != 0, axis=1)) + 1
+            for group in np.split(order, breaks):
+                cx, cy = cell_ids[group[0]]
+                self.cells[(int(cx), int(cy))] = group
+            self.cell_bounds = cell_ids.min(axis=0), cell_ids.max(axis=0)
+
+    def nearest(self, x: float, y: float) -> Optional[Tuple[int, float]]:
+        """
+        Returns (index, distance) of the point closest to (x, y), or None if the layer is empty.
+        """
+        if not self.cells:
+            return None
+
+        cx, cy = int(x // CELL_SIZE), int(y // CELL_SIZE)
+        (min_cx, min_cy), (max_cx, max_cy) = self.cell_bounds
+        # Beyond this ring every cell of the grid has been visited
+        max_ring = int(max(abs(cx - min_cx), abs(cx - max_cx), abs(cy - min_cy), abs(cy - max_cy)))
+
+        best: Optional[Tuple[int, float]] = None
+        for ring in range(max_ring + 1):
+            # Any point in ring r is at least (r - 1) * CELL_SIZE away
+            if best is not None and (ring - 1) * CELL_SIZE > best[1]:
+                break
+            for i in range(cx - ring, cx + ring + 1):
+                for j in range(cy - ring, cy + ring + 1):
+                    # Only the border of the ring, inner cells were already visited
+                    if max(abs(i - cx), abs(j - cy)) != ring:
+                        continue
+                    group = self.cells.get((i, j))
+                    if group is None:
+                        continue
+                    d = np.hypot(self.xy[group, 0] - x, self.xy[group, 1] - y)
+                    k = int(np.argmin(d))
+                    if best is None or d[k] < best[1]:
+                        best = (int(group[k]), float(d[k]))
+        return best
+
+
+# (map, data type, key) -> (data version, index)
+_indexes: "OrderedDict[Tuple[str, str, str], Tuple[Any, PointIndex]]" = OrderedDict()
+_indexes_lock = Lock()
+
+
+def get_index(map_name: str, data_type: str, key: str) -> PointIndex:
+    """
+    Returns the spatial index of a layer, rebuilt only when its data changed.
+    """
+    cache_key = (map_name, data_type, key)
+    version = data_version(map_name, data_type)
+
+    with _indexes_lock:
+        cached = _indexes.get(cache_key)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(cache_key)
+            return cached[1]
+
+    index = PointIndex(find_data_list(map_name, key, data_type), VALUE_FIELDS[data_type])
+
+    with _indexes_lock:
+        _indexes[cache_key] = (version, index)
+        _indexes.move_to_end(cache_key)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+
+def query_point(map_name: str, data_type: str, key: str, x: int, y: int,
+                shape: Tuple[int, int], radius: int = RADIUS, sigma: float = SIGMA) -> Dict[str, Any]:
+    """
+    Answers a hover query on a layer at pixel (x, y) of a plan of the given shape.
+    Returns the nearest measured point and the interpolated value at that pixel.
+    """
+    index = get_index(map_name, data_type, key)
+    result: Dict[str, Any] = {"x": x, "y": y, "nearest": None}
+
+    found = index.nearest(x, y)
+    if found is not None:
+        i, distance = found
+        point = index.points[i]
+        result["nearest"] = {
+            "x": point["x"],
+            "y": point["y"],
+            "value": point[index.value_field],
+            "bssid": point.get("bssid"),
+            "distance": round(distance, 1)
+        }
+
+    value = get_field(map_name, data_type, key, shape, radius, sigma).value_at(x, y)
+    result["value"] = None if value is None or math.isnan(value) else round(value, 1)
+    return result
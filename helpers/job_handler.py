@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields, asdict
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi.concurrency import run_in_threadpool
+from config import SCAN_QUEUE_MAX, JOBS_DIR
+from helpers.scan_handler import extract_scan, scan_interface_name
+from helpers.data_handler import save_scan
+from helpers.session_handler import start_session
+from helpers.lock_handler import get_map_lock, radio_lock, write_json_atomic
+
+# Finished jobs kept for status queries, oldest dropped first
+JOB_HISTORY = 200
+# Seconds between keep-alive comments on idle event streams (for proxies)
+KEEPALIVE_INTERVAL = 15
+# Seconds between two checks of the shared job files by an event stream
+EVENT_POLL_INTERVAL = 0.5
+# Job files not updated for this long are ignored (their worker process is
+# gone), then deleted once they reach JOB_MAX_AGE
+STALE_JOB_AGE = 600
+JOB_MAX_AGE = 3600
+
+# Order of the statuses: an event never moves a job back
+_STATUS_ORDER = {"queued": 0, "scanning": 1, "saving": 2, "done": 3, "error": 3}
+_JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ScanQueueFull(Exception):
+    """Raised when an interface already has SCAN_QUEUE_MAX waiting jobs."""
+
+
+@dataclass
+class ScanJob:
+    """
+    One scan requested by a click on the scan page.
+    Its status goes from "queued" to "scanning", "saving", then "done" or "error".
+    """
+    id: str
+    map_name: str
+    x: int
+    y: int
+    new_session: bool
+    interface: str = ""
+    status: str = "queued"
+    ahead: int = 0  # Jobs waiting before this one on the same interface
+    message: str = ""
+    created: float = field(default_factory=time.time)
+
+    def event(self) -> Dict[str, Any]:
+        """The job as sent in progress events and status queries."""
+        return asdict(self)
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any]) -> "ScanJob":
+        return cls(**{f.name: event[f.name] for f in fields(cls) if f.name in event})
+
+
+def _progress(event: Dict[str, Any]) -> Tuple[int, int]:
+    """How far a job is: later statuses, then fewer jobs ahead, come later."""
+    return _STATUS_ORDER.get(event["status"], 0), -event["ahead"]
+
+
+def _job_path(job_id: str) -> Path:
+    return JOBS_DIR / f"{job_id}.json"
+
+
+def _read_job(path: Path) -> Optional[ScanJob]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return ScanJob.from_event(json.load(f))
+    except (OSError, ValueError, TypeError, KeyError):
+        return None  # Deleted meanwhile, or not a job file
+
+
+class ScanQueue:
+    """
+    Runs scan jobs one at a time per Wi-Fi interface, in the event loop.
+
+    A scan occupies the radio for several seconds, so clicks are queued
+    instead of holding their HTTP request open. Each interface has its own
+    queue and worker task; the radio work runs in a thread under the
+    interface's cross-process lock, then the results are saved under the
+    map's lock. Every status change is pushed to the map's event subscribers.
+
+    With several server workers, a click can reach any process. Each status
+    change is also written to a job file in JOBS_DIR, so status queries,
+    event streams and the SCAN_QUEUE_MAX limit see the jobs of every process.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._waiting: Dict[str, List[ScanJob]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        # One thread writes the job files, in the order of the changes
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-jobs")
+
+    async def submit(self, map_name: str, x: int, y: int, new_session: bool = False) -> ScanJob:
+        """
+        Queues a scan at (x, y) and returns its job at once.
+        Raises ScanQueueFull if the interface has too many waiting jobs.
+        """
+        # The first call probes the hardware (slow): keep it off the event loop
+        interface = await run_in_threadpool(scan_interface_name)
+        waiting = self._waiting.setdefault(interface, [])
+        # Waiting jobs of every process (this one's may not be written yet)
+        shared = await run_in_threadpool(self._shared_jobs)
+        ahead = {job.id for job in shared if job.interface == interface and job.status == "queued"}
+        ahead.update(job.id for job in waiting)
+        if len(ahead) >= SCAN_QUEUE_MAX:
+            raise ScanQueueFull(f"{len(ahead)} scans are already waiting for {interface}")
+
+        job = ScanJob(id=uuid.uuid4().hex, map_name=map_name, x=x, y=y,
+                      new_session=new_session, interface=interface, ahead=len(ahead))
+        self._remember(job)
+        waiting.append(job)
+        self._queue(interface).put_nowait(job)
+        self._publish(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ScanJob]:
+        """A job of any process, or None. Reads its job file: call it in a thread."""
+        job = self._jobs.get(job_id)
+        if job is None and _JOB_ID_PATTERN.match(job_id):
+            job = _read_job(_job_path(job_id))
+        return job
+
+    def jobs(self, map_name: str) -> List[ScanJob]:
+        """The known jobs of a map, oldest first."""
+        return [job for job in self._jobs.values() if job.map_name == map_name]
+
+    @staticmethod
+    def _shared_jobs(map_name: Optional[str] = None, since_ns: int = 0) -> List[ScanJob]:
+        """
+        The jobs of every process (of one map if given) whose file changed
+        after `since_ns`, leaving out the stale ones. Deletes the old files.
+        """
+        now = time.time()
+        jobs = []
+        for entry in os.scandir(JOBS_DIR):
+            try:
+                mtime_ns = entry.stat().st_mtime_ns
+                if now - mtime_ns / 1e9 > JOB_MAX_AGE:
+                    os.unlink(entry.path)  # Also removes the temp files of interrupted writes
+                    continue
+            except FileNotFoundError:
+                continue
+            if mtime_ns <= since_ns or entry.name.startswith(".") or not entry.name.endswith(".json"):
+                continue
+            job = _read_job(Path(entry.path))
+            if job is None or (map_name is not None and job.map_name != map_name):
+                continue
+            if job.status not in ("done", "error") and now - mtime_ns / 1e9 > STALE_JOB_AGE:
+                continue
+            jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def _store(event: Dict[str, Any]) -> None:
+        try:
+            write_json_atomic(_job_path(event["id"]), event, indent=None)
+        except OSError as e:
+            print(f"Error writing scan job {event['id']}: {e}")
+
+    def _remember(self, job: ScanJob) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > JOB_HISTORY:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.status not in ("done", "error"):
+                break  # Never forget a job that is still running
+            self._jobs.popitem(last=False)
+
+    def _queue(self, interface: str) -> asyncio.Queue:
+        """Returns the interface's queue, starting its worker on first use."""
+        queue = self._queues.get(interface)
+        worker = self._workers.get(interface)
+        if queue is None or worker is None or worker.done():
+            queue = self._queues.setdefault(interface, asyncio.Queue())
+            self._workers[interface] = asyncio.get_running_loop().create_task(self._work(interface, queue))
+        return queue
+
+    async def _work(self, interface: str, queue: asyncio.Queue) -> None:
+        """Worker task of one interface: scans and saves its jobs in order."""
+        while True:
+            job: ScanJob = await queue.get()
+            waiting = self._waiting[interface]
+            waiting.remove(job)
+            for ahead, other in enumerate(waiting):
+                other.ahead = ahead
+                self._publish(other)
+
+            try:
+                # 1. Scan (in a thread, holding the radio across workers)
+                self._update(job, "scanning")
+                results, channels = await run_in_threadpool(self._scan, interface)
+
+                # 2. Save under the map's lock, like any other write to the map
+                self._update(job, "saving")
+                async with get_map_lock(job.map_name):
+                    if job.new_session:
+                        await run_in_threadpool(start_session, job.map_name)
+                    await run_in_threadpool(save_scan, job.map_name, job.x, job.y, results, channels)
+                self._update(job, "done", f"Added scan for {job.map_name} at ({job.x}, {job.y})")
+            except Exception as e:
+                print(f"Scan job {job.id} on {job.map_name} failed: {e}")
+                self._update(job, "error", str(e))
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    def _scan(interface: str) -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+        with radio_lock(interface):
+            return extract_scan()
+
+    def _update(self, job: ScanJob, status: str, message: str = "") -> None:
+        job.status = status
+        job.message = message
+        self._publish(job)
+
+    def _publish(self, job: ScanJob) -> None:
+        event = job.event()
+        self._writer.submit(self._store, event)
+        for subscriber in self._subscribers.get(job.map_name, ()):
+            subscriber.put_nowait(event)
+
+    async def events(self, map_name: str, is_disconnected: Callable[[], Awaitable[bool]]) -> AsyncIterator[str]:
+        """
+        Server-Sent Events stream of a map's job updates.
+        Starts with the jobs still in progress, then sends every change: at
+        once for this process's jobs, within EVENT_POLL_INTERVAL for the
+        jobs of other processes (read from their job files).
+        """
+        subscriber: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(map_name, set()).add(subscriber)
+        sent: Dict[str, Tuple[int, int]] = {}
+
+        def fresh(event: Dict[str, Any]) -> bool:
+            # Local events and job files can both carry a change: send it once, in order
+            progress = _progress(event)
+            if event["id"] in sent and progress <= sent[event["id"]]:
+                return False
+            sent[event["id"]] = progress
+            return True
+
+        try:
+            yield "retry: 2000\n\n"
+            polled_ns = time.time_ns()
+            for job in self.jobs(map_name) + await run_in_threadpool(self._shared_jobs, map_name):
+                if job.status not in ("done", "error") and fresh(job.event()):
+                    yield f"event: job\ndata: {json.dumps(job.event())}\n\n"
+
+            idle = 0.0
+            while not await is_disconnected():
+                try:
+                    events = [await asyncio.wait_for(subscriber.get(), EVENT_POLL_INTERVAL)]
+                except asyncio.TimeoutError:
+                    # Overlap the previous check by a second: file times are not exact
+                    now_ns = time.time_ns()
+                    jobs = await run_in_threadpool(self._shared_jobs, map_name, polled_ns - 1_000_000_000)
+                    polled_ns = now_ns
+                    events = [job.event() for job in jobs]
+                    idle += EVENT_POLL_INTERVAL
+
+                events = [event for event in events if fresh(event)]
+                for event in events:
+                    yield f"event: job\ndata: {json.dumps(event)}\n\n"
+                if events:
+                    idle = 0.0
+                elif idle >= KEEPALIVE_INTERVAL:
+                    idle = 0.0
+                    yield ": keep-alive\n\n"
+        finally:
+            subscribers = self._subscribers.get(map_name)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[map_name]
+
+
+# Scan queue shared by every request of this process
+scan_queue = ScanQueue()
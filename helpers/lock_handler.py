@@ -0,0 +1,191 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional
+from config import LOCK_DIR
+
+# OS-specific primitives for cross-process file locks
+if sys.platform.startswith("win"):
+    import msvcrt
+else:
+    import fcntl
+
+# One asyncio lock per map, shared by every request handled in this process
+_async_locks: Dict[str, asyncio.Lock] = {}
+
+# Map names whose file lock is currently held by the calling thread
+_held = threading.local()
+
+
+def get_map_lock(map_name: str) -> asyncio.Lock:
+    """
+    Returns the in-process asyncio lock for a map.
+    Requests on the same map wait for each other, different maps never do.
+    """
+    lock = _async_locks.get(map_name)
+    if lock is None:
+        lock = _async_locks.setdefault(map_name, asyncio.Lock())
+    return lock
+
+
+def _acquire(handle) -> None:
+    """Blocks until the OS-level lock on the given lock file is acquired."""
+    if sys.platform.startswith("win"):
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+
+def _release(handle) -> None:
+    """Releases the OS-level lock on the given lock file."""
+    if sys.platform.startswith("win"):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def map_file_lock(map_name: str) -> Iterator[None]:
+    """
+    Holds the cross-process lock of a map for the duration of the block.
+
+    The lock is a file in LOCK_DIR, so it is shared by every uvicorn worker
+    and thread. It is re-entrant within a thread, which lets a caller hold it
+    around several helpers that also take it.
+    """
+    held = getattr(_held, "maps", None)
+    if held is None:
+        held = _held.maps = set()
+
+    # Already held by this thread: nothing to do
+    if map_name in held:
+        yield
+        return
+
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_DIR / f"{map_name}.lock", "a+b") as handle:
+        _acquire(handle)
+        held.add(map_name)
+        try:
+            yield
+        finally:
+            held.discard(map_name)
+            _release(handle)
+
+
+@contextmanager
+def radio_lock(interface: str) -> Iterator[None]:
+    """
+    Holds the cross-process lock of a Wi-Fi interface during a scan,
+    so two workers never drive the same radio at once.
+    """
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    # Windows interface names are descriptions: keep them file-name safe
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in interface)
+    with open(LOCK_DIR / f".radio-{safe_name}.lock", "a+b") as handle:
+        _acquire(handle)
+        try:
+            yield
+        finally:
+            _release(handle)
+
+
+def write_json_atomic(file_path: Path, data: Any, indent: Optional[int] = 4) -> None:
+    """
+    Writes JSON data through a temp file and os.replace.
+    Readers see either the previous file or the complete new one.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, separators=None if indent else (",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def write_bytes_atomic(file_path: Path, data: bytes) -> None:
+    """
+    Writes binary content through a temp file and os.replace,
+    like write_json_atomic.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _load_json(file_path: Path) -> Any:
+    """Loads a JSON file, raising on missing or corrupted content."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_json_checked(file_path: Path, loader: Callable[[Path], Any] = _load_json) -> Dict[str, Any]:
+    """
+    Reads a map's JSON file for a read-modify-write, after a crash-recovery check.
+    Must be called while holding the map's file lock.
+    `loader` reads files of another layout (it raises ValueError on corrupted content).
+
+    - A leftover temp file newer than the data file holds a write that was
+      fully written but never renamed (crash before os.replace): it is restored.
+    - Other leftover temp files are incomplete writes and are removed.
+    - A corrupted data file is moved aside as "<name>.corrupt-<timestamp>"
+      instead of being silently overwritten, and an empty dict is returned.
+    """
+    leftovers = sorted(file_path.parent.glob(f".{file_path.name}.*.tmp"),
+                       key=lambda p: p.stat().st_mtime_ns, reverse=True)
+    current_mtime = file_path.stat().st_mtime_ns if file_path.exists() else -1
+
+    for tmp_path in leftovers:
+        tmp_mtime = tmp_path.stat().st_mtime_ns
+        if tmp_mtime > current_mtime:
+            try:
+                loader(tmp_path)
+            except (OSError, ValueError):
+                pass
+            else:
+                print(f"Recovering unfinished write of {file_path.name} from {tmp_path.name}")
+                os.replace(tmp_path, file_path)
+                # Older leftovers are now older than the restored data too
+                current_mtime = tmp_mtime
+                continue
+        tmp_path.unlink(missing_ok=True)
+
+    if not file_path.exists():
+        return {}
+
+    try:
+        data = loader(file_path)
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+
+    # Keep the unreadable file for inspection rather than wiping the survey
+    quarantine = file_path.with_name(f"{file_path.name}.corrupt-{int(time.time())}")
+    os.replace(file_path, quarantine)
+    print(f"Corrupted data file {file_path.name} moved to {quarantine.name}")
+    return {}
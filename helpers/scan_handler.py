@@ -1,10 +1,10 @@
 import subprocess
+import random
 import re
 import time
 from time import sleep
 from collections import defaultdict
-from config import SYS, WIFI_INTERFACE
-import pywifi
+from config import SYS, SCAN_BACKEND, FAKE_SCAN_DELAY, get_wifi_interface
 from typing import List, Dict, Tuple, Any, DefaultDict
 
 
@@ -170,34 +170,6 @@ def parse_windows_scan_output(output: str) -> List[Dict[str, Any]]:
     return networks
 
 
-def find_best_networks(networks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Filters a list of scan results to keep only the strongest BSSID
-    for each unique SSID + Band combination.
-    """
-    ssid_seen: Dict[Tuple[str, str], Dict[str, Any]] = {}
-
-    for net in networks:
-        ssid = net["ssid"]
-        signal = net["signal"]
-        band = net["band"]
-        bssid = net["bssid"]
-
-        key = (ssid, band)
-
-        # If this SSID/Band is new, or this BSSID is stronger than the saved one
-        if key not in ssid_seen or ssid_seen[key]["signal"] < signal:
-            ssid_seen[key] = {
-                "ssid": ssid,
-                "bssid": bssid,
-                "signal": signal,
-                "band": band
-            }
-
-    # Return a list of the best networks
-    return list(ssid_seen.values())
-
-
 def count_wifi_channels_from_netsh_output(output: str) -> Dict[int, int]:
     """
     Parses the 'netsh' output to count APs on each channel.
@@ -241,11 +213,12 @@ def extract_windows() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
     Uses pywifi to trigger a fresh scan, then netsh to read the results
     (which include channel data that pywifi misses).
     """
-    if not WIFI_INTERFACE:
+    wifi_interface = get_wifi_interface()
+    if not wifi_interface:
         return [], {}
 
     # Trigger a new scan. This is asynchronous.
-    WIFI_INTERFACE.scan()
+    wifi_interface.scan()
 
     # Wait for the system's scan cache to update. 3 seconds is
     # typically enough after a pywifi-triggered scan.
@@ -265,7 +238,7 @@ def extract_linux() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
     """
     Linux-specific scan implementation using 'iw'.
     """
-    output = wifi_scan_iw(WIFI_INTERFACE)
+    output = wifi_scan_iw(get_wifi_interface())
 
     # Parse the output for channel counts and network info
     channels = count_wifi_channels_from_iw_output(output)
@@ -274,11 +247,50 @@ def extract_linux() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
     return networks, channels
 
 
+def extract_fake() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
+    """
+    Fake scan backend (HEATMAP_SCAN_BACKEND=fake), used by benchmarks/load_test.py.
+    Waits like a real scan, then returns random results for a fixed set of
+    SSIDs, BSSIDs and channels, without touching the Wi-Fi hardware.
+    """
+    time.sleep(FAKE_SCAN_DELAY)
+
+    networks = []
+    channels: DefaultDict[int, int] = defaultdict(int)
+    for index in range(8):
+        for band, band_channels in (("2.4GHz", (1, 6, 11)), ("5GHz", (36, 44, 149))):
+            for ap in range(2):
+                channels[random.choice(band_channels)] += 1
+                networks.append({
+                    "ssid": f"LoadTest-{index}",
+                    "bssid": f"02:00:00:{index:02x}:{ap:02x}:{0 if band == '2.4GHz' else 1:02x}",
+                    "signal": float(random.randint(-90, -30)),
+                    "band": band
+                })
+
+    return networks, dict(channels)
+
+
+def scan_interface_name() -> str:
+    """
+    Returns the name of the interface scans run on, used to queue them
+    (see job_handler). Probes the hardware on the first call.
+    """
+    if SCAN_BACKEND == "fake":
+        return "fake"
+    wifi_interface = get_wifi_interface()
+    if wifi_interface is None:
+        return "none"
+    # Linux returns the interface name, Windows a pywifi interface
+    return wifi_interface if isinstance(wifi_interface, str) else wifi_interface.name()
+
+
 def extract_scan() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
     """
     Main entry point for performing a scan.
-    Calls the correct OS-specific function and returns the
-    filtered (best networks only) results and channel counts.
+    Calls the correct OS-specific function and returns every network seen
+    (all BSSIDs, see ap_handler) and the channel counts.
+    The best BSSID per SSID/Band is selected when the signal layers are read.
     """
     # OS-specific function mapping
     os_actions = {
@@ -288,7 +300,9 @@ def extract_scan() -> Tuple[List[Dict[str, Any]], Dict[int, int]]:
 
     # Call the appropriate function for the current system (SYS from config.py)
     # Default to an empty result if OS is not supported
-    networks, channels = os_actions.get(SYS, lambda: ([], {}))()
+    if SCAN_BACKEND == "fake":
+        networks, channels = extract_fake()
+    else:
+        networks, channels = os_actions.get(SYS, lambda: ([], {}))()
 
-    # Filter to only the best BSSID per SSID/Band
-    return find_best_networks(networks), channels
\ No newline at end of file
+    return networks, channels
\ No newline at end of file
@@ -0,0 +1,217 @@
+import gzip
+import hashlib
+import json
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import SESSIONS_DIR
+from helpers.data_handler import delete_signal, delete_channel, read_survey, write_survey
+from helpers.ap_handler import APStore, COLUMNS, read_store, write_store, delete_store
+from helpers.lock_handler import map_file_lock, read_json_checked, write_json_atomic, write_bytes_atomic
+from helpers.catalog_handler import map_catalog
+
+# Identification of the archived session format
+SESSION_FORMAT = "heatmap-session"
+SESSION_VERSION = 1
+SESSION_EXTENSION = ".session.gz"
+
+SurveyData = Dict[str, List[Dict[str, Any]]]
+
+
+def _session_dir(map_name: str) -> Path:
+    """
+    Returns the directory of a map's sessions.
+    Raises ValueError unless the map name is a plain file name, so that no
+    read, write or deletion can reach outside SESSIONS_DIR.
+    """
+    if map_name in ("", ".", "..") or Path(map_name).name != map_name:
+        raise ValueError(f"Invalid map name: {map_name!r}")
+    return SESSIONS_DIR / map_name
+
+
+def _index_path(map_name: str) -> Path:
+    return _session_dir(map_name) / "index.json"
+
+
+def _session_id(signal: SurveyData, channel: SurveyData, aps: APStore) -> str:
+    """
+    Returns the content hash of a survey, used as its session id.
+    Archiving the same survey twice stores it only once.
+    """
+    content = {"signal": signal, "channel": channel}
+    if aps["scan_x"]:
+        # Surveys made before the AP store existed keep their id
+        content["aps"] = aps
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_session(map_name: str, signal: SurveyData, channel: SurveyData, aps: APStore) -> bytes:
+    """
+    Encodes a survey as a compressed, columnar session.
+    Layer keys ("SSID [Band]", "Channel_X") and BSSIDs are stored once in
+    tables shared by the whole session and referenced by index.
+    The AP store is already columnar and is embedded as is.
+    """
+    keys: Dict[str, int] = {}
+    bssids: Dict[str, int] = {}
+    layers = []
+
+    for key, points in signal.items():
+        layers.append({
+            "type": "signal",
+            "key": keys.setdefault(key, len(keys)),
+            "x": [p["x"] for p in points],
+            "y": [p["y"] for p in points],
+            "signal": [p["signal"] for p in points],
+            "bssid": [bssids.setdefault(str(p.get("bssid", "")), len(bssids)) for p in points],
+        })
+    for key, points in channel.items():
+        layers.append({
+            "type": "channel",
+            "key": keys.setdefault(key, len(keys)),
+            "x": [p["x"] for p in points],
+            "y": [p["y"] for p in points],
+            "count": [p["count"] for p in points],
+        })
+
+    document = {"format": SESSION_FORMAT, "version": SESSION_VERSION, "map": map_name,
+                "keys": list(keys), "bssids": list(bssids), "layers": layers, "aps": aps}
+    # mtime=0 keeps the compressed bytes identical for identical surveys
+    return gzip.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), mtime=0)
+
+
+def _decode_session(content: bytes) -> Tuple[SurveyData, SurveyData, APStore]:
+    """
+    Expands an archived session back to its (signal, channel, AP store) data.
+    Sessions archived before the AP store existed restore an empty one.
+    """
+    document = json.loads(gzip.decompress(content))
+    if document.get("format") != SESSION_FORMAT or document.get("version") != SESSION_VERSION:
+        raise ValueError("Not a supported survey session")
+
+    keys, bssids = document["keys"], document["bssids"]
+    data: Dict[str, SurveyData] = {"signal": {}, "channel": {}}
+    for layer in document["layers"]:
+        key = keys[layer["key"]]
+        if layer["type"] == "signal":
+            points = [{"bssid": bssids[b], "signal": s, "x": x, "y": y}
+                      for x, y, s, b in zip(layer["x"], layer["y"], layer["signal"], layer["bssid"])]
+        else:
+            points = [{"x": x, "y": y, "count": c}
+                      for x, y, c in zip(layer["x"], layer["y"], layer["count"])]
+        data[layer["type"]][key] = points
+    aps = document.get("aps") or {}
+    return data["signal"], data["channel"], {column: aps.get(column, []) for column in COLUMNS}
+
+
+def _read_index(map_name: str) -> Dict[str, Any]:
+    index = read_json_checked(_index_path(map_name))
+    index.setdefault("current", None)
+    index.setdefault("sessions", [])
+    return index
+
+
+def archive_session(map_name: str) -> Optional[str]:
+    """
+    Stores the map's current survey as an immutable session and returns its id
+    (None when there is no data). The session becomes the current one.
+    """
+    with map_file_lock(map_name):
+        # The scans of the signal layers are in the AP store, archived as is
+        signal = read_survey(map_name, "signal", scans=False)
+        channel = read_survey(map_name, "channel")
+        aps = read_store(map_name)
+        if not signal and not channel and not aps["scan_x"]:
+            return None
+
+        session_id = _session_id(signal, channel, aps)
+        session_path = _session_dir(map_name) / f"{session_id}{SESSION_EXTENSION}"
+        session_path.parent.mkdir(parents=True, exist_ok=True)
+
+        index = _read_index(map_name)
+        if not session_path.exists():
+            write_bytes_atomic(session_path, _encode_session(map_name, signal, channel, aps))
+        if not any(s["id"] == session_id for s in index["sessions"]):
+            # Counted on the signal layers as rendered, scans included
+            layers = read_survey(map_name, "signal")
+            index["sessions"].append({
+                "id": session_id,
+                "created": int(time.time()),
+                "points": sum(len(points) for points in layers.values()),
+                "layers": len(layers) + len(channel),
+            })
+        index["current"] = session_id
+        write_json_atomic(_index_path(map_name), index)
+        return session_id
+
+
+def start_session(map_name: str) -> Optional[str]:
+    """
+    Starts a new, empty survey of a map.
+    The previous survey is archived first, so it can be switched back to.
+    Returns the id of the archived session, if any.
+    """
+    with map_file_lock(map_name):
+        archived = archive_session(map_name)
+        delete_signal(map_name)
+        delete_channel(map_name)
+        delete_store(map_name)
+        if archived:
+            index = _read_index(map_name)
+            index["current"] = None
+            write_json_atomic(_index_path(map_name), index)
+
+    map_catalog.refresh(map_name)
+    return archived
+
+
+def switch_session(map_name: str, session_id: str) -> bool:
+    """
+    Makes an archived session the map's current survey, after archiving the
+    survey being replaced. Returns False if the session does not exist.
+    """
+    try:
+        session_path = _session_dir(map_name) / f"{Path(session_id).name}{SESSION_EXTENSION}"
+    except ValueError:
+        return False
+
+    with map_file_lock(map_name):
+        if not session_path.exists():
+            return False
+        signal, channel, aps = _decode_session(session_path.read_bytes())
+
+        archive_session(map_name)
+        write_survey(map_name, "signal", signal)
+        write_survey(map_name, "channel", channel)
+        write_store(map_name, aps)
+
+        index = _read_index(map_name)
+        index["current"] = session_id
+        write_json_atomic(_index_path(map_name), index)
+
+    map_catalog.refresh(map_name)
+    return True
+
+
+def list_sessions(map_name: str) -> Dict[str, Any]:
+    """
+    Returns the archived sessions of a map (newest first) and the current one.
+    """
+    # Raises ValueError for names that are not a plain file name
+    _session_dir(map_name)
+    with map_file_lock(map_name):
+        index = _read_index(map_name)
+    sessions = sorted(index["sessions"], key=lambda s: s["created"], reverse=True)
+    return {"current": index["current"], "sessions": sessions}
+
+
+def delete_sessions(map_name: str) -> None:
+    """Deletes every archived session of a map (when the map is deleted)."""
+    try:
+        session_dir = _session_dir(map_name)
+    except ValueError:
+        return  # No map of that name can have sessions
+    with map_file_lock(map_name):
+        shutil.rmtree(session_dir, ignore_errors=True)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import atexit
+import sys
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, NamedTuple, Tuple
+from helpers.import_handler import lazy_module
+
+# NumPy is imported on first use, not at startup
+np = lazy_module("numpy")
+
+# Number of plans a render worker keeps attached
+WORKER_ATTACH_CACHE = 4
+
+
+class PlanHandle(NamedTuple):
+    """
+    Picklable reference to a decoded plan published in shared memory.
+    Sending it to a worker costs a few bytes instead of the whole image.
+    """
+    shm_name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class _Published:
+    """A plan's shared memory block, with the number of render jobs using it."""
+    __slots__ = ("shm", "handle", "version", "refs", "retired")
+
+    def __init__(self, shm: shared_memory.SharedMemory, handle: PlanHandle, version: Tuple[int, int]):
+        self.shm = shm
+        self.handle = handle
+        self.version = version
+        self.refs = 0
+        self.retired = False
+
+
+class PlanStore:
+    """
+    Publishes each decoded plan once in shared memory for the render workers.
+
+    Render jobs `acquire` a plan (decoding and publishing it if needed) and
+    `release` it when they finish. A plan that is replaced or deleted is only
+    unlinked once no job uses it anymore.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._plans: Dict[str, _Published] = {}  # map name -> current plan
+        self._by_name: Dict[str, _Published] = {}  # shm name -> plan (current or retired)
+        atexit.register(self.close_all)
+
+    def _publish(self, img: np.ndarray, version: Tuple[int, int]) -> _Published:
+        """Copies a decoded plan into a new shared memory block."""
+        shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+        view = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)
+        view[...] = img
+        del view  # Do not keep an exported pointer on the block
+        published = _Published(shm, PlanHandle(shm.name, tuple(img.shape), img.dtype.str), version)
+        self._by_name[shm.name] = published
+        return published
+
+    def _retire(self, published: _Published) -> None:
+        """Marks a plan as replaced or deleted, and frees it if it is unused."""
+        published.retired = True
+        if published.refs == 0:
+            self._free(published)
+
+    def _free(self, published: _Published) -> None:
+        self._by_name.pop(published.handle.shm_name, None)
+        published.shm.close()
+        try:
+            published.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def acquire(self, map_name: str, map_path: Path, load: Callable[[Path], np.ndarray]) -> PlanHandle:
+        """
+        Returns the shared plan of a map for one render job.
+        The plan is decoded with `load` only if it was never published or if
+        its file changed since. Every call must be paired with `release`.
+        """
+        stat = map_path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            published = self._plans.get(map_name)
+            if published is not None and published.version == version:
+                published.refs += 1
+                return published.handle
+
+        # Decode outside the lock so other maps are not blocked
+        img = load(map_path)
+
+        with self._lock:
+            published = self._plans.get(map_name)
+            if published is None or published.version != version:
+                if published is not None:
+                    self._retire(published)
+                published = self._plans[map_name] = self._publish(img, version)
+            published.refs += 1
+            return published.handle
+
+    def release(self, handle: PlanHandle) -> None:
+        """Ends a render job's use of a plan."""
+        with self._lock:
+            published = self._by_name.get(handle.shm_name)
+            if published is None:
+                return
+            published.refs -= 1
+            if published.retired and published.refs <= 0:
+                self._free(published)
+
+    def discard(self, map_name: str) -> None:
+        """Drops a map's plan, e.g. when the map is deleted."""
+        with self._lock:
+            published = self._plans.pop(map_name, None)
+            if published is not None:
+                self._retire(published)
+
+    def close_all(self) -> None:
+        """Unlinks every block, so nothing is left in shared memory at exit."""
+        with self._lock:
+            for published in list(self._by_name.values()):
+                self._free(published)
+            self._plans.clear()
+
+
+# Shared plan store of this (server) process
+plan_store = PlanStore()
+
+# --- Worker side ---
+
+# Blocks attached by this worker process: shm name -> block
+_attached: "OrderedDict[str, shared_memory.SharedMemory]" = OrderedDict()
+
+
+def attach_plan(handle: PlanHandle) -> np.ndarray:
+    """
+    Returns a read-only NumPy view on a published plan, without copying it.
+    Called in render worker processes.
+    """
+    shm = _attached.get(handle.shm_name)
+    if shm is None:
+        if sys.version_info >= (3, 13):
+            # The server owns the block: workers must not unlink it on exit
+            shm = shared_memory.SharedMemory(name=handle.shm_name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=handle.shm_name)
+        _attached[handle.shm_name] = shm
+        while len(_attached) > WORKER_ATTACH_CACHE:
+            _, old = _attached.popitem(last=False)
+            try:
+                old.close()
+            except BufferError:
+                pass  # Still viewed by a running job; closed when collected
+    else:
+        _attached.move_to_end(handle.shm_name)
+
+    img = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+    img.flags.writeable = False
+    return img
@@ -0,0 +1,133 @@
+from __future__ import annotations
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from helpers.field_handler import Field, MIN_COVERAGE, RADIUS, SIGMA, get_field
+from helpers.import_handler import lazy_module
+
+# NumPy is imported on the first computation, not at startup
+np = lazy_module("numpy")
+
+# Thresholds reported when the request gives none: common design targets in
+# dBm (voice, data, connectivity) for signal, AP counts for channel congestion
+DEFAULT_THRESHOLDS = {"signal": (-67.0, -70.0, -80.0), "ap": (-67.0, -70.0, -80.0), "channel": (5.0, 10.0)}
+# Number of histogram bins over the value range
+DEFAULT_BINS = 12
+
+# "x0,y0,x1,y1" or "name:x0,y0,x1,y1"
+_REGION_PATTERN = re.compile(r"^(?:(?P<name>[^:]+):)?(?P<box>-?\d+,-?\d+,-?\d+,-?\d+)$")
+
+
+class Region(NamedTuple):
+    """A named rectangle of the plan, in pixels (x1 and y1 excluded)."""
+    name: str
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+
+def parse_region(text: str) -> Region:
+    """
+    Parses a region given as "x0,y0,x1,y1" or "name:x0,y0,x1,y1".
+    Raises ValueError if it is malformed or empty.
+    """
+    match = _REGION_PATTERN.match(text.strip())
+    if not match:
+        raise ValueError(f"Invalid region {text!r}: expected [name:]x0,y0,x1,y1")
+    x0, y0, x1, y1 = (int(v) for v in match.group("box").split(","))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"Invalid region {text!r}: x1 and y1 must be greater than x0 and y0")
+    return Region(match.group("name") or match.group("box"), x0, y0, x1, y1)
+
+
+def _percent(count: int, total: int) -> float:
+    return round(100.0 * count / total, 2) if total else 0.0
+
+
+def _summarize(mean: np.ndarray, covered: np.ndarray, thresholds: Sequence[float]) -> Tuple[Dict[str, Any], np.ndarray]:
+    """
+    Reduces one area of a field: share of surveyed pixels, value statistics
+    and the share of the area at or above each threshold.
+    Returns the summary and the surveyed values (for the histogram).
+    """
+    total = int(covered.size)
+    values = mean[covered]
+    surveyed = int(values.size)
+
+    summary: Dict[str, Any] = {
+        "pixels": total,
+        "surveyed_pct": _percent(surveyed, total),
+        "mean": None, "min": None, "max": None,
+    }
+    if surveyed:
+        summary.update(mean=round(float(values.mean(dtype=np.float64)), 2),
+                       min=round(float(values.min()), 2), max=round(float(values.max()), 2))
+
+    summary["thresholds"] = []
+    for threshold in thresholds:
+        above = int(np.count_nonzero(values >= threshold))
+        summary["thresholds"].append({
+            "threshold": threshold,
+            "pct_of_area": _percent(above, total),
+            "pct_of_surveyed": _percent(above, surveyed),
+        })
+    return summary, values
+
+
+def _histogram(values: np.ndarray, min_val: float, max_val: float, bins: int) -> List[Dict[str, Any]]:
+    """
+    Area histogram of the surveyed values over [min_val, max_val].
+    Values outside the range are counted in the first or last bin.
+    """
+    index = np.floor((values - min_val) * (bins / (max_val - min_val)))
+    np.clip(index, 0, bins - 1, out=index)
+    counts = np.bincount(index.astype(np.intp), minlength=bins)
+    edges = np.linspace(min_val, max_val, bins + 1)
+    return [
+        {"from": round(float(edges[i]), 2), "to": round(float(edges[i + 1]), 2),
+         "pixels": int(counts[i]), "pct": _percent(int(counts[i]), int(values.size))}
+        for i in range(bins)
+    ]
+
+
+def layer_stats(map_name: str, data_type: str, key: str, shape: Tuple[int, int],
+                value_range: Tuple[float, float], thresholds: Optional[Sequence[float]] = None,
+                bins: int = DEFAULT_BINS, regions: Sequence[Region] = (),
+                radius: int = RADIUS, sigma: float = SIGMA) -> Dict[str, Any]:
+    """
+    Coverage statistics of one layer over a plan of the given (height, width),
+    from its field (taken from the field cache when it was already rendered
+    or queried). See field_stats.
+    """
+    field = get_field(map_name, data_type, key, shape, radius, sigma)
+    return field_stats(field, data_type, value_range, thresholds, bins, regions)
+
+
+def field_stats(field: Field, data_type: str, value_range: Tuple[float, float],
+                thresholds: Optional[Sequence[float]] = None, bins: int = DEFAULT_BINS,
+                regions: Sequence[Region] = ()) -> Dict[str, Any]:
+    """
+    Coverage statistics of a layer's field, computed with NumPy reductions:
+    - the share of the plan close enough to a scan to have a value,
+    - the mean, min and max interpolated value,
+    - for each threshold, the share of the plan (and of its surveyed part)
+      at or above it, e.g. "42% of the floor is above -67 dBm",
+    - an area histogram of the values over `value_range`,
+    - the same summary (without histogram) for each region.
+    """
+    if thresholds is None:
+        thresholds = DEFAULT_THRESHOLDS.get(data_type, ())
+    covered = field.coverage >= MIN_COVERAGE
+
+    stats, values = _summarize(field.mean, covered, thresholds)
+    stats["histogram"] = _histogram(values, *value_range, bins)
+
+    h, w = field.mean.shape
+    stats["regions"] = []
+    for region in regions:
+        # Clip the rectangle to the plan
+        x0, x1 = min(max(region.x0, 0), w), min(max(region.x1, 0), w)
+        y0, y1 = min(max(region.y0, 0), h), min(max(region.y1, 0), h)
+        summary, _ = _summarize(field.mean[y0:y1, x0:x1], covered[y0:y1, x0:x1], thresholds)
+        stats["regions"].append({"name": region.name, "box": [x0, y0, x1, y1], **summary})
+    return stats
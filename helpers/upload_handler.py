@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Tuple
+from fastapi import UploadFile
+from config import UPLOAD_CHUNK_SIZE
+
+
+class UploadTooLargeError(Exception):
+    """
+    Raised when an upload stream exceeds the maximum size allowed for it.
+    """
+
+
+def stream_to_temp(file: UploadFile, directory: Path, max_size: int) -> Tuple[Path, str]:
+    """
+    Streams an uploaded file into a temporary file inside `directory`.
+
+    The upload is read in chunks of UPLOAD_CHUNK_SIZE bytes, so memory use
+    stays flat whatever the size of the file. The size limit is enforced
+    while reading and a SHA-256 checksum is computed on the fly.
+    Returns the temporary path and the hex checksum.
+    """
+    return copy_to_temp(file.file, file.filename, directory, max_size)
+
+
+def copy_to_temp(stream: BinaryIO, name: str, directory: Path, max_size: int) -> Tuple[Path, str]:
+    """
+    Copies any readable stream (an upload, an archive member...) into a
+    temporary file inside `directory`, like stream_to_temp.
+    `name` only appears in errors.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    checksum = hashlib.sha256()
+    size = 0
+
+    # The temp file lives in the target directory so the final rename
+    # stays on the same filesystem (and is therefore atomic)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    tmp_path = Path(tmp_name)
+
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(f"{name} exceeds {max_size} bytes")
+                checksum.update(chunk)
+                tmp_file.write(chunk)
+            # Make sure the bytes are on disk before the file is renamed
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+    except BaseException:
+        # Never leave a partial upload behind
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return tmp_path, checksum.hexdigest()
+
+
+def commit_upload(tmp_path: Path, destination: Path) -> None:
+    """
+    Atomically moves a fully written temporary file to its final destination.
+    Readers either see the previous file or the complete new one, never a
+    truncated version.
+    """
+    try:
+        os.replace(tmp_path, destination)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def save_upload(file: UploadFile, destination: Path, max_size: int) -> str:
+    """
+    Streams an upload to `destination` through a temporary file and an
+    atomic rename. Returns the SHA-256 checksum of the stored content.
+    """
+    tmp_path, checksum = stream_to_temp(file, destination.parent, max_size)
+    commit_upload(tmp_path, destination)
+    return checksum
@@ -1,7 +1,8 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from routers import home, plans, scans, maps, help, change_language, data
-from config import BASE_DIR
+from config import BASE_DIR, WORKERS
+from helpers.html_handler import load_translations
 
 # Initialize the FastAPI application
 # We disable the default docs/redoc/openapi URLs for a cleaner public-facing app
@@ -11,6 +12,10 @@ app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
 # Mount the 'static' directory to serve CSS, JS, images, and map data
 app.mount("/static", StaticFiles(directory=BASE_DIR/"static"), name="static")
 
+# --- Translations ---
+# Load every translation file into memory once, before the first request
+load_translations()
+
 # --- Routers ---
 # Include all the router files to organize API endpoints
 app.include_router(home.router)
@@ -27,4 +32,5 @@ if __name__ == "__main__":
     import uvicorn
     # Run the application using uvicorn
     # This block is only executed when running "python main.py"
-    uvicorn.run("main:app", host="127.0.0.1", port=8000)
\ No newline at end of file
+    # Writes to map data are locked per map, so several workers can run safely
+    uvicorn.run("main:app", host="127.0.0.1", port=8000, workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,340 @@
+"""
+Headless batch renderer for offline reports.
+
+Renders every signal and channel layer of one or more maps, with their
+coverage statistics, without starting the server: the layers are spread
+over a pool of processes (one job per layer) that run the same field and
+blend stages as the heatmap endpoints. Writes one image per layer and a
+manifest.json describing the run.
+
+The survey comes from one of:
+- the application's own data (default), optionally restricted with --map,
+- a copy of the application's `static` directory (--data-dir): plans in
+  DIR/maps, JSON scan data in DIR/data/signal and DIR/data/channel, and
+  the scans of the AP stores in DIR/data/aps,
+- an exported survey (--survey, a .heatmap.gz bundle or a legacy signal or
+  channel JSON file) and the plan it was made on (--plan).
+
+Exits with status 1 when a layer failed to render, 2 on invalid input.
+
+Usage:
+    python render.py --output reports/ [--map NAME ...]
+    python render.py --output reports/ --data-dir backup/static
+    python render.py --output reports/ --survey office.heatmap.gz --plan office.png
+                     [--kind signal --kind channel] [--processes 4] [--format png]
+                     [--colormap turbo] [--alpha 0.6] [--radius 30] [--sigma 30]
+                     [--region "name:x0,y0,x1,y1" ...] [--no-stats]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from pydantic import ValidationError
+from config import COLORMAPS, MAPS_POSSIBLE_EXTENSIONS, RADIUS, SIGMA, VALUE_FIELDS, HeatmapParams
+from helpers.ap_handler import best_layers, load_store
+from helpers.export_handler import BUNDLE_EXTENSION, SurveyData, read_bundle, validate_survey
+from helpers.field_handler import compute_field
+from helpers.heatmap_handler import blend_heatmap, create_img, decode_img, value_range
+from helpers.stats_handler import Region, field_stats, parse_region
+from helpers.import_handler import lazy_module
+
+# OpenCV is imported by the render processes, not by the parent
+cv2 = lazy_module("cv2")
+
+KINDS = ("signal", "channel")
+
+
+class MapSurvey(NamedTuple):
+    """One map to render: its plan and its scan data of each kind."""
+    name: str
+    plan: Path
+    shared: bool  # Plan of the application: loaded through its .npy sidecar
+    surveys: Dict[str, SurveyData]
+
+
+class LayerJob(NamedTuple):
+    """One layer to render in a worker process."""
+    map_name: str
+    plan: Path
+    shared: bool
+    kind: str
+    key: str
+    points: List[Dict[str, Any]]
+    output_path: Path
+
+
+# --- Inputs ---
+
+def app_surveys(names: Sequence[str]) -> List[MapSurvey]:
+    """The maps of the application (all of them when `names` is empty), read under their file locks."""
+    from helpers.catalog_handler import map_catalog
+    from helpers.data_handler import read_survey
+    from helpers.lock_handler import map_file_lock
+
+    entries = map_catalog.all()
+    if names:
+        known = {entry.name for entry in entries}
+        missing = [name for name in names if name not in known]
+        if missing:
+            raise ValueError(f"Unknown map(s): {', '.join(missing)}")
+        entries = [entry for entry in entries if entry.name in names]
+
+    maps = []
+    for entry in entries:
+        with map_file_lock(entry.name):
+            surveys = {kind: read_survey(entry.name, kind) for kind in KINDS}
+        maps.append(MapSurvey(entry.name, entry.path, True, surveys))
+    return maps
+
+
+def _read_json_survey(path: Path, kind: str) -> SurveyData:
+    """A validated legacy JSON survey file, or no layers if it does not exist."""
+    if not path.is_file():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return validate_survey(kind, json.load(f))
+
+
+def _dir_survey(data_dir: Path, name: str, kind: str) -> SurveyData:
+    """A map's survey of one kind in a copy of `static`, with its scans for signal data (like read_survey)."""
+    survey = _read_json_survey(data_dir / "data" / kind / f"{name}.json", kind)
+    store_path = data_dir / "data" / "aps" / f"{name}.jsonl"
+    if kind == "signal" and store_path.is_file():
+        for key, points in best_layers(load_store(store_path)).items():
+            survey[key] = survey.get(key, []) + points
+    return survey
+
+
+def dir_surveys(data_dir: Path, names: Sequence[str]) -> List[MapSurvey]:
+    """The maps of a copy of the application's `static` directory."""
+    maps_dir = data_dir / "maps"
+    if not maps_dir.is_dir():
+        raise ValueError(f"{data_dir} has no maps directory")
+
+    # Keep the first extension in MAPS_POSSIBLE_EXTENSIONS order, like the map catalog
+    plans: Dict[str, Path] = {}
+    for ext in MAPS_POSSIBLE_EXTENSIONS:
+        for file in sorted(maps_dir.iterdir()):
+            if file.suffix.lower() == ext and file.stem not in plans:
+                plans[file.stem] = file
+    if names:
+        missing = [name for name in names if name not in plans]
+        if missing:
+            raise ValueError(f"Unknown map(s): {', '.join(missing)}")
+        plans = {name: plans[name] for name in names}
+
+    return [
+        MapSurvey(name, path, False, {kind: _dir_survey(data_dir, name, kind) for kind in KINDS})
+        for name, path in sorted(plans.items())
+    ]
+
+
+def file_survey(survey: Path, plan: Path) -> List[MapSurvey]:
+    """An exported survey (bundle or legacy JSON file) and the plan it was made on."""
+    if not plan.is_file():
+        raise ValueError(f"Plan {plan} not found")
+    if survey.name.endswith(BUNDLE_EXTENSION):
+        with open(survey, "rb") as f:
+            signal, channel = read_bundle(f)
+        surveys = {"signal": signal, "channel": channel}
+    else:
+        # A legacy file holds one kind: channel layers are the "Channel_X" keys
+        with open(survey, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        kind = "channel" if isinstance(data, dict) and data and \
+            all(str(key).startswith("Channel_") for key in data) else "signal"
+        surveys = {"signal": {}, "channel": {}}
+        surveys[kind] = validate_survey(kind, data)
+    name = survey.name[:-len(BUNDLE_EXTENSION)] if survey.name.endswith(BUNDLE_EXTENSION) else survey.stem
+    return [MapSurvey(name, plan, False, surveys)]
+
+
+# --- Rendering ---
+
+def _file_name(key: str, taken: set) -> str:
+    """A file-system-safe, unique name for a layer key."""
+    base = re.sub(r"[^\w.-]+", "_", key).strip("_.") or "layer"
+    name, index = base, 2
+    while name.lower() in taken:
+        name, index = f"{base}_{index}", index + 1
+    taken.add(name.lower())
+    return name
+
+
+def plan_jobs(maps: Sequence[MapSurvey], kinds: Sequence[str], output: Path, ext: str) -> List[LayerJob]:
+    """One job per non-empty layer, with its output path under output/{map}/."""
+    jobs = []
+    for survey in maps:
+        taken: set = set()
+        for kind in kinds:
+            for key, points in sorted(survey.surveys[kind].items()):
+                if not points:
+                    continue
+                path = output / survey.name / f"{kind}-{_file_name(key, taken)}{ext}"
+                jobs.append(LayerJob(survey.name, survey.plan, survey.shared, kind, key, points, path))
+    return jobs
+
+
+@lru_cache(maxsize=4)
+def _load_plan(path: Path, shared: bool):
+    """
+    The decoded plan, once per worker process. Plans of the application are
+    memory-mapped from their sidecar (shared by every worker); other plans
+    are decoded without writing anything next to them.
+    """
+    return create_img(path) if shared else decode_img(path)
+
+
+def render_job(job: LayerJob, params: HeatmapParams, regions: Sequence[Region],
+               with_stats: bool) -> Dict[str, Any]:
+    """
+    Runs in a worker process: computes a layer's field over its plan, blends
+    it like the heatmap endpoints and writes the image, then reduces the
+    same field to its coverage statistics.
+    """
+    start = time.perf_counter()
+    img = _load_plan(job.plan, job.shared)
+    field = compute_field(job.points, VALUE_FIELDS[job.kind], img.shape[:2], params.radius, params.sigma)
+    overlay = blend_heatmap(field, *value_range(job.kind, params), img, params.colormap, params.alpha)
+    job.output_path.parent.mkdir(parents=True, exist_ok=True)
+    if not cv2.imwrite(str(job.output_path), overlay):
+        raise IOError(f"cv2.imwrite failed to write {job.output_path}")
+
+    result: Dict[str, Any] = {"points": len(job.points)}
+    if with_stats:
+        result["stats"] = field_stats(field, job.kind, value_range(job.kind, params), regions=regions)
+    result["render_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def run_jobs(jobs: Sequence[LayerJob], params: HeatmapParams, regions: Sequence[Region], with_stats: bool,
+             processes: int) -> List[Dict[str, Any]]:
+    """
+    Renders the jobs, in `processes` worker processes (here when it is 1).
+    Returns one result per job, in job order; a failed layer gets an "error".
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+
+    def report(index: int, result: Dict[str, Any]) -> None:
+        results[index] = result
+        job = jobs[index]
+        status = f"error: {result['error']}" if "error" in result else f"{result['render_ms']:.0f} ms"
+        print(f"[{sum(r is not None for r in results)}/{len(jobs)}] {job.map_name} {job.kind} {job.key}: {status}",
+              file=sys.stderr)
+
+    if processes <= 1:
+        for index, job in enumerate(jobs):
+            try:
+                report(index, render_job(job, params, regions, with_stats))
+            except Exception as e:
+                report(index, {"error": str(e)})
+        return results
+
+    # "spawn" like the server's render pool; the largest layers start first
+    order = sorted(range(len(jobs)), key=lambda i: -len(jobs[i].points))
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(render_job, jobs[i], params, regions, with_stats): i for i in order}
+        for future in as_completed(futures):
+            try:
+                report(futures[future], future.result())
+            except Exception as e:
+                report(futures[future], {"error": str(e)})
+    return results
+
+
+def build_manifest(maps: Sequence[MapSurvey], jobs: Sequence[LayerJob], results: Sequence[Dict[str, Any]],
+                   output: Path, params: HeatmapParams, regions: Sequence[Region], processes: int,
+                   elapsed: float) -> Dict[str, Any]:
+    """Describes the run: parameters, and for each map its layers with their image and statistics."""
+    layers: Dict[str, List[Dict[str, Any]]] = {survey.name: [] for survey in maps}
+    for job, result in zip(jobs, results):
+        layer = {"kind": job.kind, "key": job.key}
+        if "error" not in result:
+            layer["file"] = job.output_path.relative_to(output).as_posix()
+        layer.update(result)
+        layers[job.map_name].append(layer)
+
+    return {
+        "created": int(time.time()),
+        "params": {"radius": params.radius, "sigma": params.sigma, "colormap": params.colormap,
+                   "alpha": params.alpha,
+                   "value_ranges": {kind: list(value_range(kind, params)) for kind in KINDS}},
+        "regions": [region._asdict() for region in regions],
+        "processes": processes,
+        "elapsed_s": round(elapsed, 3),
+        "layers": len(jobs),
+        "failed": sum("error" in result for result in results),
+        "maps": [
+            {"name": survey.name, "plan": str(survey.plan), "layers": layers[survey.name]}
+            for survey in maps
+        ],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Render every heatmap layer of a survey, without the server")
+    parser.add_argument("--output", type=Path, required=True, help="Directory of the images and manifest.json")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--data-dir", type=Path, help="Copy of the application's static directory")
+    source.add_argument("--survey", type=Path, help="Exported survey (.heatmap.gz bundle or JSON file)")
+    parser.add_argument("--plan", type=Path, help="Plan image the exported survey was made on")
+    parser.add_argument("--map", action="append", default=[], help="Only render this map (repeatable)")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="Only render this kind of layer (repeatable)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Number of render processes")
+    parser.add_argument("--format", choices=("png", "jpg"), default="png", help="Image format")
+    parser.add_argument("--colormap", choices=COLORMAPS, default="turbo")
+    parser.add_argument("--alpha", type=float, default=0.6, help="Weight of the heatmap in the blend")
+    parser.add_argument("--radius", type=int, default=RADIUS, help="Disk radius around each scan (px)")
+    parser.add_argument("--sigma", type=float, default=SIGMA, help="Gaussian blur standard deviation (px)")
+    parser.add_argument("--region", action="append", default=[], help="Statistics region [name:]x0,y0,x1,y1")
+    parser.add_argument("--no-stats", action="store_true", help="Skip the coverage statistics")
+    args = parser.parse_args()
+
+    if (args.survey is None) != (args.plan is None):
+        parser.error("--survey and --plan go together")
+    if args.survey and args.map:
+        parser.error("--map does not apply to --survey")
+    try:
+        params = HeatmapParams(radius=args.radius, sigma=args.sigma, colormap=args.colormap, alpha=args.alpha)
+        regions = [parse_region(text) for text in args.region]
+    except (ValidationError, ValueError) as e:
+        parser.error(str(e))
+
+    # 1. Read and validate the whole survey before rendering anything
+    try:
+        if args.survey:
+            maps = file_survey(args.survey, args.plan)
+        elif args.data_dir:
+            maps = dir_surveys(args.data_dir, args.map)
+        else:
+            maps = app_surveys(args.map)
+    except (OSError, ValueError) as e:  # BundleError and JSON errors are ValueErrors
+        print(f"Error reading the survey: {e}", file=sys.stderr)
+        return 2
+
+    # 2. Render the layers across the processes
+    args.output.mkdir(parents=True, exist_ok=True)
+    jobs = plan_jobs(maps, args.kind or KINDS, args.output, f".{args.format}")
+    processes = max(1, min(args.processes, len(jobs)))
+    start = time.perf_counter()
+    results = run_jobs(jobs, params, regions, not args.no_stats, processes)
+    elapsed = time.perf_counter() - start
+
+    # 3. Describe the run
+    manifest = build_manifest(maps, jobs, results, args.output, params, regions, processes, elapsed)
+    with open(args.output / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Rendered {manifest['layers'] - manifest['failed']} of {manifest['layers']} layers "
+          f"from {len(maps)} map(s) in {elapsed:.1f} s ({processes} processes)", file=sys.stderr)
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
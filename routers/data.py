@@ -1,5 +1,11 @@
-from fastapi import APIRouter, File, UploadFile
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, File, UploadFile, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from config import DATA_DIR, ARCHIVE_MAX_UPLOAD_SIZE
 from helpers.data_handler import load_data, send_data
+from helpers.archive_handler import ArchiveError, export_archive, read_manifest, import_archive
+from helpers.upload_handler import stream_to_temp, UploadTooLargeError
+from helpers.lock_handler import get_map_lock
 
 
 router = APIRouter(
@@ -8,18 +14,66 @@ router = APIRouter(
 )
 
 @router.post("/load/{map_name}")
-async def upload_data(map_name: str, file: UploadFile = File(...)):
+async def upload_data(map_name: str, file: UploadFile = File(...), merge: bool = False):
     """
-    Endpoint to upload a previously saved .json scan file.
+    Endpoint to upload a previously saved .json scan file or export bundle.
     Called by the "Load" button on the 'scans' page.
+
+    :param merge: Add the points to the existing survey instead of replacing it
     """
-    return load_data(map_name, file)
+    # Serialize with scans on the same map; the upload is streamed in a worker thread
+    async with get_map_lock(map_name):
+        return await run_in_threadpool(load_data, map_name, file, merge)
 
 
 @router.get("/save/{map_name}")
-async def save_data(map_name: str):
+async def save_data(map_name: str, format: str = "json"):
     """
-    Endpoint to download the current .json scan data.
+    Endpoint to download the current scan data.
     Called by the "Save" button on the 'scans' page.
+
+    :param format: "json" (signal data only) or "bundle" (compressed signal + channel data)
     """
-    return send_data(map_name)
\ No newline at end of file
+    # The survey is read under the map's file lock: wait for it in a worker thread
+    return await run_in_threadpool(send_data, map_name, format)
+
+
+@router.get("/archive")
+async def save_archive():
+    """
+    Endpoint to download every plan and its scan data as one zip archive,
+    streamed as it is built (e.g. to move a whole site to another machine).
+    """
+    return export_archive()
+
+
+@router.post("/archive")
+async def load_archive(file: UploadFile = File(...), replace: bool = False):
+    """
+    Endpoint to import an archive made by GET /archive.
+    Every member is checked against the manifest's SHA-256 before its map
+    is written, and maps are imported in parallel.
+
+    :param replace: Overwrite the maps that already exist instead of skipping them
+    """
+    # 1. Stream the upload to a temp file, bounded by ARCHIVE_MAX_UPLOAD_SIZE
+    try:
+        tmp_path, _ = await run_in_threadpool(stream_to_temp, file, DATA_DIR, ARCHIVE_MAX_UPLOAD_SIZE)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    try:
+        # 2. Validate the manifest against the archive's members
+        plans = await run_in_threadpool(read_manifest, tmp_path)
+
+        # 3. Import while holding the locks of every map in the archive
+        # (taken in name order, so two imports cannot deadlock)
+        async with AsyncExitStack() as stack:
+            for name in sorted(plans):
+                await stack.enter_async_context(get_map_lock(name))
+            return await run_in_threadpool(import_archive, tmp_path, plans, replace)
+    except ArchiveError as e:
+        print(f"Rejected archive: {e}")
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Request
-from helpers.html_handler import find_language
-from config import template
+from helpers.html_handler import render_page
 
 router = APIRouter(
     prefix="/help",
@@ -13,14 +12,6 @@ router = APIRouter(
 async def help(request: Request):
     """
     Serves the documentation page (help.html).
+    The page is static, so it is served from the rendered-page cache.
     """
-    lang, translations = find_language("help", request)
-
-    return template.TemplateResponse(
-        name="help.html",
-        context={
-            "request": request,
-            "translations": translations,
-            "current_lang": lang
-        }
-    )
\ No newline at end of file
+    return render_page("help", request)
\ No newline at end of file
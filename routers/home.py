@@ -1,6 +1,5 @@
 from fastapi import APIRouter, Request
-from config import template
-from helpers.html_handler import find_language
+from helpers.html_handler import render_page
 
 router = APIRouter(
     tags = ["Home"],
@@ -11,14 +10,6 @@ router = APIRouter(
 async def root(request: Request):
     """
     Serves the main homepage (home.html).
+    The page is static, so it is served from the rendered-page cache.
     """
-    lang, translations = find_language("home", request)
-
-    return template.TemplateResponse(
-        name="home.html",
-        context={
-            "request": request,
-            "translations": translations,
-            "current_lang": lang
-        }
-    )
\ No newline at end of file
+    return render_page("home", request)
\ No newline at end of file
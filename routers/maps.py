@@ -1,10 +1,23 @@
-from fastapi import APIRouter, Request, status, HTTPException
-from config import template
-from helpers.html_handler import find_language, list_map
+from fastapi import APIRouter, Request, Query, Header, Depends, status, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from config import template, HeatmapParams, RADIUS, SIGMA
+from pydantic import ValidationError
+from helpers.html_handler import find_language, list_map, render_page, maps_version
 from helpers.file_handler import find_map_url, find_map
-from helpers.data_handler import find_ssid_list, find_data_list, find_channel_list
-from helpers.heatmap_handler import draw_heatmap, channel_heatmap
+from helpers.data_handler import find_ssid_list, find_channel_list
+from helpers.heatmap_handler import draw_heatmap, channel_heatmap, ap_heatmap, aggregate_heatmap, value_range
+from helpers.flight_handler import RenderCancelled, RenderTicket, render_tickets
+from helpers.index_handler import query_point
+from helpers.stats_handler import layer_stats, parse_region, DEFAULT_BINS
+from helpers.contour_handler import layer_contours, to_geojson, to_svg, DEFAULT_EPSILON
+from helpers.grid_handler import layer_grid, colormap_tables, DEFAULT_GRID_SIZE, MAX_GRID_SIZE
+from helpers.session_handler import list_sessions
+from helpers.ap_handler import ap_summary
+from helpers.catalog_handler import map_catalog
 from urllib.parse import unquote
+from base64 import b64encode
+from typing import Any, Callable, Dict, List, Optional
 
 router = APIRouter(
     prefix="/maps",
@@ -13,21 +26,53 @@ router = APIRouter(
 )
 
 
+def heatmap_params(radius: int = RADIUS, sigma: float = SIGMA, min_value: Optional[float] = None,
+                   max_value: Optional[float] = None, colormap: str = "turbo",
+                   alpha: float = 0.6) -> HeatmapParams:
+    """
+    Dependency reading the optional rendering parameters from the query string.
+    """
+    try:
+        params = HeatmapParams(radius=radius, sigma=sigma, min_value=min_value,
+                               max_value=max_value, colormap=colormap, alpha=alpha)
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if min_value is not None and max_value is not None and max_value <= min_value:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="max_value must be greater than min_value")
+    return params
+
+
+async def render_ticket(x_render_client: Optional[str] = Header(None)) -> RenderTicket:
+    """
+    Dependency claiming the render ticket of a request. A page sending an
+    X-Render-Client id supersedes its own earlier renders, which then stop
+    before their expensive stages (see flight_handler).
+    Async, so tickets are claimed in the order the requests arrive.
+    """
+    return render_tickets.claim(x_render_client)
+
+
+async def run_render(func: Callable[..., Dict[str, Any]], *args: Any) -> Dict[str, Any]:
+    """Runs a render in a thread; a superseded render answers 409."""
+    try:
+        return await run_in_threadpool(func, *args)
+    except RenderCancelled as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
 @router.get("/")
 async def maps(request: Request):
     """
     Serves the main 'Maps' page (maps.html).
     This page lists all maps that have existing scan data.
+    It is only re-rendered when maps or scan data are added or removed.
     """
-    lang, translations = find_language("maps", request)
-    return template.TemplateResponse(
-        name="maps.html",
-        context={
-            "request": request,
-            "translations": translations,
-            "current_lang": lang,
-            "maps": list_map()  # Get list of maps *with data*
-        }
+    return render_page(
+        "maps", request,
+        version=maps_version(),
+        context=lambda: {"maps": list_map()}  # Get list of maps *with data*
     )
 
 
@@ -53,7 +98,12 @@ async def heatmaps(map_name: str, request: Request):
                 "translations": translations,
                 "current_lang": lang,
                 "ssid_band_list": ssid_band_list,  # Used by JS checklist
-                "channel_list": channel_list  # Used by JS checklist
+                "channel_list": channel_list,  # Used by JS checklist
+                # Color maps of the client-side rendering (the first call imports OpenCV)
+                "colormaps": await run_in_threadpool(colormap_tables),
+                "radius": RADIUS,
+                # Used by the session selector (reads the archives under the map's file lock)
+                "sessions": await run_in_threadpool(list_sessions, map_name)
             })
         # If no scan data exists for this map, raise 404
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
@@ -63,50 +113,258 @@ async def heatmaps(map_name: str, request: Request):
 
 
 @router.get("/{map_name}/signal/{ssid_band_key:path}")
-async def display(map_name: str, ssid_band_key: str):
+async def display(map_name: str, ssid_band_key: str, params: HeatmapParams = Depends(heatmap_params),
+                  ticket: RenderTicket = Depends(render_ticket)):
     """
     API endpoint that generates and returns a signal heatmap image.
     Called by JavaScript when a user selects an SSID from the checklist.
 
     :param map_name: The name of the map (e.g., "my_plan")
     :param ssid_band_key: The selected key (e.g., "MySSID [5GHz]")
+    :param params: Optional rendering parameters (radius, sigma, min_value,
+                   max_value, colormap, alpha)
     """
     # Decode URL-encoded characters (e.g., spaces, brackets)
     map_name = unquote(map_name)
     ssid_band_key = unquote(ssid_band_key)
 
-    # 1. Find the raw data points for this key
-    data = find_data_list(map_name, ssid_band_key, "signal")
-    # 2. Find the file path for the base map image
+    # 1. Find the file path for the base map image
     map_info = find_map(map_name)
 
     if not map_info:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
 
-    # 3. Generate the heatmap image and return it
-    return draw_heatmap(data, map_info)
+    # 2. Generate the heatmap image from the key's data and return it
+    # (in a thread, so other requests are served while it renders)
+    return await run_render(draw_heatmap, map_name, ssid_band_key, map_info, params, ticket)
 
 
 @router.get("/{map_name}/channel/{channel}")
-async def display(map_name: str, channel: str):
+async def display(map_name: str, channel: str, params: HeatmapParams = Depends(heatmap_params),
+                  ticket: RenderTicket = Depends(render_ticket)):
     """
     API endpoint that generates and returns a channel congestion heatmap image.
     Called by JavaScript when a user selects a Channel from the checklist.
 
     :param map_name: The name of the map (e.g., "my_plan")
     :param channel: The selected key (e.g., "Channel_6")
+    :param params: Optional rendering parameters (see the signal endpoint)
     """
     # Decode URL-encoded characters
     map_name = unquote(map_name)
     channel = unquote(channel)
 
-    # 1. Find the raw data points for this channel
-    data = find_data_list(map_name, channel, "channel")
-    # 2. Find the file path for the base map image
+    # 1. Find the file path for the base map image
     map_info = find_map(map_name)
 
     if not map_info:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
 
-    # 3. Generate the channel heatmap image and return it
-    return channel_heatmap(data, map_info)
\ No newline at end of file
+    # 2. Generate the channel heatmap image from the channel's data and return it
+    return await run_render(channel_heatmap, map_name, channel, map_info, params, ticket)
+
+
+@router.get("/{map_name}/aps")
+async def access_points(map_name: str):
+    """
+    Lists every access point (BSSID) seen by the scans of a map, with its
+    SSID key, number of samples, mean signal and the number of scans where
+    it was the strongest AP of its SSID.
+    """
+    if not find_map(map_name):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+    return await run_in_threadpool(ap_summary, map_name)
+
+
+@router.get("/{map_name}/ap/{bssid}")
+async def display(map_name: str, bssid: str, params: HeatmapParams = Depends(heatmap_params),
+                  ticket: RenderTicket = Depends(render_ticket)):
+    """
+    API endpoint that generates and returns the signal heatmap of one access point.
+
+    :param bssid: The BSSID of the access point (see /maps/{map_name}/aps)
+    :param params: Optional rendering parameters (see the signal endpoint)
+    """
+    map_name = unquote(map_name)
+    bssid = unquote(bssid)
+
+    map_info = find_map(map_name)
+    if not map_info:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+
+    return await run_render(ap_heatmap, map_name, bssid, map_info, params, ticket)
+
+
+@router.get("/{map_name}/aggregate/{mode}")
+async def aggregate(map_name: str, mode: str, keys: Optional[List[str]] = Query(None), threshold: float = -67,
+                    params: HeatmapParams = Depends(heatmap_params), ticket: RenderTicket = Depends(render_ticket)):
+    """
+    API endpoint that generates an aggregate heatmap over several layers.
+
+    :param mode: "best" (strongest signal across SSIDs), "threshold" (where the
+                 best signal reaches `threshold` dBm) or "congestion" (total AP
+                 count across channels)
+    :param keys: Layers to combine (repeat the parameter); all of them by default
+    :param threshold: Signal level (dBm) used by the "threshold" mode
+    :param params: Optional rendering parameters (see the signal endpoint)
+    """
+    if mode not in ("best", "threshold", "congestion"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown aggregate mode")
+
+    map_info = find_map(map_name)
+    if not map_info:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+
+    # Only combine layers that exist for this map
+    available = find_channel_list(map_name) if mode == "congestion" else find_ssid_list(map_name)
+    selected = [key for key in available if keys is None or key in keys]
+    if not selected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
+
+    result = await run_render(aggregate_heatmap, map_name, mode, selected, map_info, threshold, params, ticket)
+    return {**result, "keys": selected}
+
+
+@router.get("/{map_name}/query")
+async def query(map_name: str, x: int, y: int, layer: str, mode: str = "signal",
+                params: HeatmapParams = Depends(heatmap_params)):
+    """
+    API endpoint used by the hover tooltips of the heatmap page.
+    Returns the nearest measured point and the interpolated value at (x, y).
+
+    :param x: Pixel column on the plan image
+    :param y: Pixel row on the plan image
+    :param layer: The displayed key (e.g., "MySSID [5GHz]", "Channel_6" or a BSSID)
+    :param mode: "signal", "channel" or "ap"
+    :param params: Rendering parameters of the displayed heatmap (radius and sigma are used)
+    """
+    if mode not in ("signal", "channel", "ap"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown mode")
+
+    entry = map_catalog.get(map_name)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+
+    # The first query on a layer may compute its field: keep it off the event loop
+    return await run_in_threadpool(query_point, map_name, mode, layer, x, y,
+                                   (entry.height, entry.width), params.radius, params.sigma)
+
+
+@router.get("/{map_name}/stats/{layer:path}")
+async def stats(map_name: str, layer: str, mode: str = "signal",
+                threshold: Optional[List[float]] = Query(None), bins: int = DEFAULT_BINS,
+                region: Optional[List[str]] = Query(None), params: HeatmapParams = Depends(heatmap_params)):
+    """
+    API endpoint returning the coverage statistics of a layer, computed from
+    its (cached) field instead of rendering an image.
+
+    :param layer: The key (e.g., "MySSID [5GHz]", "Channel_6" or a BSSID)
+    :param mode: "signal", "channel" or "ap"
+    :param threshold: Values to report the coverage of (repeat the parameter),
+                      e.g. -67 for "share of the floor above -67 dBm"
+    :param bins: Number of histogram bins between min_value and max_value
+    :param region: Areas to summarize, as "x0,y0,x1,y1" or "name:x0,y0,x1,y1"
+                   in plan pixels (repeat the parameter)
+    :param params: Rendering parameters (radius and sigma shape the field,
+                   min_value and max_value bound the histogram)
+    """
+    if mode not in ("signal", "channel", "ap"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown mode")
+    if not 1 <= bins <= 256:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="bins must be between 1 and 256")
+    try:
+        regions = [parse_region(text) for text in region or []]
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    entry = map_catalog.get(map_name)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+    if mode != "ap" and layer not in (find_channel_list(map_name) if mode == "channel" else find_ssid_list(map_name)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
+
+    result = await run_in_threadpool(layer_stats, map_name, mode, layer, (entry.height, entry.width),
+                                     value_range(mode, params), threshold, bins, regions,
+                                     params.radius, params.sigma)
+    return {"layer": layer, "mode": mode, "width": entry.width, "height": entry.height, **result}
+
+
+@router.get("/{map_name}/contours/{layer:path}")
+async def contours(map_name: str, layer: str, mode: str = "signal", format: str = "geojson",
+                   threshold: Optional[List[float]] = Query(None), epsilon: float = DEFAULT_EPSILON,
+                   params: HeatmapParams = Depends(heatmap_params)):
+    """
+    API endpoint returning the iso-bands of a layer as vectors: for each
+    threshold, the areas at or above it, traced on the (cached) field.
+    A few KB instead of a rendered image, and sharp at any zoom.
+
+    :param layer: The key (e.g., "MySSID [5GHz]", "Channel_6" or a BSSID)
+    :param mode: "signal", "channel" or "ap"
+    :param format: "geojson" (MultiPolygons in plan pixels) or "svg" (overlay of the plan's size)
+    :param threshold: Levels to trace (repeat the parameter); -67, -70 and -80 dBm by default
+    :param epsilon: Simplification tolerance of the polygons, in pixels
+    :param params: Rendering parameters (radius and sigma shape the field, the
+                   color map and value range color the SVG paths)
+    """
+    if mode not in ("signal", "channel", "ap"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown mode")
+    if format not in ("geojson", "svg"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown format")
+    if not 0 <= epsilon <= 50:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="epsilon must be between 0 and 50")
+
+    entry = map_catalog.get(map_name)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+    if mode != "ap" and layer not in (find_channel_list(map_name) if mode == "channel" else find_ssid_list(map_name)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
+
+    shape = (entry.height, entry.width)
+    levels = await run_in_threadpool(layer_contours, map_name, mode, layer, shape, threshold, epsilon,
+                                     params.radius, params.sigma)
+    if format == "svg":
+        return Response(content=to_svg(levels, layer, shape, value_range(mode, params), params.colormap),
+                        media_type="image/svg+xml")
+    return JSONResponse(content=to_geojson(levels, layer, shape), media_type="application/geo+json")
+
+
+@router.get("/{map_name}/field/{layer:path}")
+async def field(map_name: str, layer: str, mode: str = "signal", size: int = DEFAULT_GRID_SIZE,
+                format: str = "json", params: HeatmapParams = Depends(heatmap_params),
+                ticket: RenderTicket = Depends(render_ticket)):
+    """
+    API endpoint returning a layer's field as a small quantized grid, so the
+    browser colors and blends it itself (see grid_handler.layer_grid).
+    Used by the heatmap page: only choosing another layer reaches the server.
+
+    :param layer: The key (e.g., "MySSID [5GHz]", "Channel_6" or a BSSID)
+    :param mode: "signal", "channel" or "ap"
+    :param size: Longest side of the grid, in cells
+    :param format: "json" (planes in base64) or "binary" (the value, intensity
+                   and coverage planes, with the metadata in X-Field-* headers)
+    :param params: Rendering parameters (radius and sigma shape the field,
+                   min_value and max_value set the quantized range)
+    """
+    if mode not in ("signal", "channel", "ap"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown mode")
+    if format not in ("json", "binary"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown format")
+    if not 16 <= size <= MAX_GRID_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"size must be between 16 and {MAX_GRID_SIZE}")
+
+    entry = map_catalog.get(map_name)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+    if mode != "ap" and layer not in (find_channel_list(map_name) if mode == "channel" else find_ssid_list(map_name)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Data not found")
+
+    grid = await run_render(layer_grid, map_name, mode, layer, (entry.height, entry.width),
+                            value_range(mode, params), size, params.radius, params.sigma, ticket)
+    if format == "binary":
+        headers = {f"X-Field-{name.capitalize()}": str(grid[name])
+                   for name in ("width", "height", "min", "max", "surveyed")}
+        return Response(content=grid["value"] + grid["intensity"] + grid["coverage"],
+                        media_type="application/octet-stream", headers=headers)
+    return {"layer": layer, "mode": mode, "plan_width": entry.width, "plan_height": entry.height,
+            **grid, **{plane: b64encode(grid[plane]).decode() for plane in ("value", "intensity", "coverage")}}
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Request, File, UploadFile
-from config import template
-from helpers.html_handler import generate_preview, find_language
+from fastapi.concurrency import run_in_threadpool
+from helpers.html_handler import generate_preview, render_page, maps_version
 from helpers.file_handler import load_file, delete_file
 
 router = APIRouter(
@@ -15,18 +15,12 @@ async def plans(request: Request):
     """
     Serves the 'Plans' page (plans.html).
     This page shows existing map previews and allows uploading new ones.
+    It is only re-rendered when the list of maps changes.
     """
-    # Get language and translation dictionary
-    lang, translations = find_language("plans", request)
-
-    return template.TemplateResponse(
-        name="plans.html",
-        context={
-            "request": request,
-            "maps": generate_preview(),  # Get list of all map images
-            "translations": translations,
-            "current_lang": lang
-        }
+    return render_page(
+        "plans", request,
+        version=maps_version(),
+        context=lambda: {"maps": generate_preview()}  # Get list of all map images
     )
 
 
@@ -38,7 +32,8 @@ async def upload_map(file: UploadFile = File(...)):
     """
     # Delegate file handling logic to the helper
     # Redirects back to /plans on success or failure
-    return load_file("/plans", file)
+    # (decoding and normalizing a large plan takes seconds, off the event loop)
+    return await run_in_threadpool(load_file, "/plans", file)
 
 
 @router.delete("/{map_name}")
@@ -48,4 +43,4 @@ async def delete_map(map_name: str):
     Called by the trash can icon on the 'Plans' page.
     """
     # Delegate deletion logic to the helper
-    return delete_file(map_name)
\ No newline at end of file
+    return await run_in_threadpool(delete_file, map_name)
\ No newline at end of file
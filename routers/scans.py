@@ -1,9 +1,14 @@
 from fastapi import APIRouter, Request, File, UploadFile, HTTPException, status
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from config import template, ClickPosition
-from helpers.html_handler import generate_preview, find_language
+from helpers.html_handler import generate_preview, find_language, render_page, maps_version
 from helpers.file_handler import load_file, find_map_url
-from helpers.data_handler import delete_json, update_json_with_scan
+from helpers.session_handler import switch_session, list_sessions
+from helpers.job_handler import scan_queue, ScanQueueFull
+from helpers.lock_handler import get_map_lock
+from helpers.catalog_handler import map_catalog
+from helpers.density_handler import sampling_density, DEFAULT_GAP_DISTANCE, DEFAULT_SUGGESTIONS
 
 router = APIRouter(
     prefix="/scans",
@@ -17,16 +22,12 @@ async def scans(request: Request):
     """
     Serves the 'Scans' page (scans.html).
     This page shows maps and allows starting a scan or uploading/downloading scan data.
+    It is only re-rendered when the list of maps changes.
     """
-    lang, translations = find_language("scans", request)
-    return template.TemplateResponse(
-        name="scans.html",
-        context={
-            "request": request,
-            "maps": generate_preview(),  # Get list of all map images
-            "translations": translations,
-            "current_lang": lang
-        }
+    return render_page(
+        "scans", request,
+        version=maps_version(),
+        context=lambda: {"maps": generate_preview()}  # Get list of all map images
     )
 
 
@@ -38,7 +39,8 @@ async def upload_map(file: UploadFile = File(...)):
     """
     # Delegate file handling logic to the helper
     # Redirects back to /scans on success or failure
-    return load_file("/scans", file)
+    # (decoding and normalizing a large plan takes seconds, off the event loop)
+    return await run_in_threadpool(load_file, "/scans", file)
 
 
 @router.get("/{map_name}", response_class=HTMLResponse)
@@ -46,11 +48,9 @@ async def load_scan(map_name: str, request: Request):
     """
     Serves the individual scan page (scan_map.html) for a specific map.
     This is where the user clicks to perform scans.
-    It deletes any previous (stale) JSON data for this map.
+    Opening it does not touch the map's data: the first scan starts a new
+    session and archives the previous survey (see update_scan).
     """
-    # Clear out old scan data before starting a new session
-    delete_json(map_name)
-
     lang, translations = find_language("scan_map", request)
     map_url = find_map_url(map_name)  # Find the /static/maps/... URL
 
@@ -67,14 +67,98 @@ async def load_scan(map_name: str, request: Request):
 
 
 @router.post("/{map_name}")
-async def update_scan(map_name: str, position: ClickPosition):
+async def update_scan(map_name: str, position: ClickPosition, new_session: bool = False):
     """
     Endpoint called when the user clicks on the map in scan_map.html.
-    It receives the (x, y) coordinates, performs a Wi-Fi scan,
-    and saves the data to the JSON files.
+    It queues a Wi-Fi scan at the (x, y) coordinates and returns its job at
+    once (HTTP 202). The scan runs when the interface is free, then its data
+    is saved to the map; progress is sent on /scans/{map_name}/events.
+
+    :param new_session: Sent with the first scan of the page: the previous
+                        survey is archived as a session before this scan is saved
+    """
+    try:
+        job = await scan_queue.submit(map_name, position.x, position.y, new_session)
+    except ScanQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+        "status": "queued", "job": job.event(),
+        "message": f"Queued scan for {map_name} at ({position.x}, {position.y})"})
+
+
+@router.get("/{map_name}/events")
+async def scan_events(map_name: str, request: Request):
+    """
+    Server-Sent Events stream of the map's scan jobs ("job" events with the
+    job's status: queued, scanning, saving, done or error).
+    """
+    return StreamingResponse(
+        scan_queue.events(map_name, request.is_disconnected),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/{map_name}/jobs/{job_id}")
+async def scan_job(map_name: str, job_id: str):
+    """
+    Returns the current state of a scan job (for clients without event streams).
+    """
+    job = await run_in_threadpool(scan_queue.get, job_id)
+    if job is None or job.map_name != map_name:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job.event()
+
+
+@router.get("/{map_name}/density")
+async def density(map_name: str, gap_distance: float = DEFAULT_GAP_DISTANCE,
+                  suggestions: int = DEFAULT_SUGGESTIONS):
+    """
+    Sampling density of the current survey: the share of the plan farther
+    than `gap_distance` pixels from every scan, an overlay of those gaps and
+    the suggested next scan positions. Refreshed by the scan page after each scan.
+
+    :param gap_distance: Distance (px of the plan) beyond which an area is a gap
+    :param suggestions: Maximum number of suggested positions
+    """
+    if not 1 <= gap_distance <= 10000:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="gap_distance must be between 1 and 10000")
+    if not 0 <= suggestions <= 20:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="suggestions must be between 0 and 20")
+
+    entry = map_catalog.get(map_name)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+    if not entry.width or not entry.height:
+        # The catalog could not read the plan's size
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Unreadable plan image")
+    return await run_in_threadpool(sampling_density, map_name, (entry.height, entry.width),
+                                   gap_distance, suggestions)
+
+
+@router.get("/{map_name}/sessions")
+async def sessions(map_name: str):
+    """
+    Lists the archived survey sessions of a map and the current one.
+    """
+    try:
+        return await run_in_threadpool(list_sessions, map_name)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Map not found")
+
+
+@router.post("/{map_name}/sessions/{session_id}")
+async def use_session(map_name: str, session_id: str):
+    """
+    Makes an archived session the map's current survey, so it is rendered
+    by the heatmap page. The replaced survey is archived, never lost.
     """
-    # Delegate the core scanning and data saving logic to the helper
-    update_json_with_scan(map_name, position.x, position.y)
+    async with get_map_lock(map_name):
+        switched = await run_in_threadpool(switch_session, map_name, session_id)
 
-    return JSONResponse(
-        content={"status": "success", "message": f"Added scan for {map_name} at ({position.x}, {position.y})"})
\ No newline at end of file
+    if not switched:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found")
+    return JSONResponse(content={"status": "success", "current": session_id})